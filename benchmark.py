@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""Time sxcv routines against straightforward reference implementations, so
+that the effects of optimizing them can be seen.  Each benchmark is run on
+random images of several sizes and the best of a few repetitions reported,
+along with the speedup over the reference.  Invoke as, for example:
+
+   python benchmark.py histogram
+
+or with no arguments to run every benchmark.
+"""
+
+#-------------------------------------------------------------------------------
+# Boilerplate.
+#-------------------------------------------------------------------------------
+
+import sys, argparse, time, tracemalloc
+import cv2
+import numpy, sxcv
+
+#-------------------------------------------------------------------------------
+# Reference implementations.
+#-------------------------------------------------------------------------------
+
+def histogram_loop (im):
+    "The original pixel-by-pixel implementation of sxcv.histogram."
+    # The original wrapped round to zero levels for uint8 images containing 255.
+    levels = int (sxcv.highest (im)) + 1
+    vals = numpy.array (range (levels), dtype=int)
+    if len (im.shape) == 2:
+        ny, nx = im.shape
+        hist = numpy.zeros (levels, dtype=int)
+        for y in range (0, ny):
+            for x in range (0, nx):
+                v = im[y,x]
+                hist[v] += 1
+    else:
+        ny, nx, nc = im.shape
+        hist = numpy.zeros ((nc,levels), dtype=int)
+        for c in range (0, nc):
+            for y in range (0, ny):
+                for x in range (0, nx):
+                    v = im[y,x,c]
+                    hist[c,v] += 1
+    return vals, hist
+
+
+def binarize_copy (im, threshold, below=0, above=255):
+    "The original copy-and-mask implementation of sxcv.binarize."
+    out = im.copy ()
+    out[im > threshold] = above
+    out[im <= threshold] = below
+    return out
+
+
+def linear_operation_float (im, a, b):
+    "The original float64 implementation of sxcv.linear_operation."
+    return (a * im + b).clip (0, 255).astype (numpy.uint8)
+
+
+def linear_blend_float (im, im2, a):
+    "The original float64 implementation of sxcv.linear_blend."
+    return ((1 - a) * im + a * im2).clip (0, 255).astype (numpy.uint8)
+
+#-------------------------------------------------------------------------------
+# Support routines.
+#-------------------------------------------------------------------------------
+
+def best_time (func, *args, repeats=3):
+    "Return the shortest time in seconds taken by func(*args)."
+    best = None
+    for r in range (0, repeats):
+        start = time.perf_counter ()
+        func (*args)
+        t = time.perf_counter () - start
+        if best is None or t < best: best = t
+    return best
+
+
+def allocated (func, *args):
+    "Return the peak number of bytes allocated by func(*args)."
+    tracemalloc.start ()
+    func (*args)
+    peak = tracemalloc.get_traced_memory ()[1]
+    tracemalloc.stop ()
+    return peak
+
+
+def random_image (ny, nx, nc=0, dtype=numpy.uint8):
+    "Return an image of random values covering the range of `dtype`."
+    shape = (ny, nx) if nc == 0 else (ny, nx, nc)
+    rng = numpy.random.default_rng (316)
+    if numpy.issubdtype (dtype, numpy.integer):
+        hi = numpy.iinfo (dtype).max
+        return rng.integers (0, hi, size=shape, endpoint=True, dtype=dtype)
+    return rng.random (shape).astype (dtype)
+
+
+def report (name, size, new, old=None):
+    "Print a line of benchmark output."
+    line = "%-36s %11s %10.2f ms" % (name, size, new * 1000)
+    if old is not None:
+        line += " %10.2f ms %8.1fx" % (old * 1000, old / new)
+    print (line)
+
+#-------------------------------------------------------------------------------
+# Benchmarks.
+#-------------------------------------------------------------------------------
+
+def bench_histogram (sizes):
+    "Vectorized histogram versus the original loops."
+    for n in sizes:
+        for nc, dtype in [(0, numpy.uint8), (3, numpy.uint8),
+                          (0, numpy.uint16), (3, numpy.float32)]:
+            im = random_image (n, n, nc, dtype)
+            name = "histogram %s x%d" % (numpy.dtype (dtype).name, max (nc, 1))
+            new = best_time (sxcv.histogram, im)
+            # The loops are far too slow to run on big images, and they cannot
+            # handle floating-point ones at all.
+            old = None
+            if n <= 512 and dtype != numpy.float32:
+                old = best_time (histogram_loop, im, repeats=1)
+            report (name, "%dx%d" % (n, n), new, old)
+
+
+def bench_convolution (sizes):
+    "Automatically-chosen convolution method versus applying the full kernel."
+    rng = numpy.random.default_rng (866)
+    kernels = [(name, sxcv.create_mask (name), "reflect101")
+               for name in ("blur5", "gaussian5", "sobelx", "laplacian")]
+    kernels += [("random15 wrap", rng.random ((15, 15)), "wrap"),
+                ("random41 wrap", rng.random ((41, 41)), "wrap")]
+    for n in sizes:
+        im = random_image (n, n)
+        for name, k, padding in kernels:
+            method = sxcv.convolution_method (im.shape, k, padding)
+            new = best_time (sxcv.convolution, im, k, padding, method)
+            old = best_time (sxcv.convolution, im, k, padding, "direct")
+            report ("convolution %s (%s)" % (name, method), "%dx%d" % (n, n),
+                    new, old)
+
+
+def smooth_sobel_passes (im):
+    "Gaussian smoothing then Sobel derivatives as separate filter2D passes."
+    g = cv2.filter2D (im, cv2.CV_32F, sxcv.create_mask ("gaussian5"))
+    gx = cv2.filter2D (g, cv2.CV_32F, sxcv.create_mask ("sobelx"))
+    gy = cv2.filter2D (g, cv2.CV_32F, sxcv.create_mask ("sobely"))
+    return gx, gy
+
+
+def bench_pipeline (sizes):
+    "Fused, buffer-reusing filter pipelines versus separate filter2D passes."
+    dx = sxcv.FilterPipeline (["gaussian5", "sobelx"])
+    dy = sxcv.FilterPipeline (["gaussian5", "sobely"])
+    def pipelines (im):
+        return dx (im), dy (im)
+    for n in sizes:
+        im = random_image (n, n)
+        pipelines (im)
+        new = best_time (pipelines, im)
+        old = best_time (smooth_sobel_passes, im)
+        mb = "%.1f/%.1f MB" % (allocated (pipelines, im) / 1.0e6,
+                               allocated (smooth_sobel_passes, im) / 1.0e6)
+        report ("pipeline smooth+sobel " + mb, "%dx%d" % (n, n), new, old)
+
+
+def bench_pointops (sizes):
+    "uint8 fast paths of point operations versus the original float versions."
+    for n in sizes:
+        im = random_image (n, n, 3)
+        im2 = random_image (n, n, 3)[::-1].copy ()
+        out = numpy.empty_like (im)
+        cases = [
+            ("binarize", (sxcv.binarize, im, 100, 0, 255, out),
+                         (binarize_copy, im, 100, 0, 255)),
+            ("linear_operation", (sxcv.linear_operation, im, 1.9, -127, out),
+                                 (linear_operation_float, im, 1.9, -127)),
+            ("linear_blend", (sxcv.linear_blend, im, im2, 0.6, out),
+                             (linear_blend_float, im, im2, 0.6)),
+        ]
+        for name, new, old in cases:
+            mb = "%.1f/%.1f MB" % (allocated (*new) / 1.0e6,
+                                   allocated (*old) / 1.0e6)
+            report ("%s %s" % (name, mb), "%dx%d" % (n, n),
+                    best_time (*new), best_time (*old))
+
+
+def chained_point_operations (im):
+    "Five point operations applied one after another."
+    im = sxcv.linear_operation (im, 1.9, -127)
+    im = 255 - im
+    im = sxcv.gamma_lut (0.8) (im)
+    im = sxcv.linear_operation (im, 0.9, 10)
+    return sxcv.binarize (im, 100)
+
+
+def bench_lut (sizes):
+    "Five point operations composed into one lookup table versus one by one."
+    def composed (im):
+        lut = sxcv.compose_luts (sxcv.linear_lut (1.9, -127),
+                                 sxcv.invert_lut (), sxcv.gamma_lut (0.8),
+                                 sxcv.linear_lut (0.9, 10),
+                                 sxcv.threshold_lut (100))
+        return lut (im)
+    single = sxcv.linear_lut (1.9, -127)
+    for n in sizes:
+        im = random_image (n, n, 3)
+        assert numpy.array_equal (composed (im), chained_point_operations (im))
+        report ("lut five composed ops", "%dx%d" % (n, n), best_time (composed, im),
+                best_time (chained_point_operations, im))
+        report ("lut one op", "%dx%d" % (n, n), best_time (single, im))
+
+
+def contour_loop (contours):
+    "Features of each contour in turn, as the programs used to do."
+    return [(cv2.contourArea (c), cv2.arcLength (c, True), cv2.boundingRect (c),
+             cv2.moments (c), cv2.contourArea (cv2.convexHull (c)),
+             cv2.minAreaRect (c)) for c in contours]
+
+
+def stretch_numpy (im, low=1.0, high=99.0):
+    "Percentile contrast stretching with numpy.percentile and float arithmetic."
+    lo, hi = numpy.percentile (im, [low, high])
+    return ((im - lo) * (255.0 / (hi - lo))).clip (0, 255).astype (numpy.uint8)
+
+
+def bench_batch (sizes):
+    "A batch of 100 images in one call versus one call per image."
+    for n in sizes:
+        if n > 512:
+            continue
+        ims = random_image (100 * n, n, 3).reshape (100, n, n, 3)
+        ims2 = random_image (100 * n, n, 3).reshape (100, n, n, 3)
+        size = "100x%dx%d" % (n, n)
+        loop = lambda func, *args: [func (im, *args) for im in ims]
+        report ("batch binarize", size, best_time (sxcv.binarize, ims, 100),
+                best_time (loop, sxcv.binarize, 100))
+        report ("batch linear_blend", size,
+                best_time (sxcv.linear_blend, ims, ims2, 0.25),
+                best_time (lambda: [sxcv.linear_blend (im, im2, 0.25)
+                                    for im, im2 in zip (ims, ims2)]))
+        report ("batch stats", size, best_time (sxcv.stats, ims),
+                best_time (loop, sxcv.stats))
+        report ("batch histogram", size, best_time (sxcv.histogram, ims),
+                best_time (loop, sxcv.histogram))
+
+
+def bench_contrast (sizes):
+    "Histogram-driven contrast operators versus numpy and OpenCV versions."
+    for n in sizes:
+        im = cv2.GaussianBlur (random_image (n, n), (0, 0), 5)
+        size = "%dx%d" % (n, n)
+        report ("equalize", size, best_time (sxcv.equalize, im),
+                best_time (cv2.equalizeHist, im))
+        report ("stretch", size, best_time (sxcv.stretch, im),
+                best_time (stretch_numpy, im))
+        report ("clahe 8x8 tiles", size, best_time (sxcv.clahe, im),
+                best_time (cv2.createCLAHE (2.0, (8, 8)).apply, im))
+
+
+def bench_contours (sizes):
+    "Batched contour features versus calling OpenCV on each contour."
+    for n in sizes:
+        bim = sxcv.binarize (random_image (n, n), 180)
+        contours, _ = cv2.findContours (bim, cv2.RETR_EXTERNAL,
+                                        cv2.CHAIN_APPROX_SIMPLE)
+        size = "%dx%d" % (n, n)
+        name = "contour_features %d" % len (contours)
+        report (name, size, best_time (sxcv.contour_features, contours),
+                best_time (contour_loop, contours))
+        report (name + " no hulls", size,
+                best_time (sxcv.contour_features, contours, False))
+
+
+def stats_numpy (im):
+    "The statistics returned by sxcv.stats, a pass for each with numpy."
+    planes = [im[:,:,c] for c in range (0, im.shape[2])]
+    return [(p.min (), p.max (), p.argmin (), p.argmax (), p.mean (), p.var ())
+            for p in planes]
+
+
+def bench_stats (sizes):
+    "Summary statistics from OpenCV versus a numpy pass for each."
+    for n in sizes:
+        for nc, dtype in [(1, numpy.uint8), (3, numpy.uint8),
+                          (1, numpy.float32)]:
+            im = random_image (n, n, nc, dtype)
+            name = "stats %s x%d" % (numpy.dtype (dtype).name, nc)
+            report (name, "%dx%d" % (n, n), best_time (sxcv.stats, im),
+                    best_time (stats_numpy, im))
+
+
+def sixel_img2sixel (im, levels):
+    "The original implementation of sxcv.display_sixel, minus the display."
+    import tempfile, subprocess, os
+    fn = tempfile.NamedTemporaryFile (suffix=".png").name
+    cv2.imwrite (fn, im)
+    subprocess.run (["img2sixel", "-p", str (levels), fn],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.remove (fn)
+
+
+def bench_sixel (sizes):
+    "In-process sixel encoding versus writing a PNG and running img2sixel."
+    import shutil
+    have_img2sixel = shutil.which ("img2sixel") is not None
+    for n in sizes:
+        # A smooth image, like most that get displayed, rather than noise.
+        im = cv2.GaussianBlur (random_image (n, n, 3), (0, 0), max (2, n / 64))
+        im = cv2.normalize (im, None, 0, 255, cv2.NORM_MINMAX)
+        grey = cv2.cvtColor (im, cv2.COLOR_BGR2GRAY)
+        for levels in (16, 256):
+            palette = sxcv.sixel_palette (im, levels)
+            cases = [("sixel grey %d" % levels, grey, None),
+                     ("sixel colour %d" % levels, im, None),
+                     ("sixel colour %d cached" % levels, im, palette)]
+            for name, image, pal in cases:
+                old = None
+                if have_img2sixel:
+                    old = best_time (sixel_img2sixel, image, levels)
+                report (name, "%dx%d" % (n, n),
+                        best_time (sxcv.sixel_encode, image, levels, pal), old)
+
+
+def bench_display (sizes):
+    "Processing loop with asynchronous debug displays versus synchronous ones."
+    import io, contextlib, tempfile, shutil
+    sxcv.debug_on ()
+    sxcv.ENVIRONMENT += ["sixel16"]
+    def loop (im, frames=20):
+        for f in range (0, frames):
+            im = cv2.GaussianBlur (im, (5, 5), 0)
+            sxcv.ddisplay (im, "frame")
+    for n in sizes:
+        im = random_image (n, n, 3)
+        with contextlib.redirect_stdout (io.StringIO ()):
+            old = best_time (loop, im)
+            queue = sxcv.async_display ("drop_oldest")
+            new = best_time (loop, im)
+            sxcv.async_display (None)
+        report ("display 20 frames, %d dropped" % queue.dropped,
+                "%dx%d" % (n, n), new, old)
+        where = tempfile.mkdtemp ()
+        sink = sxcv.debug_sink (where)
+        new = best_time (loop, im)
+        sxcv.debug_sink (None)
+        shutil.rmtree (where)
+        report ("sink 20 frames, %d dropped" % sink.queue.dropped,
+                "%dx%d" % (n, n), new, old)
+    sxcv.ENVIRONMENT.remove ("sixel16")
+    sxcv.debug_off ()
+
+
+def bench_tiled (sizes):
+    "Strips processed in parallel by sxcv.tiled versus the whole image at once."
+    k = numpy.ones ((9, 9), numpy.uint8)
+    smooth_dx = sxcv.FilterPipeline (["gaussian5", "sobelx"])
+    for n in sizes:
+        im = random_image (n, n)
+        bim = sxcv.binarize (im, 128)
+        size = "%dx%d" % (n, n)
+        report ("tiled 9x9 open", size,
+                best_time (sxcv.tiled_morphology, bim, cv2.MORPH_OPEN, k),
+                best_time (cv2.morphologyEx, bim, cv2.MORPH_OPEN, k))
+        out = numpy.empty ((n, n), numpy.float32)
+        report ("tiled gaussian5+sobelx pipeline", size,
+                best_time (lambda: sxcv.tiled (smooth_dx, im, out=out)),
+                best_time (smooth_dx, im, out))
+        report ("tiled lut", size,
+                best_time (sxcv.tiled, sxcv.invert_lut (), im),
+                best_time (sxcv.invert_lut (), im))
+
+
+def bench_packed (sizes):
+    "Bit-packed binary images versus one byte per pixel."
+    k = numpy.ones ((9, 9), numpy.uint8)
+    for n in sizes:
+        bim = sxcv.binarize (cv2.GaussianBlur (random_image (n, n), (0, 0), 3),
+                             128)
+        bim2 = bim[::-1].copy ()
+        p, p2 = sxcv.PackedBinary (bim), sxcv.PackedBinary (bim2)
+        size = "%dx%d" % (n, n)
+        report ("packed 9x9 open", size, best_time (p.open, k),
+                best_time (cv2.morphologyEx, bim, cv2.MORPH_OPEN, k))
+        report ("packed and", size, best_time (lambda: p & p2),
+                best_time (cv2.bitwise_and, bim, bim2))
+        report ("packed area", size, best_time (p.area),
+                best_time (cv2.countNonZero, bim))
+        report ("packed pack+unpack", size,
+                best_time (lambda: sxcv.PackedBinary (bim).unpack ()))
+
+
+BENCHMARKS = {
+    "batch": bench_batch,
+    "contours": bench_contours,
+    "contrast": bench_contrast,
+    "convolution": bench_convolution,
+    "display": bench_display,
+    "histogram": bench_histogram,
+    "lut": bench_lut,
+    "packed": bench_packed,
+    "pipeline": bench_pipeline,
+    "pointops": bench_pointops,
+    "sixel": bench_sixel,
+    "stats": bench_stats,
+    "tiled": bench_tiled,
+}
+
+#-------------------------------------------------------------------------------
+# Main program.
+#-------------------------------------------------------------------------------
+
+clp = argparse.ArgumentParser (description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+clp.add_argument ("-sizes", default="64,256,512,1024,4096",
+                  help="comma-separated list of image sizes to use")
+clp.add_argument ("benchmarks", nargs="*", default=sorted (BENCHMARKS),
+                  help="the benchmarks to run (default: all)")
+args = clp.parse_args()
+sizes = [int (s) for s in args.sizes.split (",")]
+
+print ("%-36s %11s %13s %13s %9s" % ("benchmark", "size", "time",
+                                      "reference", "speedup"))
+for b in args.benchmarks:
+    if b not in BENCHMARKS:
+        print ("Unknown benchmark '%s'" % b, file=sys.stderr)
+        exit (1)
+    BENCHMARKS[b] (sizes)
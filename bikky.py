@@ -24,16 +24,17 @@ def process_biscuit (fn, gt, display, threshold=100, mask_size=9):
     True, output information and display the result."""
 
     # Read in the image and binarize it.
-    im = cv2.imread (fn, cv2.IMREAD_GRAYSCALE)
+    im = sxcv.imread (fn, cv2.IMREAD_GRAYSCALE)
     if im is None:
         print ("Cannot read " + fn, file=sys.stderr)
         exit (2)
     bim = sxcv.binarize (im, threshold, 0, 255)
 
-    # Tidy up the binary image by deleting small regions and filling in gaps.
+    # Tidy up the binary image by deleting small regions and filling in gaps,
+    # a strip at a time on all the processors.
     kernel = numpy.ones ((mask_size, mask_size), numpy.uint8)
-    bim = cv2.morphologyEx (bim, cv2.MORPH_OPEN, kernel)
-    bim = cv2.morphologyEx (bim, cv2.MORPH_CLOSE, kernel)
+    bim = sxcv.tiled_morphology (bim, cv2.MORPH_OPEN, kernel)
+    bim = sxcv.tiled_morphology (bim, cv2.MORPH_CLOSE, kernel)
 
     # Find contours and print them out.
     contours, _ = cv2.findContours (bim, cv2.RETR_EXTERNAL,
@@ -48,7 +49,9 @@ def process_biscuit (fn, gt, display, threshold=100, mask_size=9):
     print ("result %s %s S %s" % (fn, gt, outcome))
 
     if display:
-        # Write the outcome on the image.
+        # Write the outcome on a copy of the image, as those returned by
+        # sxcv.imread are read-only.
+        im = im.copy ()
         cv2.putText (im, outcome, (10, 45), cv2.FONT_HERSHEY_SIMPLEX, 1,
                      (255,255,255), 2, cv2.LINE_AA)
         # Draw the contours on the image and display the result.
@@ -52,14 +52,6 @@ def draw_contour_centres (canvas, centres, colour, shape="+"):
             cv2.line (canvas, (xlo, yhi), (xhi, ylo), colour)
 
 
-def find_contour_centre (c):
-    "Return the centre of the contour."
-    x, y, w, h = cv2.boundingRect (c)
-    cx = x + w // 2
-    cy = y + h // 2
-    return cx, cy
-
-
 def nearby (cx, cy, centres, threshold=10):
     # Look at all the other centres.
     dist_thresh = threshold**2
@@ -144,7 +136,7 @@ else:
 # Having done all the preparation, we can now work through the images.
 for fn in args.files:
     # Read in the image.
-    im = cv2.imread (fn)
+    im = sxcv.imread (fn)
     if im is None:
         print ("Cannot read " + fn, file=sys.stderr)
         exit (1)
@@ -204,17 +196,20 @@ for fn in args.files:
                                         cv2.CHAIN_APPROX_SIMPLE)
 
         # Make sure the contours we find are in the allowed size range and
-        # are not too close to each other.
+        # are not too close to each other.  The features of all the contours
+        # are calculated in one go, so only those of the right size need to
+        # be looked at individually.
+        features = sxcv.contour_features (contours, hulls=False)
+        area = features["area"]
+        bbox = features["bbox"][(area >= args.minarea) & (area <= args.maxarea)]
         valid_centres = []
-        for c in contours:
-            a = cv2.contourArea (c)
-            if a >= args.minarea and a <= args.maxarea:
-                cx, cy = find_contour_centre (c)
-                centres = selected_centres + deleted_centres + valid_centres
-                if nearby (cx, cy, selected_centres): continue
-                if nearby (cx, cy, deleted_centres): continue
-                if nearby (cx, cy, valid_centres): continue
-                valid_centres += [[cx, cy]]
+        for x, y, w, h in bbox.tolist ():
+            cx = x + w // 2
+            cy = y + h // 2
+            if nearby (cx, cy, selected_centres): continue
+            if nearby (cx, cy, deleted_centres): continue
+            if nearby (cx, cy, valid_centres): continue
+            valid_centres += [[cx, cy]]
 
         # Draw the remaining contour centres onto a copy of the image.
         draw_contour_centres (canvas, valid_centres, black)
@@ -12,9 +12,11 @@ Usage:
 
     fact execute <test-file>
     fact run     <test-file>
+    fact -j 8 execute <test-file>
 
     fact vary "<par>=<val>,<val>"...  <test-file>
     fact roc  "<par>=<val>,<val>"...  <test-file>
+    fact -j 8 vary "<par>=<val>,<val>" "<par>=<val>,<val>"  <test-file>
 
     fact optimise "<par>=<min>,<max>"...  <test-file>
     fact optimize "<par>=<min>,<max>"...  <test-file>
@@ -25,6 +27,17 @@ Usage:
     fact anal    <transcript>
 
     fact compare <transcript> <transcript>...
+
+    fact -c <cache-file> execute <test-file>
+    fact -c <cache-file> cache stats
+    fact -c <cache-file> cache prune [<days>]
+    fact -c <cache-file> cache clear
+
+A cached result is re-used while the interface module, any module it
+imports from its own directory or the working directory (such as sxcv.py),
+the test's input file and the parameter values are all unchanged.  Other
+changes, such as to installed packages or to files that a test reads
+other than its input, are not noticed: use "cache clear" after them.
 '''
 
 #-----------------------------------------------------------------------------
@@ -231,120 +244,211 @@ review_header = 'No Tests  Class'
 #-----------------------------------------------------------------------------
 def analyse (resfile, fmt, detail=2):
     '''Analyse a file of results.'''
-    # Load the file and set things up.  Then branch according to the type of
-    # tests defined by the script that generated the results.
-    content = load_script (resfile, reportnargs, extension='.res')
-    type = content['transcript_begin'][0][2]
+    # Start reading the file and set things up.  Then branch according to
+    # the type of tests defined by the script that generated the results,
+    # which are counted as they are read rather than being held in memory.
+    begin, results = stream_transcript (resfile)
+    type = begin[2]
     if type == 'label':
-        classes, rates = error_rates (content['result'])
+        counts = tally (results)
+        classes, rates = error_rates (None, counts)
         print(format_error_rates (classes, rates, fmt, resfile, detail))
-        ccm, exp, act = confusion_matrix (content['result'])
+        ccm, exp, act = confusion_matrix (None, counts)
         print(format_confusion_matrix (ccm, exp, act, fmt, resfile, detail))
     else:
         print('Unknown experiment type of "' + type + '".', file=sys.stderr)
 
+#-----------------------------------------------------------------------------
+def cache_key (cache, iface, test, table):
+    '''Work out the key under which the result of running test with the
+    parameter values in table is cached'''
+    # A result depends on the interface module, the test's name and input,
+    # the content of the input if it is a file, and the parameter values.
+    # Files are hashed via hash_file, which remembers the hashes of files
+    # that haven't changed.
+    import hashlib
+    fields = [interface_hash (cache, iface), test[0], test[1],
+              hash_file (cache, test[1]), repr (sorted (table.items ()))]
+    return hashlib.sha1 ('\0'.join (fields).encode ()).hexdigest ()
+
+#-----------------------------------------------------------------------------
+def cache_lookup (cache, keys):
+    '''Return a dictionary of those results in cache whose keys are in
+    keys, marking them as having been used now'''
+    db = cache['db']
+    found = {}
+    keys = list (set (keys))
+    for i in range (0, len (keys), 500):
+        chunk = keys[i:i+500]
+        marks = ','.join ('?' * len (chunk))
+        for k, s, a, output in db.execute ('SELECT key, status, actual, ' +
+            'output FROM results WHERE key IN (' + marks + ')', chunk):
+            found[k] = (s, a, output)
+    db.executemany ('UPDATE results SET used=? WHERE key=?',
+                    [(time.time (), k) for k in found])
+    return found
+
+#-----------------------------------------------------------------------------
+def cache_prune (cache, days=None):
+    '''Delete results that haven't been used for days, or if days is None
+    those produced by interface modules other than the current one, from
+    cache, returning the number deleted'''
+    db = cache['db']
+    if days is None:
+        n = db.execute ('DELETE FROM results WHERE interface!=?',
+                        (cache['interface'],)).rowcount
+    else:
+        n = db.execute ('DELETE FROM results WHERE used<?',
+                        (time.time () - days * 86400,)).rowcount
+    gone = [(p,) for p, in db.execute ('SELECT path FROM files')
+            if not os.path.exists (p)]
+    db.executemany ('DELETE FROM files WHERE path=?', gone)
+    db.commit ()
+    db.execute ('VACUUM')
+    return n
+
+#-----------------------------------------------------------------------------
+def cache_stats (cache):
+    '''Return a description of the content of cache and how well it has
+    been used in this run'''
+    db = cache['db']
+    n, ni, oldest, newest = db.execute ('SELECT COUNT(*), ' +
+        'COUNT(DISTINCT interface), MIN(used), MAX(used) ' +
+        'FROM results').fetchone ()
+    nf, = db.execute ('SELECT COUNT(*) FROM files').fetchone ()
+    text = 'Cache %s: %d results from %d interfaces, %d files, %d bytes\n' % \
+        (cache['filename'], n, ni, nf, os.path.getsize (cache['filename']))
+    if n > 0:
+        text += 'Results last used between %s and %s\n' % \
+            (time.ctime (oldest), time.ctime (newest))
+    if cache['hits'] + cache['misses'] > 0:
+        text += 'This run: %d hits, %d misses\n' % \
+            (cache['hits'], cache['misses'])
+    return text[:-1]
+
+#-----------------------------------------------------------------------------
+def cache_store (cache, key, status, actual, output):
+    '''Save the result of a test in cache under key'''
+    cache['db'].execute ('INSERT OR REPLACE INTO results ' +
+                         'VALUES (?,?,?,?,?,?)',
+        (key, cache['interface'], status, str (actual), output, time.time ()))
+
 #-----------------------------------------------------------------------------
 def compare (transcripts, fmt, detail=2):
     '''Compare a set of transcripts'''
-    # Load the transcript files and ensure they were all generated from the
-    # same test script.
-    tscripts = []
+    # Start reading the transcript files and ensure they were all generated
+    # from the same test script.
+    import itertools
+    streams = []
     s1 = v1 = None
     for file in transcripts:
-        t = load_script (file, reportnargs, extension='.res')
+        begin, results = stream_transcript (file)
         if s1 is None:
-            s1 = t['transcript_begin'][0][0]
-            v1 = t['transcript_begin'][0][1]
+            s1 = begin[0]
+            v1 = begin[1]
         else:
-            s2 = t['transcript_begin'][0][0]
-            v2 = t['transcript_begin'][0][1]
+            s2 = begin[0]
+            v2 = begin[1]
             if s1 != s2 or v1 != v2:
                 print('Script or version mismatch between', \
                     transcripts[0], 'and', file, file=sys.stderr)
                 exit (1)
-        tscripts.append (t)
+        streams.append (results)
 
-    # Identify the various classes of result.
+    # Read the results of the tests from all the transcripts in step,
+    # identifying the various classes of result and accumulating the counts
+    # for McNemar's formula for each pair of transcripts, for each class and
+    # overall, as we go.
     c = {}
-    for ts in tscripts:
-        for t in ts['result']:
+    pairs = [(s1, s2) for s1 in range (0, len (streams))
+             for s2 in range (s1+1, len (streams))]
+    counts = [{} for p in pairs]
+    overall = [[0, 0, 0, 0] for p in pairs]
+    for rs in itertools.zip_longest (*streams):
+        assert None not in rs
+        for t in rs:
             c[t[1]] = 1
             c[t[3]] = 1
+        for (s1, s2), cn, on in zip (pairs, counts, overall):
+            r1 = rs[s1]
+            r2 = rs[s2]
+            k = 2 * sf (r1[1], r1[3]) + sf (r2[1], r2[3])
+            on[k] += 1
+            for e in {r1[1], r2[1]}:
+                if e not in cn: cn[e] = [0, 0, 0, 0]
+                cn[e][k] += 1
     classes = sorted (c.keys())
 
-    # Now cycle through the transcripts, in each case comparing the various
-    # tests via McNemar's formula.
-    n = len (tscripts[0]['result'])
+    # Now cycle through the pairs of transcripts, in each case comparing the
+    # various tests via McNemar's formula.
     results = {}
-    for s1 in range(0, len(tscripts)):
-        for s2 in range(s1+1, len(tscripts)):
-            if s1 == s2: continue
-            r1 = tscripts[s1]['result']
-            r2 = tscripts[s2]['result']
-            assert len (r1) == len (r2)
-            for c in classes:
-                results[c] = mcnemar (r1, r2, c)
-            results['overall'] = mcnemar (r1, r2, None)
-            print(format_comparison (transcripts[s1], transcripts[s2],
-                                     classes, results, fmt, detail))
-
-#-----------------------------------------------------------------------------
-def confusion_matrix (results):
-    '''Work out and return the class confusion matrix'''
+    for (s1, s2), cn, on in zip (pairs, counts, overall):
+        for c in classes:
+            Nff, Nfs, Nsf, Nss = cn.get (c, [0, 0, 0, 0])
+            results[c] = mcnemar_score (Nsf, Nfs)
+        Nff, Nfs, Nsf, Nss = on
+        results['overall'] = mcnemar_score (Nsf, Nfs)
+        print(format_comparison (transcripts[s1], transcripts[s2],
+                                 classes, results, fmt, detail))
+
+#-----------------------------------------------------------------------------
+def confusion_matrix (results, counts=None):
+    '''Work out and return the class confusion matrix, from counts if they
+    have already been made by tally'''
+    if counts is None: counts = tally (results)
     ccmdata = {}    # indexed by "expected,actual"
     expnames = {}   # expected class names
     actnames = {}   # actual class names
 
-    # Gather up the results in a dictionary, finding the expected and
+    # Gather up the counts in a dictionary, finding the expected and
     # actual class names as we do it.
-    for t in results:
-        name, expected, status, actual = t
+    for (expected, status, actual), n in counts.items ():
         expnames[expected] = 1
         actnames[actual] = 1
         k = expected + ',' + actual
         if k not in ccmdata: ccmdata[k] = 0
-        ccmdata[k] += 1
+        ccmdata[k] += n
     return ccmdata, expnames, actnames
 
 #-----------------------------------------------------------------------------
-def error_rates (results):
-    '''Calculate the error rates from the results in the transcript'''
+def error_rates (results, counts=None):
+    '''Calculate the error rates from the results in the transcript, or from
+    counts if they have already been made by tally'''
+    if counts is None: counts = tally (results)
+
     # Identify the various classes of result.
     c = {}
-    for t in results:
-        c[t[1]] = 1
-        c[t[3]] = 1
+    for e, s, a in counts:
+        c[e] = 1
+        c[a] = 1
     classes = sorted (c.keys())
 
     # Work out and report the number of TPs etc for each class and overall.
     count = {}
+    for c in classes:
+        count[c] = {'n': 0, 'TP': 0, 'TN': 0, 'FP': 0, 'FN': 0}
+    for (e, s, a), n in counts.items ():
+        count[e][outcome (e, s, a)] += n
+        count[e]['n'] += n
     mat = {}
     ttp = ttn = tfp = tfn = tn = 0
     for c in classes:
-        n = 0
-        count['TP'] = count['FP'] = count['TN'] = count['FN'] = 0
-        for t in results:
-            if t[1] == c:
-                r = outcome (t[1], t[2], t[3])
-                count[r] += 1
-                n += 1
-            a, r, p, s = measures (count['TP'], count['TN'],
-                                        count['FP'], count['FN'], n)
-            mat[c] = [n, count['TP'], count['TN'], count['FP'], \
-                          count['FN'], a, r, p, s]
-
-        ttp += count['TP']
-        ttn += count['TN']
-        tfp += count['FP']
-        tfn += count['FN']
-        tn  += n
+        k = count[c]
+        a, r, p, s = measures (k['TP'], k['TN'], k['FP'], k['FN'], k['n'])
+        mat[c] = [k['n'], k['TP'], k['TN'], k['FP'], k['FN'], a, r, p, s]
+        ttp += k['TP']
+        ttn += k['TN']
+        tfp += k['FP']
+        tfn += k['FN']
+        tn  += k['n']
     a, r, p, s = measures (ttp, ttn, tfp, tfn, tn)
     mat['overall'] = [tn, ttp, ttn, tfp, tfn, a, r, p, s]
     return classes, mat
 
 #-----------------------------------------------------------------------------
-def execute (script, iface, printres):
-    '''Carry out the tests in script'''
+def execute (script, iface, printres, jobs=1, cache=None):
+    '''Carry out the tests in script, sharing them among jobs processes and
+    using the results in cache where possible'''
     import datetime, time
 
     # Load the test script and do any checking of it that we can.
@@ -361,15 +465,21 @@ def execute (script, iface, printres):
             content['type'][0], datetime.datetime.now ())
         start = time.time ()
 
-    # Do the actual tests and output what happened to the transcript.
+    # Do the actual tests and output what happened to the transcript.  When
+    # there are several jobs, the tests are shared among worker processes;
+    # anything a test prints is captured and output along with its result,
+    # and the results are output in the order of the script, so that the
+    # transcript is the same as when the tests are run one after another.
+    # Tests whose results are in the cache, if there is one, are not re-run.
+    table = globals().get ('symtab', {})
+    pool = start_pool (iface, jobs)
     results = []
-    for t in content['test']:
-        s, a = run_test (iface, t[0], t[1], t[2])
-        if s: st = 'S'
-        else: st = 'F'
-        results.append ([t[0], t[2], st, a])
-        if printres: print('result', t[0], t[2], st, a)
-    
+    for r in run_pairs (pool, iface, [(t, table) for t in content['test']],
+                        jobs, cache):
+        results.append (r)
+        if printres: print('result', *r)
+    if pool is not None: pool.shutdown ()
+
     # Stop the run timer and output the end-of-transcript message, then
     # return the results we've collected.
     if printres:
@@ -571,12 +681,103 @@ def format_table (data, fmt='latex', coltitles=False, rowtitles=False,
 
     return text
 
+#-----------------------------------------------------------------------------
+def format_sweep (settings, variation, fmt):
+    '''Format the overall error rates of a parameter sweep as a table, which
+    contains the data for ROC, precision-recall and sensitivity-specificity
+    curves'''
+    data = [['tests', 'TP', 'TN', 'FP', 'FN', 'accuracy', 'recall',
+             'precision', 'specificity']]
+    labels = ['']
+    for table, rates in zip (settings, variation):
+        labels.append (','.join ('%s=%s' % kv for kv in table.items ()))
+        data.append (['%d' % r for r in rates[:5]] +
+                     ['%.2f' % r for r in rates[5:]])
+    width = max (len (l) for l in labels) + 2
+    return format_table ([[l] + row for l, row in zip (labels, data)], fmt,
+                         coltitles=True, rowtitles=True, datafmt='%12s',
+                         colfmt='%12s', rowfmt='%-' + str (width) + 's',
+                         rowtitle='setting', caption='Parameter sweep')
+
+#-----------------------------------------------------------------------------
+def format_trace (trace, best, rates, fmt):
+    '''Format the trace of an optimisation and its best setting as a table'''
+    data = [['', 'round', 'tests', 'accuracy']]
+    for rnd, n, a, table in trace:
+        data.append ([','.join ('%s=%s' % kv for kv in table.items ()),
+                      '%d' % rnd, '%d' % n, '%.2f' % a])
+    width = max (len (row[0]) for row in data) + 2
+    text = format_table (data, fmt, coltitles=True, rowtitles=True,
+                         datafmt='%10s', colfmt='%10s',
+                         rowfmt='%-' + str (width) + 's', rowtitle='setting',
+                         caption='Optimisation trace')
+    return text + '\nBest setting ' + \
+        ','.join ('%s=%s' % kv for kv in best.items ()) + \
+        ' with accuracy %.2f on %d tests' % (rates[5], rates[0])
+
+#-----------------------------------------------------------------------------
+def hash_file (cache, fn):
+    '''Return a hash of the content of the file fn, or an empty string if
+    there is no such file, re-reading it only if it has changed'''
+    import hashlib
+    if not os.path.isfile (fn): return ''
+    path = os.path.abspath (fn)
+    st = os.stat (path)
+    db = cache['db']
+    row = db.execute ('SELECT hash FROM files WHERE path=? AND size=? ' +
+                      'AND mtime=?',
+                      (path, st.st_size, st.st_mtime_ns)).fetchone ()
+    if row is not None: return row[0]
+    h = hashlib.sha1 ()
+    with open (path, 'rb') as f:
+        for block in iter (lambda: f.read (1 << 20), b''):
+            h.update (block)
+    h = h.hexdigest ()
+    db.execute ('INSERT OR REPLACE INTO files VALUES (?,?,?,?)',
+                (path, st.st_size, st.st_mtime_ns, h))
+    return h
+
 #-----------------------------------------------------------------------------
 def help ():
     """Print out the program's help string and exit"""
     print(__doc__, file=sys.stderr)
     exit (1)
 
+#-----------------------------------------------------------------------------
+def init_worker (interface):
+    '''Prepare a worker process to run tests for execute or sweep'''
+    global worker_interface
+    worker_interface = load_interface (interface)
+
+#-----------------------------------------------------------------------------
+def interface_hash (cache, iface):
+    '''Return a hash of the source of the interface module iface and of the
+    modules it has imported from its own directory or the working directory,
+    which becomes the current interface of cache'''
+    # Editing a module that the interface wraps, such as sxcv.py, has to
+    # invalidate its results just as editing the interface itself does.
+    # Modules that are imported only once a test is running are not seen,
+    # and nor are changes to installed packages.
+    import hashlib
+    if iface.__name__ not in cache['modules']:
+        main = os.path.abspath (iface.__file__)
+        dirs = {os.path.dirname (main), os.path.abspath (os.getcwd ())}
+        files = {main}
+        for m in list (sys.modules.values ()):
+            fn = getattr (m, '__file__', None)
+            if fn is None or not fn.endswith ('.py'): continue
+            fn = os.path.abspath (fn)
+            if 'site-packages' in fn.split (os.sep): continue
+            if any (fn.startswith (d + os.sep) for d in dirs):
+                files.add (fn)
+        h = hashlib.sha1 ()
+        for fn in sorted (files, key=os.path.basename):
+            with open (fn, 'rb') as f:
+                h.update (os.path.basename (fn).encode () + b'\0' + f.read ())
+        cache['modules'][iface.__name__] = h.hexdigest ()
+    cache['interface'] = cache['modules'][iface.__name__]
+    return cache['interface']
+
 #-----------------------------------------------------------------------------
 def list_to_string (l, delim=' '):
     "Convert a list of words to a string, with each word separated by delim."
@@ -597,21 +798,7 @@ def load_script (script, nargs, extension='.fact'):
     is an element in that list for each time 'verb' appeared in the file, and
     each element will itself be a list if the 'verb' takes several arguments.
     """
-    # Put the default extension in place if there isn't one.
-    root, ext = os.path.splitext (script)
-    if ext == '': name = script + extension
-    else: name = script
-
-    # We read the script's content differently if it's a file or a URL.
-    if name[0:7] == 'http://':               # It's a URL
-        import urllib.request, urllib.error, urllib.parse, string
-        f = urllib.request.urlopen(name)
-        lines = string.split (f.read(), '\n')
-    else:                                      # It's a file
-        f = open (name, 'r')
-        lines = f.read().split('\n')
-    f.close ()
-    return parse_file (lines, nargs)
+    return parse_file (read_lines (script, extension), nargs)
 
 #-----------------------------------------------------------------------------
 def load_interface (interface):
@@ -636,7 +823,13 @@ def mcnemar (r1, r2, c):
             elif s1 and not s2: Nsf += 1
             elif not s1 and s2: Nfs += 1
             else:               Nff += 1
+    return mcnemar_score (Nsf, Nfs)
 
+#-----------------------------------------------------------------------------
+def mcnemar_score (Nsf, Nfs):
+    """Return the Z-score of McNemar's test, signed to indicate which set of
+    results was better, from the numbers of tests that succeeded in only
+    the first set and only the second."""
     if Nsf + Nfs <= 0:
         z = 0.0
     else:
@@ -663,6 +856,91 @@ def measures (tp, tn, fp, fn, n):
     else: s = tn / (tn + fp + 0.0)
     return a, r, p, s
 
+#-----------------------------------------------------------------------------
+def open_cache (filename):
+    '''Open the SQLite database filename that holds cached test results,
+    creating it if necessary'''
+    import sqlite3
+    db = sqlite3.connect (filename)
+    db.execute ('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, ' +
+                'interface TEXT, status TEXT, actual TEXT, output TEXT, ' +
+                'used REAL)')
+    db.execute ('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, ' +
+                'size INTEGER, mtime INTEGER, hash TEXT)')
+    return {'db': db, 'filename': filename, 'modules': {},
+            'interface': None, 'hits': 0, 'misses': 0}
+
+#-----------------------------------------------------------------------------
+def optimise (script, iface, ranges, jobs=1, points=5, eta=3, rounds=3,
+              least=10, cache=None):
+    '''Search for the values of the parameters in ranges that give the
+    highest overall accuracy on the tests in script, returning the best
+    setting found, its error rates and a trace of every evaluation'''
+    # Each round lays a grid of points values across the range of every
+    # parameter and whittles the combinations down by successive halving:
+    # all of them are run on a small subset of the tests, the best 1/eta of
+    # them go on to eta times as many tests, and so on until the survivors
+    # have been run on every test.  The first subset has at least least
+    # tests, as accuracies measured on only a handful are mostly ties.  The
+    # next round then zooms in on the best setting so far with a finer
+    # grid.  Results are remembered, so a setting that survives a rung is
+    # run only on the tests it hasn't seen.
+    import random, itertools
+    content = load_script (script, scriptnargs)
+    tests = content['test'][:]
+    random.Random (0).shuffle (tests)   # so subsets mix the classes
+    nt = len (tests)
+    pool = start_pool (iface, jobs)
+    done = {}     # results so far, indexed by setting
+    trace = []
+    best = None
+    for rnd in range (1, rounds+1):
+        axes = []
+        for param, lo, hi, integer in ranges:
+            vals = [lo + (hi - lo) * i / (points - 1) for i in range (points)]
+            if integer: vals = sorted (set (int (round (v)) for v in vals))
+            axes.append ([(param, ('%d' if integer else '%g') % v)
+                          for v in vals])
+        survivors = [tuple (combo) for combo in itertools.product (*axes)]
+        rungs = math.ceil (math.log (len (survivors), eta)) \
+                if len (survivors) > 1 else 0
+        n = min (nt, max (least, nt // eta ** rungs))
+        while True:
+            pairs = []
+            for key in survivors:
+                if key not in done: done[key] = []
+                table = dict (key)
+                pairs += [(t, table) for t in tests[len (done[key]):n]]
+            results = iter (list (run_pairs (pool, iface, pairs, jobs,
+                                             cache)))
+            for key in survivors:
+                while len (done[key]) < n: done[key].append (next (results))
+            scores = []
+            for key in survivors:
+                classes, rates = error_rates (done[key][:n])
+                scores.append ((rates['overall'][5], key, rates['overall']))
+                trace.append ([rnd, n, rates['overall'][5], dict (key)])
+            scores.sort (key=lambda x: -x[0])   # stable, so ties keep order
+            if n >= nt: break
+            survivors = [key for a, key, r in
+                         scores[:max (1, math.ceil (len (scores) / eta))]]
+            n = min (nt, n * eta)
+        if best is None or scores[0][0] > best[0]: best = scores[0]
+
+        # Zoom in on the best setting, stopping when the grid gets no finer.
+        table = dict (best[1])
+        narrower = []
+        for param, lo, hi, integer in ranges:
+            step = (hi - lo) / (points - 1)
+            if integer: step = max (1, math.ceil (step))
+            v = float (table[param])
+            narrower.append ((param, max (lo, v - step), min (hi, v + step),
+                              integer))
+        if narrower == ranges: break
+        ranges = narrower
+    if pool is not None: pool.shutdown ()
+    return dict (best[1]), best[2], trace
+
 #-----------------------------------------------------------------------------
 def outcome (expected, status, actual):
     '''Determine whether a test resulted in a TP etc'''
@@ -674,22 +952,68 @@ def outcome (expected, status, actual):
         else:                  result = 'FN'
     return result
 
+#-----------------------------------------------------------------------------
+def parse_grid (specs):
+    '''Turn a list of "<par>=<val>,<val>..." specifications into a list of
+    symbol tables, one for every combination of the values'''
+    import itertools
+    params = []
+    values = []
+    for spec in specs:
+        param, valstring = spec.split ('=', 1)
+        params.append (param)
+        values.append (valstring.split (','))
+    return [dict (zip (params, combo))
+            for combo in itertools.product (*values)]
+
+#-----------------------------------------------------------------------------
+def parse_ranges (specs):
+    '''Turn a list of "<par>=<min>,<max>" specifications into a list of
+    (parameter, min, max, integer) tuples, integer being True when both
+    limits are integers'''
+    ranges = []
+    for spec in specs:
+        param, valstring = spec.split ('=', 1)
+        lo, hi = valstring.split (',')
+        integer = lo.lstrip ('+-').isdigit () and hi.lstrip ('+-').isdigit ()
+        lo, hi = float (lo), float (hi)
+        if lo > hi: lo, hi = hi, lo
+        ranges.append ((param, lo, hi, integer))
+    return ranges
+
 #-----------------------------------------------------------------------------
 def parse_file (lines, nargs):
     """
-    Parse the contents of a list of lines that conforms to the FACT syntax.
-    Each line starts with a 'verb' which contains a number of arguments; the
-    number is given in the dictionary argument 'nargs'.  Lines may be
-    continued onto further physical lines by making the last character of each
-    line but the final one a backslash character.  (Most of the complexity in
-    the routine is due to the support for continuation lines.)  Blank lines
-    and lines whose first non-whitespace character is a hash are ignored.
+    Parse the contents of a list of lines that conforms to the FACT syntax,
+    as described under parse_lines.
 
     We return a dictionary, indexed by 'verb', whose content is a list; there
     is an element in that list for each time 'verb' appeared in the file, and
     each element will itself be a list if the 'verb' takes several arguments.
     """
     content = {}
+    for verb, rest in parse_lines (lines, nargs):
+        if verb in content:
+            content[verb].append (rest)
+        else:
+            content[verb] = []
+            content[verb].append (rest)
+    return content
+
+#-----------------------------------------------------------------------------
+def parse_lines (lines, nargs):
+    """
+    Parse lines that conform to the FACT syntax, yielding a (verb, arguments)
+    pair for each statement as soon as it has been read.  Each line starts
+    with a 'verb' which contains a number of arguments; the number is given
+    in the dictionary argument 'nargs'.  Lines may be continued onto further
+    physical lines by making the last character of each line but the final
+    one a backslash character.  (Most of the complexity in the routine is
+    due to the support for continuation lines.)  Blank lines and lines whose
+    first non-whitespace character is a hash are ignored.
+
+    The arguments are a list if the 'verb' takes several of them.
+    """
     delim = None
     append = False
     verb = ''
@@ -716,27 +1040,59 @@ def parse_file (lines, nargs):
             append = True
             rest = rest[:-1]
         else:
-            # We are finally able to store this line (possibly after it has
-            # been continued).  Split it into the right number of words, make
-            # sure the entry in the dictionary is a list-head, and append the
-            # arguments to the list.
+            # We are finally able to pass on this line (possibly after it has
+            # been continued), split into the right number of words.
             if nargs[verb] > 1: rest = rest.split (delim, nargs[verb]-1)
-            if verb in content:
-                content[verb].append (rest)
-            else:
-                content[verb] = []
-                content[verb].append (rest)
-    return content
+            yield verb, rest
+
+#-----------------------------------------------------------------------------
+def read_lines (script, extension='.fact'):
+    '''Yield the lines of the file or URL 'script' one at a time, without
+    their line terminators'''
+    # Put the default extension in place if there isn't one.
+    root, ext = os.path.splitext (script)
+    if ext == '': name = script + extension
+    else: name = script
+
+    # We read the script's content differently if it's a file or a URL.
+    # Either way, the lines are those that splitting the whole content at
+    # newlines would give, including the empty one after a final newline.
+    if name[0:7] == 'http://':               # It's a URL
+        import urllib.request, io
+        f = io.TextIOWrapper (urllib.request.urlopen (name))
+    else:                                      # It's a file
+        f = open (name, 'r')
+    with f:
+        line = ''
+        for line in f:
+            if line[-1:] == '\n': yield line[:-1]
+            else: yield line
+        if line[-1:] == '\n' or line == '': yield ''
 
 #-----------------------------------------------------------------------------
 def review (script):
     '''Review the tests in a test script'''
     text = ''
     fmt = '%7s:  %s\n'
-    # Load the test script and do any checking of it that we can.
-    content = load_script (script, scriptnargs)
+    # Read the test script, keeping everything but the tests themselves and
+    # seeing how many times each class is tested for as we go.
+    content = {}
+    classes = {}
+    classes['failure'] = 0
+    na = 0
+    for verb, rest in parse_lines (read_lines (script), scriptnargs):
+        if verb == 'test':
+            na += 1
+            k = rest[2]
+            if k not in classes: classes[k] = 1
+            else:  classes[k] += 1
+        elif verb in content:
+            content[verb].append (rest)
+        else:
+            content[verb] = [rest]
+
+    # Do any checking of the script that we can.
     nt = int (content['tests'][0])
-    na = len (content['test'])
     if nt != na:
         print('Warning: script identifies', nt, \
             'tests but there are actually %d.' % na, file=sys.stderr)
@@ -749,14 +1105,6 @@ def review (script):
     text += (fmt % ('Version', content['version'][0]))
     text += (fmt % ('Purpose', content['purpose'][0]))
 
-    # Walk through the tests and see how many times each class is tested for.
-    classes = {}
-    classes['failure'] = 0
-    for t in content['test']:
-        k = t[2]
-        if k not in classes: classes[k] = 1
-        else:  classes[k] += 1
-
     # Produce a table of the class occupancy.
     ckeys = sorted (classes.keys())
     ckeys.append ('Total')
@@ -771,6 +1119,63 @@ def run_test (interface, name, input, expected):
     '''Run a single test and determine whether it yielded a TP etc'''
     return interface.interface (name, input)
 
+#-----------------------------------------------------------------------------
+def run_captured (job, interface=None):
+    '''Run a test, normally in a worker process, with the parameter values
+    in a symbol table, returning its outcome and anything that it printed'''
+    import io, contextlib
+    global symtab
+    test, symtab = job
+    if interface is None: interface = worker_interface
+    buffer = io.StringIO ()
+    with contextlib.redirect_stdout (buffer):
+        s, a = run_test (interface, test[0], test[1], test[2])
+    return s, a, buffer.getvalue ()
+
+#-----------------------------------------------------------------------------
+def run_pairs (pool, iface, pairs, jobs=1, cache=None):
+    '''Run each (test, symbol table) pair, in the jobs worker processes of
+    pool if there is one, yielding their results in order; pairs whose
+    results are in cache are not run again'''
+    # With a cache, only the pairs whose results aren't in it are run, and
+    # anything they print is captured so that it can be replayed later.
+    if cache is not None:
+        keys = [cache_key (cache, iface, t, table) for t, table in pairs]
+        found = cache_lookup (cache, keys)
+        todo = [p for p, k in zip (pairs, keys) if k not in found]
+    else:
+        keys = [None] * len (pairs)
+        found = {}
+        todo = pairs
+    if pool is not None:
+        chunk = max (1, len (todo) // (4 * jobs))
+        outcomes = pool.map (run_captured, todo, chunksize=chunk)
+    else:
+        def run_serial (pair):
+            global symtab
+            if cache is not None: return run_captured (pair, iface)
+            t, symtab = pair
+            return (*run_test (iface, t[0], t[1], t[2]), None)
+        outcomes = map (run_serial, todo)
+
+    stored = 0
+    for (t, table), k in zip (pairs, keys):
+        if k in found:
+            st, a, output = found[k]
+        else:
+            s, a, output = next (outcomes)
+            st = 'S' if s else 'F'
+            if cache is not None:
+                cache_store (cache, k, st, a, output)
+                stored += 1
+                if stored % 1000 == 0: cache['db'].commit ()
+        if output: sys.stdout.write (output)
+        yield [t[0], t[2], st, a]
+    if cache is not None:
+        cache['db'].commit ()
+        cache['hits'] += len (found)
+        cache['misses'] += len (todo)
+
 #-----------------------------------------------------------------------------
 def sf (e, a):
     if a == 'F':
@@ -781,6 +1186,70 @@ def sf (e, a):
         s = False
     return s
 
+#-----------------------------------------------------------------------------
+def start_pool (iface, jobs):
+    '''Start the worker processes for running tests, if there are to be
+    several jobs'''
+    if jobs <= 1: return None
+    import concurrent.futures
+    return concurrent.futures.ProcessPoolExecutor (jobs,
+        initializer=init_worker, initargs=(iface.__name__,))
+
+#-----------------------------------------------------------------------------
+def stream_transcript (resfile):
+    '''Start reading the transcript resfile, returning the arguments of its
+    transcript_begin line and a generator of its results'''
+    # The transcript_begin line is normally the first, so only a few lines
+    # need be read to find it; the results are then read as they are needed.
+    import itertools
+    records = parse_lines (read_lines (resfile, '.res'), reportnargs)
+    head = []
+    begin = None
+    for verb, rest in records:
+        head.append ((verb, rest))
+        if verb == 'transcript_begin':
+            begin = rest
+            break
+    if begin is None:
+        raise KeyError ('transcript_begin')
+    results = (rest for verb, rest in itertools.chain (head, records)
+               if verb == 'result')
+    return begin, results
+
+#-----------------------------------------------------------------------------
+def sweep (script, iface, settings, jobs=1, cache=None):
+    '''Run the tests in script once for each setting, a dictionary of
+    parameter values, returning the overall error rates of each'''
+    # Every test is run for every setting, with the pairs shared among
+    # worker processes when there are several jobs.  The pairs are sent out
+    # one setting after another and come back in the same order, so the
+    # error rates for each setting are worked out as soon as its last test
+    # is done, and the results of only one setting need be held at a time.
+    content = load_script (script, scriptnargs)
+    tests = content['test']
+    pairs = [(t, table) for table in settings for t in tests]
+    pool = start_pool (iface, jobs)
+    variation = []
+    results = []
+    for r in run_pairs (pool, iface, pairs, jobs, cache):
+        results.append (r)
+        if len (results) == len (tests):
+            classes, rates = error_rates (results)
+            variation.append (rates['overall'][:])
+            results = []
+    if pool is not None: pool.shutdown ()
+    return variation
+
+#-----------------------------------------------------------------------------
+def tally (results):
+    '''Count the occurrences of each (expected, status, actual) triple in
+    results'''
+    # There are at most a couple of triples per pair of classes, however
+    # many results there are, so error_rates and confusion_matrix work from
+    # these counts, made in a single pass, rather than the results.
+    import collections, operator
+    return collections.Counter (map (operator.itemgetter (1, 2, 3), results))
+
 #-----------------------------------------------------------------------------
 def valof (symbol, default):
     '''Return the value of 'symbol' from our symbol table'''
@@ -849,6 +1318,12 @@ the context of computer vision.''')
                        help='output format')
     parser.add_option ('-i', '--interface', dest='interface',
                        default='interface', help='name of interface module')
+    parser.add_option ('-j', '--jobs', dest='jobs', type='int',
+                       default=1, help='number of tests to run at once')
+    parser.add_option ('-c', '--cache', dest='cache', default=None,
+                       help='file in which to cache test results; clear' +
+                       ' it after changing anything but the interface and' +
+                       ' local modules it imports')
     (options, args) = parser.parse_args()
 
     # Ensure everything is defined.
@@ -856,6 +1331,16 @@ the context of computer vision.''')
         print('FACT version', timestamp[13:-1])
         exit (1)
     symtab = {}
+    cache = open_cache (options.cache) if options.cache else None
+    if cache is not None:
+        # Say how well the cache worked, away from the results, even if
+        # the user leaves while the curves of a sweep are being plotted.
+        import atexit
+        def report_cache ():
+            if cache['hits'] + cache['misses'] > 0:
+                print('Cache: %d hits, %d misses' %
+                      (cache['hits'], cache['misses']), file=sys.stderr)
+        atexit.register (report_cache)
 
     # Generate the preamble for the chosen format, if required.
     if options.head: print(preamble[options.format])
@@ -872,6 +1357,25 @@ the context of computer vision.''')
         transcript = args[1]
         analyse (args[1], options.format, options.detail)
 
+    elif task == 'cache':
+        if nargs < 2 or cache is None: help ()
+        if args[1] == 'stats':
+            print(cache_stats (cache))
+        elif args[1] == 'prune':
+            if nargs > 2:
+                n = cache_prune (cache, float (args[2]))
+            else:
+                interface_hash (cache, load_interface (options.interface))
+                n = cache_prune (cache)
+            print('Pruned', n, 'results from', options.cache)
+        elif args[1] == 'clear':
+            cache['db'].execute ('DELETE FROM results')
+            cache['db'].execute ('DELETE FROM files')
+            cache['db'].commit ()
+            cache['db'].execute ('VACUUM')
+        else:
+            help ()
+
     elif task == 'compare' or task == 'comp':
         if nargs < 3: help ()
         compare (args[1:], options.format, options.detail)
@@ -879,7 +1383,7 @@ the context of computer vision.''')
     elif task == 'execute' or task == 'run':
         if nargs != 2: help ()
         iface = load_interface (options.interface)
-        execute (args[1], iface, True)
+        execute (args[1], iface, True, options.jobs, cache)
 
     elif task == 'help':
         help ()
@@ -890,38 +1394,34 @@ the context of computer vision.''')
 
     elif task == 'optimise' or task == 'optimize' or task == 'opt':
         if nargs < 3: help ()
-        # Process the tuning parameters.
-        opts = args[1:-1]
-        for opt in opts:
-            param,valstring = opt.split('=', 1)
-            vals = valstring.split(',')
+        # Process the tuning parameters, then search within their ranges for
+        # the values that give the best accuracy.
+        ranges = parse_ranges (args[1:-1])
         iface = load_interface (options.interface)
-        print('Processing script', args[-1])
+        best, rates, trace = optimise (args[-1], iface, ranges, options.jobs,
+                                       cache=cache)
+        print(format_trace (trace, best, rates, options.format))
 
     elif task == 'vary' or task == 'roc':
         if nargs < 3: help ()
-        # Process the tuning parameters.
-        param,valstring = args[1].split('=', 1)
-        vals = valstring.split(',')
-        # Load the interface file and carry out the various runs,
-        # saving the results for later.
+        # Process the tuning parameters, of which there may be several, in
+        # which case every combination of their values is tried.  Then load
+        # the interface file and carry out all the runs in one go.
+        settings = parse_grid (args[1:-1])
         iface = load_interface (options.interface)
-        variation = {}
-        for v in vals:
-            symtab[param] = v
-            results = execute (args[2], iface, False)
-            classes, rates = error_rates (results)
-            variation[v] = rates['overall'][:]
+        variation = sweep (args[-1], iface, settings, options.jobs, cache)
 
-        # Finally, generate the output.
+        # Finally, generate the output: a table holding the data for all
+        # the curves, then the curves themselves.
+        print(format_sweep (settings, variation, options.format))
         x = []; y = []; pre = []; rec = []; sens = []; spec = []
-        for v in vals:
-            x.append (variation[v][3])
-            y.append (variation[v][1])
-            pre.append (variation[v][7])
-            rec.append (variation[v][6])
-            sens.append (variation[v][6])   # same as recall
-            spec.append (variation[v][8])
+        for rates in variation:
+            x.append (rates[3])
+            y.append (rates[1])
+            pre.append (rates[7])
+            rec.append (rates[6])
+            sens.append (rates[6])   # same as recall
+            spec.append (rates[8])
         plot (x, y, 'ROC Curve', 'false positives', 'true positives')
         plot (pre, rec, 'Precision-Recall Curve', 'precision', 'recall')
         plot (sens, spec, 'Sensitivity-Specificity Curve',\
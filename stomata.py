@@ -19,8 +19,10 @@ def get_centres(filename):
     return points
         
 def load_img(filename):
-    image = cv2.imread(FILENAME+'.jpg')
-    g_im = cv2.imread(FILENAME+'.jpg',cv2.IMREAD_GRAYSCALE)
+    # The greyscale image is derived from the cached colour one rather than
+    # decoding the file again.
+    image = sxcv.imread(FILENAME+'.jpg')
+    g_im = sxcv.imread(FILENAME+'.jpg',cv2.IMREAD_GRAYSCALE)
     neg_im = 255-g_im
     return image, g_im, neg_im
     
@@ -32,34 +34,43 @@ def align_centres_to_img(img,centres):
         cv2.circle(point_image,(coor[1],coor[0]),radius=1, color=(255,0,0),thickness=1)
     return point_image
     
+# Filter pipelines, built once and reused for every image.  Each Sobel
+# pipeline fuses the smoothing and the derivative into a single 7x7 kernel,
+# and works in floating point so negative gradients are not clipped away.
+# The pipelines are applied by sxcv.tiled, a strip at a time on all the
+# processors.
+SMOOTH = sxcv.FilterPipeline(['gaussian5'])
+SMOOTH_DX = sxcv.FilterPipeline(['gaussian5', 'sobelx'])
+SMOOTH_DY = sxcv.FilterPipeline(['gaussian5', 'sobely'])
+LOG = sxcv.FilterPipeline(['gaussian5', 'laplacian'])
+
 def sobel(img):
-    sobel_x = cv2.filter2D(src=img, ddepth=-1, kernel=sxcv.create_mask('sobelx'))
-    sobel_y = cv2.filter2D(src=img, ddepth=-1, kernel=sxcv.create_mask('sobely'))
-    return sobel_x + sobel_y
+    sobel_x = sxcv.tiled(SMOOTH_DX, img)
+    sobel_y = sxcv.tiled(SMOOTH_DY, img)
+    return cv2.add(cv2.convertScaleAbs(sobel_x), cv2.convertScaleAbs(sobel_y))
     
 def sobel_root_squared(img):
-    sobel_x = cv2.filter2D(src=img, ddepth=-1, kernel=sxcv.create_mask('sobelx'))
-    sobel_y = cv2.filter2D(src=img, ddepth=-1, kernel=sxcv.create_mask('sobely'))
-    return ((sobel_x**2+sobel_y**2)**0.5).clip(0,255).astype('uint8')
+    sobel_x = sxcv.tiled(SMOOTH_DX, img)
+    sobel_y = sxcv.tiled(SMOOTH_DY, img)
+    return cv2.convertScaleAbs(cv2.magnitude(sobel_x, sobel_y))
 def laplacian_of_gaussian(img):
-    gaussian = cv2.filter2D(src=img, ddepth=-1, kernel=sxcv.create_mask('gaussian5'))
-    return cv2.filter2D(src=gaussian, ddepth=-1, kernel=sxcv.create_mask('laplacian'))
+    return sxcv.tiled(LOG, img).clip(0,255).astype('uint8')
     
 def show_images(images_dict):
     for name,image in images_dict.items():
         cv2.imshow(name,image)
     cv2.waitKey(0)
-def linear_operator(im,a,b):
-    return ((g_im*a)+b).clip(0,255).astype('uint8')
 centres = get_centres(FILENAME)
 images_dict = {}
 im, g_im, neg_im = load_img(FILENAME)
 
-mult_im = linear_operator(g_im,1.9,-127)
-gaussian = cv2.filter2D(src=mult_im, ddepth=-1, kernel=sxcv.create_mask('gaussian5'))
+# Stretch the contrast so that the darkest and brightest 1% of pixels
+# saturate, rather than using a hand-tuned gain and offset.
+mult_im = sxcv.stretch(g_im)
+gaussian = cv2.convertScaleAbs(sxcv.tiled(SMOOTH, mult_im))
 laplacian_of_gaussian = laplacian_of_gaussian(mult_im)
-sobel = sobel(gaussian)
-sobel_rs = sobel_root_squared(gaussian)
+sobel = sobel(mult_im)
+sobel_rs = sobel_root_squared(mult_im)
 
 formatted_image = (g_im+sobel).clip(0,255)
 _,bin_im = cv2.threshold(formatted_image,0,255,cv2.THRESH_OTSU)
@@ -68,7 +79,7 @@ bin_points = align_centres_to_img(bin_im,centres)
 images_dict = {
     'original':im,
     'grayscale':g_im,
-    'multiplied':mult_im,
+    'stretched':mult_im,
     'gaussian': gaussian,
     'LoG': laplacian_of_gaussian+100,
     'g+sobel': sobel+100,
@@ -87,7 +98,7 @@ for line in f.readlines():
     a = [int(word) for word in line.strip(' ').split(' ') if word not in (' ','')]
     points.append(tuple(a))
 
-image = cv2.imread(FILENAME+'.jpg')
+image = sxcv.imread(FILENAME+'.jpg')
 mult_im = cv2.multiply(image,(1),scale=1.2).astype('uint8')
 #_,bin_im = cv2.threshold(image,0,255,cv2.THRESH_OTSU)
 filtered_image = cv2.filter2D(src=image, ddepth=-1, kernel=sxcv.create_mask('blur5'))
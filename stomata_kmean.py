@@ -5,7 +5,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
 import cv2
-img1 = cv2.imread("M:/ComputerVision/Images/stomata/005-ab.jpg")
+import sxcv
+img1 = sxcv.imread("M:/ComputerVision/Images/stomata/005-ab.jpg")
 def plot_3d(img):
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     r, g, b = cv2.split(img)
@@ -51,9 +51,8 @@ of the Python language would specify what we should all use!
 # Boilerplate.
 #-------------------------------------------------------------------------------
 
-import sys, os, platform, tempfile
+import sys, os, mmap, functools, threading
 import cv2, numpy
-import matplotlib.pylab as plt
 
 #-------------------------------------------------------------------------------
 # MODULE INITIALIZATION.
@@ -63,8 +62,13 @@ import matplotlib.pylab as plt
 DEBUG = False
 
 # We occasionally have to do things differently on different operating systems,
-# so figure out what we're running on.
-systype = platform.system ()
+# so figure out what we're running on.  This gives the same answer as
+# platform.system() without the cost of importing the platform module.
+systype = "Windows" if os.name == "nt" else os.uname ().sysname
+
+# The number of seconds that importing this module is allowed to take on top
+# of importing OpenCV and numpy; see import_time.
+IMPORT_BUDGET = 0.05
 
 # Extract any settings from the environment variable "SXCV" and store them in
 # the global list ENVIRONMENT.
@@ -77,6 +81,17 @@ if key in os.environ:
 else:
     ENVIRONMENT = []
 
+def _setting (name):
+    """Return the value of the setting `name` in the environment variable
+    "SXCV", given there as "name=value" with the value's case preserved,
+    True if just the word `name` is present, or None if it is absent."""
+    for word in os.environ.get ("SXCV", "").split ():
+        if word.lower () == name:
+            return True
+        if word.lower ().startswith (name + "="):
+            return word[len (name) + 1:]
+    return None
+
 #-------------------------------------------------------------------------------
 # DEBUGGING SUPPORT.
 #-------------------------------------------------------------------------------
@@ -96,21 +111,36 @@ else:
 # sixel256: images displayed via sxsv.ddisplay will, if the system supports it,
 #    appear directly in the terminal window.
 #
+# async: images displayed via sxcv.ddisplay are displayed by a background
+#    thread, so that processing is not held up; "async=drop_newest" and
+#    "async=block" choose what happens when images arrive faster than they
+#    can be displayed (see "ASYNCHRONOUS DISPLAY" below).
+#
+# sink=<directory>: images passed to sxcv.ddisplay are not displayed but
+#    stored as thumbnails in the directory, which holds only the most recent
+#    ones (see "DEBUG IMAGE SINKS" below).
+#
+# profile: the time taken and memory used by calls to routines in this module,
+#    and to the OpenCV routines they call, are recorded and summarized when
+#    the program exits; "profile=<file>" saves them in a JSON file instead
+#    (see "PROFILING" below).
+#
+# cache=<directory>: images read by imread are also kept in the directory as
+#    decoded pixels, so that other processes need not decode them again (see
+#    "READING IMAGES" below).
+#
 # Sixel graphics are not widely reported and not all that widely used but they
 # are a really useful way of reviewing and comparing the effects of processing.
-# To be able to view them, you need to do a little preparatory work:
+# This module generates them itself, so no other software is needed, but you
+# do need a terminal program that can display them:
 #
-#   +  On a Mac, you need to install the "img2sixel" program via Homebrew:
-#         brew install libsixel
-#      AND be using iTerm2 (https://iterm2.com) rather than the standard
-#      Terminal application.  iTerm2 is better than Terminal anyway.
-#      Set "sixel256" in the SXCV envronment variable.
+#   +  On a Mac, you need to be using iTerm2 (https://iterm2.com) rather than
+#      the standard Terminal application.  iTerm2 is better than Terminal
+#      anyway.  Set "sixel256" in the SXCV envronment variable.
 #
-#   +  On Linux systems that run X11 rather than Wayland, you also need to
-#      install the "img2sixel" program:
-#         apt install libsixel-bin
-#      The venerable xterm application can display sixel graphics once it is
-#      configured properly.  First, put the lines:
+#   +  On Linux systems that run X11 rather than Wayland, the venerable xterm
+#      application can display sixel graphics once it is configured
+#      properly.  First, put the lines:
 #         xterm*decTerminalID: vt340
 #         xterm*numColorRegisters: 256
 #         xterm*sixelScrolling: 1
@@ -187,9 +217,13 @@ def ddisplay (im, title, delay=0, destroy=True):
 
     If the environment variable "SXCV" exists and contains the word
     "sixel16" or "sixel256", then the image is displayed in the terminal
-    window via `img2sixel`; otherwise it is displayed in a conventional
+    window via `display_sixel`; otherwise it is displayed in a conventional
     pop-up display window.  Display in the terminal window makes it easier
-    to review the effects of processing.
+    to review the effects of processing.  In asynchronous mode (see
+    `async_display`), the image is queued for display by a background
+    thread and `delay` and `destroy` are ignored.  If "sink=<directory>"
+    is in "SXCV", or `debug_sink` has been called, a thumbnail of the
+    image is stored in that directory instead of being displayed.
 
     Args:
         im (image): image to be displayed
@@ -203,49 +237,877 @@ def ddisplay (im, title, delay=0, destroy=True):
 
     if debugging ():
         # For information on the following tests, see the top of this file.
-        if "sixel16" in ENVIRONMENT and systype != "Windows":
-            display_sixel (im, title, 16)
-        elif "sixel256" in ENVIRONMENT and systype != "Windows":
-            display_sixel (im, title, 256)
+        if DISPLAY_SINK is None and _setting ("sink") not in (None, True):
+            debug_sink (_setting ("sink"))
+        if DISPLAY_SINK is not None:
+            DISPLAY_SINK.put (im, title)
+            return
+        if DISPLAY_QUEUE is None and _setting ("async"):
+            policy = _setting ("async")
+            async_display ("drop_oldest" if policy is True else policy)
+        levels = 0
+        if "sixel16" in ENVIRONMENT:
+            levels = 16
+        elif "sixel256" in ENVIRONMENT:
+            levels = 256
+        if DISPLAY_QUEUE is not None:
+            # The caller may go on to change the image, so queue a copy.
+            DISPLAY_QUEUE.put ((im.copy (), title, levels))
+        elif levels > 0:
+            display_sixel (im, title, levels)
         else:
             display (im, title, delay, destroy)
 
 #-------------------------------------------------------------------------------
-def display_sixel (im, title, levels=256):
+def display_sixel (im, title, levels=256, width=None, scene=None):
     """
-    Display `im` as sixels via the external program `img2sixel`.
+    Display `im` in the terminal window as sixels.
+
+    Colour images are displayed using a palette of `levels` colours
+    chosen to suit the image.  Choosing the palette is the slowest part
+    of the process, so it is remembered and used again for later images
+    of the same `scene`, which is normally the same as `title`: when
+    displaying successive frames of a video, say, give them all the same
+    scene.  Images wider than `width` pixels are shrunk to fit.
 
     Args:
         im (image): image to be displayed
         title (str): information about what is being displayed
         levels (int): number of output levels to be produced
                       (default: 256)
+        width (int): maximum width of the displayed image in pixels
+                     (default: the width of the terminal window)
+        scene (str): name used to look up the palette to be used
+                     (default: `title`)
     """
-    # ASIDE: As well as being useful in its own right, this routine serves as
-    # a template for any other routines that need to run an external program
-    # on an image.  The basic strategy is to save the image out as a temporary
-    # ".png" file (it needs to be an uncompressed format), then run a shell
-    # command on it.  In this particular case, the command does not create any
-    # output but it is easy to edit the temporary filename to have a different
-    # extension, if the external program produces an output image, and then
-    # read in the result of processing via cv2.imread as usual.
-
     # As the sixel output goes into the terminal window, output the title
     # above it so we can find it when we scroll up the window.
     print (title + ":")
 
-    # Save the image to a temporary file, run img2sixel on it, then delete the
-    # file.
-    fn = tempfile.NamedTemporaryFile (suffix=".png").name
-    cv2.imwrite (fn, im)
-    # The following works with at least zsh.
-    cmd = "img2sixel -p %d %s 2>/dev/null" % (levels, fn)
-    os.system (cmd)
-    os.remove (fn)
-
-    # Terminate the line in the output in case img2sixel didn't.
+    if width is None:
+        import shutil
+        width = shutil.get_terminal_size ().columns * SIXEL_CELL_WIDTH
+    if im.shape[1] > width:
+        ny = max (1, im.shape[0] * width // im.shape[1])
+        im = cv2.resize (im, (width, ny), interpolation=cv2.INTER_AREA)
+
+    palette = None
+    if len (im.shape) == 3 and im.shape[2] > 1:
+        key = (title if scene is None else scene, levels)
+        palette = SIXEL_PALETTES.get (key)
+        if palette is None:
+            if len (SIXEL_PALETTES) >= 32: SIXEL_PALETTES.clear ()
+            palette = sixel_palette (im, levels)
+            SIXEL_PALETTES[key] = palette
+    sys.stdout.write (sixel_encode (im, levels, palette))
+    sys.stdout.flush ()
+
+    # Terminate the line in the output.
     print ()
 
+# The width in pixels assumed for each character cell of the terminal, used
+# to work out how wide images can be displayed, and the palettes chosen by
+# display_sixel, indexed by scene and number of levels.
+SIXEL_CELL_WIDTH = 10
+SIXEL_PALETTES = {}
+
+#-------------------------------------------------------------------------------
+def sixel_palette (im, levels=256):
+    """
+    Choose a palette of up to `levels` colours to represent the colour
+    image `im`.  The palette is returned along with a lookup table that
+    gives the index of the nearest palette entry for each colour, after
+    each of the channels has been reduced to 5 bits.  Entries for colours
+    that do not appear in `im` are -1 and are filled in by `sixel_encode`
+    if it meets them.
+
+    Args:
+        im (image): colour image for which the palette is to be chosen
+        levels (int): largest number of colours in the palette
+                      (default: 256)
+
+    Returns:
+        palette (array): the colours of the palette, in BGR order
+        lut (array): the palette index of each reduced colour
+
+    Tests:
+        >>> im = numpy.zeros ((4, 6, 3), dtype=numpy.uint8)
+        >>> im[:,3:] = (0, 0, 255)
+        >>> palette, lut = sixel_palette (im, 16)
+        >>> print (palette)
+        [[  4   4   4]
+         [  4   4 252]]
+        >>> print (lut[_sixel_codes (im)])
+        [[0 0 0 1 1 1]
+         [0 0 0 1 1 1]
+         [0 0 0 1 1 1]
+         [0 0 0 1 1 1]]
+    """
+    # ASIDE: This is the median cut algorithm of Heckbert.  The colours are
+    # first reduced to 5 bits per channel and counted, so that the work
+    # depends on the number of different colours rather than on the size of
+    # the image.  The box of colours with the largest extent is repeatedly
+    # split in two at the median along its longest side, until there are
+    # as many boxes as levels, and the palette holds each box's mean colour.
+    counts = numpy.bincount (_sixel_codes (im).ravel (), minlength=32768)
+    codes = numpy.flatnonzero (counts)
+    weights = counts[codes]
+    bgr = numpy.stack ([codes >> 10, (codes >> 5) & 31, codes & 31], axis=1)
+    boxes = [numpy.arange (len (codes))]
+    extents = [numpy.ptp (bgr, axis=0)]
+    longest = [int (extents[0].max ())]
+    while len (boxes) < levels:
+        i = max (range (len (boxes)), key=longest.__getitem__)
+        if longest[i] == 0:
+            break
+        box = boxes.pop (i)
+        longest.pop (i)
+        channel = extents.pop (i).argmax ()
+        box = box[numpy.argsort (bgr[box,channel], kind="stable")]
+        values = bgr[box,channel]
+        cum = numpy.cumsum (weights[box])
+        median = values[numpy.searchsorted (cum, cum[-1] / 2)]
+        # Don't split a run of equal values across the two boxes.
+        split = numpy.searchsorted (values, median, side="right")
+        if split == len (box):
+            split = numpy.searchsorted (values, median, side="left")
+        boxes += [box[:split], box[split:]]
+        extents += [numpy.ptp (bgr[b], axis=0) for b in boxes[-2:]]
+        longest += [int (e.max ()) for e in extents[-2:]]
+    palette = numpy.array ([numpy.average (bgr[b], axis=0, weights=weights[b])
+                            for b in boxes])
+    palette = (palette * 8 + 4).round ().astype (numpy.uint8)
+
+    lut = numpy.full (32768, -1, dtype=numpy.int16)
+    lut[codes] = _sixel_nearest (palette, codes)
+    return palette, lut
+
+#-------------------------------------------------------------------------------
+def sixel_encode (im, levels=256, palette=None):
+    """
+    Return the sixel representation of the image `im`, which can be
+    written to a terminal that supports sixel graphics to display it.
+    Monochrome images are displayed with `levels` grey levels and colour
+    ones with up to `levels` colours, using a palette returned by
+    `sixel_palette` or, by default, one chosen for this image.  Images
+    that are not 8-bit are scaled into the range 0 to 255.
+
+    Args:
+        im (image): image to be encoded
+        levels (int): number of levels to be produced (default: 256)
+        palette (tuple): palette and lookup table from `sixel_palette`
+                         (default: one chosen to suit `im`)
+
+    Returns:
+        text (str): the image encoded as sixels
+
+    Tests:
+        >>> im = numpy.zeros ((7, 10), dtype=numpy.uint8)
+        >>> im[:,5:] = 255
+        >>> print (repr (sixel_encode (im, 2)))
+        '\\x1bPq"1;1;10;7#0;2;0;0;0#1;2;100;100;100#0!5~$#1!5?!5~-#0!5@$#1!5?!5@-\\x1b\\\\'
+    """
+    # ASIDE: A sixel image is sent to the terminal in bands six pixels tall.
+    # Each band is sent once for each colour appearing in it, as a row of
+    # characters that each encode which of the six pixels of a column have
+    # that colour, the same character repeated n times being abbreviated to
+    # "!n" and the character.  Rather than working through the pixels in
+    # turn, which is far too slow in Python, the bit patterns of all the
+    # bands and colours are built up together with numpy, using one pass
+    # per row of the band, and the run-length encoding and output text are
+    # then worked out for all of them at once (see _sixel_bands).
+    if im.dtype != numpy.uint8:
+        im = cv2.normalize (im, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+    if len (im.shape) == 3 and im.shape[2] == 1:
+        im = im[:,:,0]
+    if len (im.shape) == 2:
+        idx = (im.astype (numpy.uint16) * levels >> 8).astype (numpy.uint8)
+        grey = (numpy.arange (levels) * 255 + (levels - 1) // 2) // max (levels - 1, 1)
+        rgb = numpy.stack ([grey, grey, grey], axis=1)
+    else:
+        if palette is None:
+            palette = sixel_palette (im, levels)
+        colours, lut = palette
+        codes = _sixel_codes (im)
+        idx = lut[codes]
+        if idx.min () < 0:
+            missing = numpy.unique (codes[idx < 0])
+            lut[missing] = _sixel_nearest (colours, missing)
+            idx = lut[codes]
+        rgb = colours[:,2::-1]
+    nc = len (rgb)
+
+    # The image is padded to a whole number of bands with a colour that is
+    # never output.
+    ny, nx = idx.shape
+    nb = (ny + 5) // 6
+    padded = numpy.full ((nb * 6, nx), nc, dtype=numpy.intp)
+    padded[:ny] = idx
+    padded = padded.reshape (nb, 6, nx)
+    out = [b'\x1bPq"1;1;%d;%d' % (nx, ny)]
+    out += [b"#%d;2;%d;%d;%d" % (c, r * 100 // 255, g * 100 // 255, b * 100 // 255)
+            for c, (r, g, b) in enumerate (rgb.tolist ())]
+    out += [_sixel_bands (padded, nc)]
+    out += [b"\x1b\\"]
+    return b"".join (out).decode ("ascii")
+
+#-------------------------------------------------------------------------------
+def _sixel_bands (bands, nc):
+    """Return the sixel encoding of `bands`, an array of palette indices of
+    shape (bands, 6, columns) in which index `nc` is not to be output."""
+    # The pattern for a colour in a column of a band has a bit set for each
+    # of the six rows of the column that has that colour.  The patterns are
+    # found for the colour of each row, keeping only the first row of each
+    # colour in a column, and then sorted by band, colour and column, which
+    # is the order in which they are to be output.
+    nb, junk, nx = bands.shape
+    b = numpy.broadcast_to (numpy.arange (nb)[:,None], (nb, nx))
+    x = numpy.broadcast_to (numpy.arange (nx)[None,:], (nb, nx))
+    eb, ec, ex, ev = [], [], [], []
+    for r in range (0, 6):
+        c = bands[:,r,:]
+        wanted = c < nc
+        pattern = numpy.zeros ((nb, nx), dtype=numpy.uint8)
+        for rr in range (0, 6):
+            same = bands[:,rr,:] == c
+            if rr < r: wanted &= ~same
+            pattern |= same.view (numpy.uint8) << rr
+        eb += [b[wanted]]
+        ec += [c[wanted]]
+        ex += [x[wanted]]
+        ev += [pattern[wanted]]
+    eb, ec, ex, ev = [numpy.concatenate (e) for e in (eb, ec, ex, ev)]
+    order = numpy.argsort ((eb * nc + ec) * nx + ex)
+    eb, ec, ex = eb[order], ec[order], ex[order]
+    ev = ev[order] + 63
+
+    # Each band is output once for each colour present in it, as a row of
+    # patterns.  Patterns that are the same as the one before them in the
+    # row form a run, and any gap before a run is a run of empty patterns.
+    row = eb * nc + ec
+    new_row = numpy.ones (len (row), dtype=bool)
+    new_row[1:] = row[1:] != row[:-1]
+    prev_x = numpy.where (new_row, -1, numpy.roll (ex, 1))
+    gap = ex - prev_x - 1
+    starts = new_row | (gap > 0)
+    starts[1:] |= ev[1:] != ev[:-1]
+    starts = numpy.flatnonzero (starts)
+    runs = len (starts)
+    rows = numpy.flatnonzero (new_row)
+    rb, rc = eb[rows], ec[rows]
+    tok_row = numpy.repeat (numpy.cumsum (new_row)[starts] - 1, 2)
+    tok_len = numpy.empty (2 * runs, dtype=int)
+    tok_len[0::2] = gap[starts]
+    tok_len[1::2] = numpy.diff (numpy.append (starts, len (ex)))
+    tok_val = numpy.empty (2 * runs, dtype=numpy.uint8)
+    tok_val[0::2] = ord ("?")
+    tok_val[1::2] = ev[starts]
+    used = tok_len > 0
+    tok_row, tok_len, tok_val = tok_row[used], tok_len[used], tok_val[used]
+
+    # Work out where everything goes in the output.  Each row is "#", its
+    # colour number, then its runs, each either "!", the length and the
+    # character or (when that would be no shorter) the character repeated,
+    # and finally "$", or "-" for the last row of a band.
+    long = tok_len > 3
+    size = numpy.where (long, 2 + _decimal_width (tok_len), tok_len)
+    hdr_len = 1 + _decimal_width (rc)
+    row_len = hdr_len + numpy.bincount (tok_row, size, len (rows)).astype (int) + 1
+    row_pos = numpy.cumsum (row_len) - row_len
+    tok_pos = numpy.cumsum (size) - size
+    first = numpy.searchsorted (tok_row, numpy.arange (len (rows)))
+    tok_pos += (row_pos + hdr_len - tok_pos[first])[tok_row]
+
+    buf = numpy.empty (int (row_len.sum ()), dtype=numpy.uint8)
+    buf[row_pos] = ord ("#")
+    _put_decimal (buf, row_pos + 1, rc)
+    last = numpy.append (rb[1:] != rb[:-1], True)
+    buf[row_pos + row_len - 1] = numpy.where (last, ord ("-"), ord ("$"))
+    buf[tok_pos[long]] = ord ("!")
+    _put_decimal (buf, tok_pos[long] + 1, tok_len[long])
+    buf[tok_pos[long] + size[long] - 1] = tok_val[long]
+    for j in range (0, 3):
+        short = ~long & (tok_len > j)
+        buf[tok_pos[short] + j] = tok_val[short]
+    return buf.tobytes ()
+
+#-------------------------------------------------------------------------------
+def _decimal_width (n):
+    "Return the number of decimal digits in each of the integers `n`."
+    width = numpy.ones (len (n), dtype=int)
+    power = 10
+    while len (n) > 0 and power <= n.max ():
+        width += n >= power
+        power *= 10
+    return width
+
+#-------------------------------------------------------------------------------
+def _put_decimal (buf, pos, n):
+    "Write the integers `n` in decimal into `buf` starting at `pos`."
+    width = _decimal_width (n)
+    for k in range (0, int (width.max (initial=0))):
+        m = width > k
+        digit = n[m] // 10 ** (width[m] - 1 - k) % 10
+        buf[pos[m] + k] = ord ("0") + digit
+
+#-------------------------------------------------------------------------------
+def _sixel_nearest (palette, codes):
+    "Return the index of the entry of `palette` nearest each of `codes`."
+    # The squared distance between colours e and p is |e|^2 - 2 e.p + |p|^2;
+    # the first term is the same for every p, so can be ignored, and the
+    # second is a matrix product.
+    bgr = numpy.stack ([codes >> 10, (codes >> 5) & 31, codes & 31], axis=1)
+    e = (bgr * 8 + 4).astype (numpy.float32)
+    p = palette.astype (numpy.float32)
+    return ((p * p).sum (axis=1) - 2 * e @ p.T).argmin (axis=1)
+
+#-------------------------------------------------------------------------------
+def _sixel_codes (im):
+    "Return the 15-bit codes of the colours of `im` with 5 bits per channel."
+    b, g, r = [im[:,:,c].astype (numpy.uint16) >> 3 for c in range (0, 3)]
+    return (b << 10) | (g << 5) | r
+
+#-------------------------------------------------------------------------------
+# ASYNCHRONOUS DISPLAY.
+#-------------------------------------------------------------------------------
+# Displaying an image in a window means waiting in cv2.waitKey, so turning on
+# debugging normally slows processing down to the speed at which the user can
+# look at the images.  In asynchronous mode, ddisplay instead hands a copy of
+# the image to a background thread that does the displaying, and carries on.
+# The images waiting to be displayed are held in a queue of limited length;
+# when the queue is full, the policy says whether to throw away the oldest
+# image in it, to throw away the new one, or to wait for room.  Asynchronous
+# mode is selected by the word "async" in the SXCV environment variable, or
+# "async=drop_newest" or "async=block" to choose a policy other than the
+# default of dropping the oldest image, or by calling async_display.  Note
+# that some platforms, notably macOS, allow windows to be used only from the
+# main thread, so sixel output is more dependable in this mode.
+
+class BackgroundQueue:
+    """Process items in a background thread, in the order they are put on
+    a queue of at most `maxsize` items.  When the queue is full, `policy`
+    determines what `put` does:
+
+        "drop_oldest": discard the item that has waited longest
+        "drop_newest": discard the item being put
+        "block": wait until there is room
+
+    The numbers of items submitted, processed and dropped are available
+    as the attributes `submitted`, `processed` and `dropped`.
+
+    Args:
+        handler (function): invoked with each item in turn
+        maxsize (int): largest number of items waiting (default: 4)
+        policy (str): what to do when the queue is full
+                      (default: "drop_oldest")
+        idle (function): invoked every `interval` seconds while there is
+                         nothing to do (default: None)
+        interval (float): see `idle` (default: 0.05)
+
+    Raises:
+        ValueError: when invoked with an unknown policy
+
+    Tests:
+        >>> import threading
+        >>> done, busy, go = [], threading.Event (), threading.Event ()
+        >>> def slow (item):
+        ...     busy.set (); go.wait (); done.append (item)
+        >>> q = BackgroundQueue (slow, maxsize=2)
+        >>> q.put (0)
+        True
+        >>> busy.wait (5)
+        True
+        >>> print ([q.put (i) for i in range (1, 5)])
+        [True, True, True, True]
+        >>> go.set (); q.close ()
+        >>> print (done, q.submitted, q.processed, q.dropped)
+        [0, 3, 4] 5 3 2
+        >>> q = BackgroundQueue (print, maxsize=1, policy="dropnewest")
+        Traceback (most recent call last):
+         ...
+        ValueError: I don't know the queue policy 'dropnewest'!
+    """
+
+    POLICIES = ("drop_oldest", "drop_newest", "block")
+
+    def __init__ (self, handler, maxsize=4, policy="drop_oldest", idle=None,
+                  interval=0.05):
+        import queue, threading
+        if policy not in self.POLICIES:
+            raise ValueError ("I don't know the queue policy '%s'!" % policy)
+        self.handler = handler
+        self.policy = policy
+        self.idle = idle
+        self.interval = interval
+        self.items = queue.Queue (maxsize)
+        self.Full, self.Empty = queue.Full, queue.Empty
+        self.lock = threading.Lock ()
+        self.submitted = self.processed = self.dropped = 0
+        self.thread = threading.Thread (target=self._run, daemon=True)
+        self.thread.start ()
+
+    def put (self, item):
+        """Queue `item` for processing, returning whether it was queued.
+
+        Args:
+            item (object): the item to be processed, which must not be None
+
+        Returns:
+            bool: False if the item was dropped
+        """
+        with self.lock:
+            self.submitted += 1
+        if self.policy == "block":
+            self.items.put (item)
+            return True
+        while True:
+            try:
+                self.items.put_nowait (item)
+                return True
+            except self.Full:
+                if self.policy == "drop_newest":
+                    self._drop ()
+                    return False
+            try:
+                self.items.get_nowait ()
+                self.items.task_done ()
+                self._drop ()
+            except self.Empty:
+                pass
+
+    def flush (self):
+        "Wait until every item queued so far has been processed."
+        self.items.join ()
+
+    def close (self):
+        "Process the items still queued, then stop the background thread."
+        if self.thread.is_alive ():
+            self.items.put (None)
+            self.thread.join ()
+
+    def _drop (self):
+        with self.lock:
+            self.dropped += 1
+
+    def _run (self):
+        while True:
+            try:
+                item = self.items.get (timeout=self.interval)
+            except self.Empty:
+                if self.idle is not None: self.idle ()
+                continue
+            try:
+                if item is None:
+                    return
+                self.handler (item)
+                with self.lock:
+                    self.processed += 1
+            except Exception:
+                # Report the problem but carry on, as the program putting
+                # items on the queue could otherwise wait for ever.
+                import traceback
+                traceback.print_exc ()
+            finally:
+                self.items.task_done ()
+
+# The queue of images waiting to be displayed in asynchronous mode, and
+# whether any display windows are open.
+DISPLAY_QUEUE = None
+DISPLAY_WINDOWS = False
+
+#-------------------------------------------------------------------------------
+def async_display (policy="drop_oldest", maxsize=4):
+    """
+    Make `ddisplay` show images asynchronously, from a background thread,
+    or synchronously again if `policy` is None.  Images still waiting to
+    be shown are shown before switching, and before the program exits.
+
+    Args:
+        policy (str): what to do when `maxsize` images are already waiting,
+                      as for `BackgroundQueue` (default: "drop_oldest")
+        maxsize (int): largest number of images waiting (default: 4)
+
+    Returns:
+        queue (BackgroundQueue): the queue of images, whose counters show
+                                 how many have been dropped, or None
+    """
+    global DISPLAY_QUEUE
+
+    if DISPLAY_QUEUE is not None:
+        DISPLAY_QUEUE.close ()
+        DISPLAY_QUEUE = None
+    if policy is not None:
+        import atexit
+        DISPLAY_QUEUE = BackgroundQueue (_display_item, maxsize, policy,
+                                         idle=_display_events)
+        atexit.register (DISPLAY_QUEUE.close)
+    return DISPLAY_QUEUE
+
+#-------------------------------------------------------------------------------
+def _display_item (item):
+    "Display an image taken from the queue of asynchronous displays."
+    global DISPLAY_WINDOWS
+
+    im, title, levels = item
+    if levels > 0:
+        display_sixel (im, title, levels)
+    else:
+        cv2.imshow (title, im)
+        cv2.waitKey (1)
+        DISPLAY_WINDOWS = True
+
+#-------------------------------------------------------------------------------
+def _display_events ():
+    "Keep any display windows responsive while there is nothing to display."
+    if DISPLAY_WINDOWS:
+        cv2.waitKey (1)
+
+#-------------------------------------------------------------------------------
+# DEBUG IMAGE SINKS.
+#-------------------------------------------------------------------------------
+# On a computer with no display, the images that ddisplay would show can be
+# sent to a directory instead, by putting "sink=<directory>" in the SXCV
+# environment variable or calling debug_sink.  So that a long run cannot fill
+# the disk, the directory holds a fixed number of slots used in rotation, each
+# holding a small JPEG thumbnail of an image; the index file in it says which
+# image is in each slot, when it arrived and how big it was.  Shrinking the
+# image is done straight away, so only thumbnails need to be kept in memory,
+# and the compression and writing are done by a background thread.  After the
+# run, read_sink lists the images in the order they arrived.
+
+class ImageSink:
+    """Store thumbnails of images in the directory `directory`, which is
+    created if need be, keeping only the most recent `slots` of them.
+
+    Args:
+        directory (str): directory in which to store the images
+        slots (int): number of images kept (default: 256)
+        size (int): largest width or height of a thumbnail (default: 256)
+        quality (int): JPEG quality of the thumbnails (default: 80)
+        maxsize (int): largest number of thumbnails waiting to be written,
+                       as for `BackgroundQueue` (default: 8)
+        policy (str): what to do when that many are waiting, as for
+                      `BackgroundQueue` (default: "drop_oldest")
+
+    Tests:
+        >>> import tempfile
+        >>> where = tempfile.mkdtemp ()
+        >>> sink = ImageSink (where, slots=3, size=4)
+        >>> for i in range (0, 5):
+        ...     sink.put (numpy.full ((8, 12), 50 * i, dtype=numpy.uint8),
+        ...               "step %d" % i)
+        >>> sink.close ()
+        >>> for entry in read_sink (where):
+        ...     print (entry["seq"], entry["title"], entry["shape"],
+        ...            os.path.basename (entry["file"]),
+        ...            cv2.imread (entry["file"], cv2.IMREAD_GRAYSCALE).shape)
+        2 step 2 8x12 uint8 00002.jpg (3, 4)
+        3 step 3 8x12 uint8 00000.jpg (3, 4)
+        4 step 4 8x12 uint8 00001.jpg (3, 4)
+        >>> sink = ImageSink (where, slots=2, size=4)
+        >>> sink.put (numpy.zeros ((8, 12), dtype=numpy.uint8), "step 5")
+        >>> sink.close ()
+        >>> for entry in read_sink (where):
+        ...     print (entry["seq"], entry["title"],
+        ...            os.path.basename (entry["file"]),
+        ...            cv2.imread (entry["file"], cv2.IMREAD_GRAYSCALE)[0,0])
+        4 step 4 00000.jpg 200
+        5 step 5 00001.jpg 0
+        >>> print (sorted (os.listdir (where)))
+        ['00000.jpg', '00001.jpg', 'index.txt']
+        >>> import shutil; shutil.rmtree (where)
+    """
+
+    # Each line of the index file has this many characters, so that the
+    # line for a slot can be overwritten without touching the others.  The
+    # index has one line per slot, so its size tells how many slots it has.
+    RECORD = 128
+
+    def __init__ (self, directory, slots=256, size=256, quality=80,
+                  maxsize=8, policy="drop_oldest"):
+        os.makedirs (directory, exist_ok=True)
+        self.directory = directory
+        self.slots = slots
+        self.size = size
+        self.quality = quality
+        self.index = os.path.join (directory, "index.txt")
+        # Carry on from where any previous run left off.
+        entries = read_sink (directory)
+        if not os.path.exists (self.index) or \
+           os.path.getsize (self.index) != slots * self.RECORD:
+            self._reslot (entries[-slots:])
+        self.seq = entries[-1]["seq"] + 1 if len (entries) > 0 else 0
+        self.queue = BackgroundQueue (self._write, maxsize, policy)
+
+    def put (self, im, title):
+        """Queue a thumbnail of `im` to be stored.
+
+        Args:
+            im (image): image to be stored
+            title (str): information about what is being stored
+        """
+        import time
+        ny, nx = im.shape[:2]
+        shape = "x".join (str (n) for n in im.shape) + " " + str (im.dtype)
+        if im.dtype != numpy.uint8:
+            im = cv2.normalize (im, None, 0, 255, cv2.NORM_MINMAX, cv2.CV_8U)
+        scale = self.size / max (ny, nx)
+        if scale < 1:
+            size = (max (1, round (nx * scale)), max (1, round (ny * scale)))
+            im = cv2.resize (im, size, interpolation=cv2.INTER_AREA)
+        else:
+            im = im.copy ()
+        self.queue.put ((self.seq, time.time (), title, shape, im))
+        self.seq += 1
+
+    def close (self):
+        "Write any thumbnails still waiting, then stop."
+        self.queue.close ()
+
+    def _reslot (self, entries):
+        """Make a fresh index with `self.slots` slots holding `entries`,
+        which were stored by a sink with a different number of slots,
+        moving their thumbnails to their new slots and removing the rest."""
+        kept = []
+        for e in entries:
+            with open (e["file"], "rb") as f:
+                kept += [(e, f.read ())]
+        for fn in os.listdir (self.directory):
+            if len (fn) == 9 and fn.endswith (".jpg") and fn[:5].isdigit ():
+                os.remove (os.path.join (self.directory, fn))
+        with open (self.index, "wb") as f:
+            f.write ((" " * (self.RECORD - 1) + "\n").encode () * self.slots)
+        for e, data in kept:
+            self._store (e["seq"], e["time"], e["title"], e["shape"], data)
+
+    def _write (self, item):
+        seq, when, title, shape, im = item
+        ok, data = cv2.imencode (".jpg", im,
+                                 [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        self._store (seq, when, title, shape, data.tobytes ())
+
+    def _store (self, seq, when, title, shape, data):
+        slot = seq % self.slots
+        fn = os.path.join (self.directory, "%05d.jpg" % slot)
+        with open (fn + ".tmp", "wb") as f:
+            f.write (data)
+        os.replace (fn + ".tmp", fn)
+        title = " ".join (title.split ())
+        line = "%10d %17.6f %-24s %s" % (seq, when, shape, title)
+        line = line.encode ()[:self.RECORD-1].ljust (self.RECORD - 1) + b"\n"
+        with open (self.index, "r+b") as f:
+            f.seek (slot * self.RECORD)
+            f.write (line)
+
+# The sink to which ddisplay sends images, if there is one.
+DISPLAY_SINK = None
+
+#-------------------------------------------------------------------------------
+def debug_sink (directory, **options):
+    """
+    Make `ddisplay` store thumbnails of images in `directory` rather than
+    display them, or display them again if `directory` is None.
+
+    Args:
+        directory (str): directory in which to store the images
+        options: other arguments to pass to `ImageSink`
+
+    Returns:
+        sink (ImageSink): the sink, or None
+    """
+    global DISPLAY_SINK
+
+    if DISPLAY_SINK is not None:
+        DISPLAY_SINK.close ()
+        DISPLAY_SINK = None
+    if directory is not None:
+        import atexit
+        DISPLAY_SINK = ImageSink (directory, **options)
+        atexit.register (DISPLAY_SINK.close)
+    return DISPLAY_SINK
+
+#-------------------------------------------------------------------------------
+def read_sink (directory):
+    """
+    Return the images stored by an `ImageSink` in `directory`, in the order
+    in which they arrived.  Each is described by a dictionary holding its
+    sequence number ("seq"), the time it arrived ("time"), its "title", its
+    size and type before shrinking ("shape") and the name of the "file"
+    holding its thumbnail.
+
+    Args:
+        directory (str): directory in which the images are stored
+
+    Returns:
+        entries (list): descriptions of the stored images
+    """
+    entries = []
+    fn = os.path.join (directory, "index.txt")
+    if not os.path.exists (fn):
+        return entries
+    with open (fn, "rb") as f:
+        for slot, line in enumerate (f):
+            words = line.decode (errors="replace").split (None, 4)
+            if len (words) < 4: continue
+            entries += [{"seq": int (words[0]), "time": float (words[1]),
+                         "shape": words[2] + " " + words[3],
+                         "title": words[4].strip () if len (words) > 4 else "",
+                         "file": os.path.join (directory, "%05d.jpg" % slot)}]
+    return sorted (entries, key=lambda e: e["seq"])
+
+#-------------------------------------------------------------------------------
+# READING IMAGES.
+#-------------------------------------------------------------------------------
+# Decoding a JPEG takes far longer than most of the processing done on it, and
+# programs often read the same image more than once: in colour and again in
+# greyscale, or once for every parameter value tried by FACT.  `imread` keeps
+# the images it has decoded in memory, discarding the least recently used
+# ones when they exceed IMAGE_CACHE_LIMIT bytes, and returns them read-only
+# so that one caller cannot change what another sees.  An image is looked up
+# by its file's name and modification time and the flags it was read with,
+# so changing the file means it is read again.  Greyscale images are derived
+# from the colour image rather than decoded again.
+#
+# Putting "cache=<directory>" in the SXCV environment variable also keeps the
+# decoded pixels in that directory as .npy files, so that other processes,
+# such as later runs of a program under FACT, can memory-map them rather than
+# decoding the image.  Stale files in the directory are never read, as the
+# modification time is part of their names, but nor are they removed.
+
+# The decoded images, least recently used first, and the bytes they occupy.
+IMAGE_CACHE = {}
+IMAGE_CACHE_BYTES = 0
+IMAGE_CACHE_LIMIT = 256 * 1024 * 1024
+
+# The directory in which decoded pixels are kept, if any.
+IMAGE_CACHE_DIRECTORY = _setting ("cache")
+if IMAGE_CACHE_DIRECTORY is True: IMAGE_CACHE_DIRECTORY = None
+
+def imread (fn, flags=cv2.IMREAD_COLOR):
+    """
+    Read an image from file `fn`, as cv2.imread does, returning a cached
+    copy if the file has been read already and not changed since.  The
+    image is read-only; copy it if it is to be changed.
+
+    A greyscale image is the colour image converted by cv2.cvtColor, so
+    it may differ by a few grey levels from one decoded as greyscale by
+    cv2.imread.
+
+    Args:
+        fn (str): name of the file to be read
+        flags (int): the cv2.IMREAD flags (default: cv2.IMREAD_COLOR)
+
+    Returns:
+        im (image): the image, or None if it cannot be read
+
+    Tests:
+        >>> fn = os.path.join (os.path.dirname (__file__), "Images",
+        ...                    "biscuits", "biscuit-001.jpg")
+        >>> im = imread (fn)
+        >>> print (imread (fn) is im, im.flags.writeable)
+        True False
+        >>> g = imread (fn, cv2.IMREAD_GRAYSCALE)
+        >>> print (numpy.array_equal (g, cv2.cvtColor (im, cv2.COLOR_BGR2GRAY)))
+        True
+        >>> print (imread ("no-such-file.jpg"))
+        None
+    """
+    global IMAGE_CACHE_BYTES
+
+    try:
+        st = os.stat (fn)
+    except OSError:
+        return None
+    key = (os.path.abspath (fn), st.st_mtime_ns, flags)
+    im = IMAGE_CACHE.pop (key, None)
+    if im is None:
+        im = _decode_image (key)
+        if im is None:
+            return None
+        im.flags.writeable = False
+        IMAGE_CACHE_BYTES += im.nbytes
+
+    # Put the image at the most recently used end of the cache, then forget
+    # the least recently used images until the cache is small enough.
+    IMAGE_CACHE[key] = im
+    while IMAGE_CACHE_BYTES > IMAGE_CACHE_LIMIT:
+        IMAGE_CACHE_BYTES -= IMAGE_CACHE.pop (next (iter (IMAGE_CACHE))).nbytes
+    return im
+
+#-------------------------------------------------------------------------------
+def image_cache (limit=None, directory=None, clear=False):
+    """
+    Configure the cache of images read by `imread`, returning the number
+    of images in it and the bytes they occupy.
+
+    Args:
+        limit (int): the most bytes of images to hold in memory
+                     (default: unchanged)
+        directory (str): directory in which to keep decoded pixels for
+                         other processes, or "" for none (default:
+                         unchanged)
+        clear (bool): whether to forget the images in memory
+                      (default: False)
+
+    Returns:
+        count (int): the number of images in memory
+        nbytes (int): the number of bytes they occupy
+
+    Tests:
+        >>> import tempfile
+        >>> fn = os.path.join (os.path.dirname (__file__), "Images",
+        ...                    "biscuits", "biscuit-003.jpg")
+        >>> with tempfile.TemporaryDirectory () as d:
+        ...     _ = image_cache (directory=d, clear=True)
+        ...     im = imread (fn)
+        ...     print (len (os.listdir (d)), image_cache (clear=True))
+        ...     print (isinstance (imread (fn), numpy.memmap))
+        ...     print (numpy.array_equal (imread (fn), cv2.imread (fn)))
+        ...     image_cache (directory="", clear=True)
+        1 (1, 631584)
+        True
+        True
+        (1, 631584)
+    """
+    global IMAGE_CACHE_BYTES, IMAGE_CACHE_LIMIT, IMAGE_CACHE_DIRECTORY
+
+    if limit is not None:
+        IMAGE_CACHE_LIMIT = limit
+    if directory is not None:
+        IMAGE_CACHE_DIRECTORY = directory or None
+    count, nbytes = len (IMAGE_CACHE), IMAGE_CACHE_BYTES
+    if clear:
+        IMAGE_CACHE.clear ()
+        IMAGE_CACHE_BYTES = 0
+    return count, nbytes
+
+#-------------------------------------------------------------------------------
+def _decode_image (key):
+    "Decode the image described by a key of IMAGE_CACHE, or return None."
+    fn, mtime, flags = key
+    if flags == cv2.IMREAD_GRAYSCALE:
+        im = imread (fn, cv2.IMREAD_COLOR)
+        return None if im is None else cv2.cvtColor (im, cv2.COLOR_BGR2GRAY)
+    if IMAGE_CACHE_DIRECTORY is None:
+        return cv2.imread (fn, flags)
+
+    # Look for the pixels on disk, and put them there if they are absent.
+    # The file is written under a temporary name and then renamed, so that
+    # other processes never see a partial one.
+    import hashlib
+    name = hashlib.sha1 (repr (key).encode ()).hexdigest () + ".npy"
+    cached = os.path.join (IMAGE_CACHE_DIRECTORY, name)
+    if os.path.exists (cached):
+        return numpy.load (cached, mmap_mode="r")
+    im = cv2.imread (fn, flags)
+    if im is not None:
+        os.makedirs (IMAGE_CACHE_DIRECTORY, exist_ok=True)
+        temp = "%s.%d.tmp" % (cached, os.getpid ())
+        with open (temp, "wb") as f:
+            numpy.save (f, im)
+        os.replace (temp, cached)
+    return im
+
 #-------------------------------------------------------------------------------
 # SUPPORT ROUTINES.
 #-------------------------------------------------------------------------------
@@ -291,9 +1153,13 @@ def create_mask (name):
     """
     Return one of the commonly-used convolution masks."
 
+    The masks are built once, when first requested, and the same
+    read-only array is returned on subsequent calls; see `kernel_info`.
+
     Args:
         name (str): name of the mask to be generated, one of:
-                    blur3, blur5, laplacian
+                    blur3, blur5, gaussian3, gaussian5, laplacian,
+                    sobel, sobelx, sobely, identity, sharpen
 
     Returns:
         im (image): numpy array containing the mask values
@@ -303,24 +1169,27 @@ def create_mask (name):
 
     Tests:
         >>> mask = create_mask ("blur3")
-        >>> print (mask)
-        [[1 1 1]
-         [1 1 1]
-         [1 1 1]]
+        >>> print (mask * 9)
+        [[1. 1. 1.]
+         [1. 1. 1.]
+         [1. 1. 1.]]
 
         >>> mask = create_mask ("blur5")
-        >>> print (mask)
-        [[1 1 1 1 1]
-         [1 1 1 1 1]
-         [1 1 1 1 1]
-         [1 1 1 1 1]
-         [1 1 1 1 1]]
+        >>> print (mask * 25)
+        [[1. 1. 1. 1. 1.]
+         [1. 1. 1. 1. 1.]
+         [1. 1. 1. 1. 1.]
+         [1. 1. 1. 1. 1.]
+         [1. 1. 1. 1. 1.]]
 
         >>> mask = create_mask ("laplacian")
-        >>> print (mask)
-        [[ 1  1  1]
-         [ 1 -1  1]
-         [ 1  1  1]]
+        >>> print (mask * 4)
+        [[  1.   2.   1.]
+         [  2. -12.   2.]
+         [  1.   2.   1.]]
+
+        >>> create_mask ("laplacian") is create_mask ("laplacian")
+        True
 
         >>> mask = create_mask ("whatsit")
         Traceback (most recent call last):
@@ -329,72 +1198,238 @@ def create_mask (name):
     """
     # ASIDE: One of the reasons for having this routine is to show how an
     # exception in a test is handled -- the last case above does it and the
-    # exception is triggered in the trailing else case below.
-    mask_dict = {
-        "blur3": 1/9*numpy.array ([
-            [1, 1, 1],
-            [1, 1, 1],
-            [1, 1, 1]
-        ], dtype="int"),
-        "blur5": 1/25*numpy.array ([
-            [1, 1, 1, 1, 1],
-            [1, 1, 1, 1, 1],
-            [1, 1, 1, 1, 1],
-            [1, 1, 1, 1, 1],
-            [1, 1, 1, 1, 1]
-        ], dtype="int"),
-        "gaussian3": 1/16*numpy.array ([
-            [1, 2, 1],
-            [2, 4, 2],
-            [1, 2, 1]
-        ], dtype="int"),
-        "gaussian5": 1/256*numpy.array ([
-            [1, 4, 6, 4, 1],
-            [4, 16, 24, 16, 4],
-            [6, 24, 36, 24, 6],
-            [4, 16, 24, 16, 4],
-            [1, 4, 6, 4, 1]
-        ], dtype="int"),     
-        "laplacian": 1/4 * numpy.array ([
-            [1,  2, 1],
-            [2, -12, 2],
-            [1,  2, 1]
-        ], dtype="int"),
-        'sobel': 1/8 * numpy.array([
-            [-1, 0, 1],
-            [-2,0,2],
-            [-1,0,1]
-        ], dtype='int'),
-        'sobelx': 1/8 * numpy.array([
-            [1, 0,-1],
-            [2,0,-2],
-            [1,0,-1]
-        ], dtype='int'),
-        'sobely': 1/8 * numpy.array([
-            [1,2,1],
-            [0,0,0],
-            [-1,-2,-1]
-        ], dtype='int'),   
-        'identity': 1/8*numpy.array ([
-            [1, 1, 1],
-            [1, 0, 1],
-            [1, 1, 1]
-        ], dtype="int"),
-        'sharpen': numpy.array ([
-            [0, -1, 0],
-            [-1, 5, -1],
-            [0, -1, 0]
-        ], dtype="int"),        
-    
-    }
-    im = mask_dict.get(name,0)
+    # exception is raised by kernel_info.
+    return kernel (name, numpy.float64)
+
+#-------------------------------------------------------------------------------
+# KERNEL REGISTRY.
+#-------------------------------------------------------------------------------
+# Convolution kernels are looked up by name in a registry.  Each entry is
+# built the first time it is asked for and remembered thereafter, along with
+# float32 and fixed-point versions of it and, when it has them, its separable
+# factors.  Parametric kernels such as gaussian(sigma) are remembered
+# separately for each set of parameter values.  Entries are read-only because
+# they are shared by all callers.
+
+# The masks returned by create_mask, as a scale factor and integer weights.
+MASKS = {
+    "blur3": (1/9, [
+        [1, 1, 1],
+        [1, 1, 1],
+        [1, 1, 1]
+    ]),
+    "blur5": (1/25, [
+        [1, 1, 1, 1, 1],
+        [1, 1, 1, 1, 1],
+        [1, 1, 1, 1, 1],
+        [1, 1, 1, 1, 1],
+        [1, 1, 1, 1, 1]
+    ]),
+    "gaussian3": (1/16, [
+        [1, 2, 1],
+        [2, 4, 2],
+        [1, 2, 1]
+    ]),
+    "gaussian5": (1/256, [
+        [1, 4, 6, 4, 1],
+        [4, 16, 24, 16, 4],
+        [6, 24, 36, 24, 6],
+        [4, 16, 24, 16, 4],
+        [1, 4, 6, 4, 1]
+    ]),
+    "laplacian": (1/4, [
+        [1,  2, 1],
+        [2, -12, 2],
+        [1,  2, 1]
+    ]),
+    "sobel": (1/8, [
+        [-1, 0, 1],
+        [-2, 0, 2],
+        [-1, 0, 1]
+    ]),
+    "sobelx": (1/8, [
+        [1, 0, -1],
+        [2, 0, -2],
+        [1, 0, -1]
+    ]),
+    "sobely": (1/8, [
+        [1, 2, 1],
+        [0, 0, 0],
+        [-1, -2, -1]
+    ]),
+    "identity": (1/8, [
+        [1, 1, 1],
+        [1, 0, 1],
+        [1, 1, 1]
+    ]),
+    "sharpen": (1, [
+        [0, -1, 0],
+        [-1, 5, -1],
+        [0, -1, 0]
+    ]),
+}
+
+# Builders for parametric kernels, indexed by name.
+KERNEL_BUILDERS = {}
+
+def register_kernel (name, builder):
+    """Register a parametric kernel, so that it can be obtained by name via
+    `kernel` or `kernel_info`.  `builder` is called with the keyword
+    parameters given there and must return a 2-D array.  Any kernels
+    previously built under `name` are forgotten.
+
+    Args:
+        name (str): name of the kernel
+        builder (function): routine that builds the kernel
+
+    Tests:
+        >>> register_kernel ("box", lambda n=3: numpy.ones ((n, n)) / n**2)
+        >>> print (kernel ("box", n=2))
+        [[0.25 0.25]
+         [0.25 0.25]]
+    """
+    KERNEL_BUILDERS[name] = builder
+    _kernel_entry.cache_clear ()
+
+#-------------------------------------------------------------------------------
+def kernel (name, dtype=numpy.float32, **params):
+    """Return the kernel called `name`, built with any `params` it needs,
+    as a read-only array of type `dtype`.
+
+    Args:
+        name (str): name of a mask or registered kernel
+        dtype (type): numpy.float32 or numpy.float64 (default: float32)
+        params: parameters of a parametric kernel, such as sigma
+
+    Returns:
+        k (array): the kernel
+
+    Raises:
+        ValueError: when invoked with an unknown name
+
+    Tests:
+        >>> k = kernel ("gaussian", sigma=1.0)
+        >>> print (k.shape, k.dtype, "%.4f" % k.sum ())
+        (7, 7) float32 1.0000
+        >>> kernel ("gaussian", sigma=1.0) is k
+        True
+    """
+    return kernel_info (name, **params)[numpy.dtype (dtype).name]
+
+#-------------------------------------------------------------------------------
+def kernel_info (name, **params):
+    """Return everything known about the kernel called `name`, built
+    with any `params` it needs.  The result is a dictionary containing:
+
+        float64: the kernel as float64 values
+        float32: the kernel as float32 values
+        fixed:   a tuple (weights, shift), where weights are int16 values
+                 such that the kernel is weights / 2**shift
+        factors: the (column, row) factors of the kernel if it is
+                 separable, otherwise None
+
+    Args:
+        name (str): name of a mask or registered kernel
+        params: parameters of a parametric kernel, such as sigma
+
+    Returns:
+        info (dict): the information about the kernel
+
+    Raises:
+        ValueError: when invoked with an unknown name
 
-    if type(im) == int:
+    Tests:
+        >>> info = kernel_info ("gaussian3")
+        >>> w, shift = info["fixed"]
+        >>> print (w, shift)
+        [[1 2 1]
+         [2 4 2]
+         [1 2 1]] 4
+        >>> col, row = info["factors"]
+        >>> print (numpy.round (numpy.outer (col, row) * 16))
+        [[1. 2. 1.]
+         [2. 4. 2.]
+         [1. 2. 1.]]
+        >>> print (kernel_info ("laplacian")["factors"])
+        None
+    """
+    if name not in MASKS and name not in KERNEL_BUILDERS:
         raise ValueError ("I don't know how to generate a '%s' mask!" % name)
+    return _kernel_entry (name, tuple (sorted (params.items ())))
+
+@functools.lru_cache (maxsize=None)
+def _kernel_entry (name, params):
+    "Build and remember a kernel; see kernel_info."
+    if name in MASKS:
+        scale, weights = MASKS[name]
+        k = scale * numpy.array (weights, dtype=numpy.float64)
+    else:
+        k = numpy.array (KERNEL_BUILDERS[name] (**dict (params)),
+                         dtype=numpy.float64)
+
+    # Work out the fixed-point version: the largest power-of-two scaling that
+    # keeps the weights within the range of an int16.
+    biggest = numpy.abs (k).max ()
+    shift = 14 if biggest == 0 else 14 - int (numpy.ceil (numpy.log2 (biggest)))
+    shift = max (0, shift)
+    weights = numpy.round (numpy.ldexp (k, shift)).astype (numpy.int16)
+    # Drop any powers of two that all the weights share.
+    while shift > 0 and not (weights & 1).any ():
+        weights >>= 1
+        shift -= 1
+
+    factors = separate_kernel (k)
+    info = {"float64": k, "float32": k.astype (numpy.float32),
+            "fixed": (weights, shift), "factors": factors}
+    for v in [k, info["float32"], weights] + list (factors or []):
+        v.setflags (write=False)
+    return info
+
+#-------------------------------------------------------------------------------
+def gaussian_kernel (sigma, size=None):
+    """Return a normalized 2-D Gaussian kernel, registered as "gaussian".
+
+    Args:
+        sigma (float): standard deviation of the Gaussian in pixels
+        size (int): number of rows and columns in the kernel
+                    (default: 2 * ceil (3 * sigma) + 1)
+
+    Returns:
+        k (array): the kernel
+    """
+    if size is None: size = 2 * int (numpy.ceil (3 * sigma)) + 1
+    x = numpy.arange (size) - (size - 1) / 2
+    g = numpy.exp (-x**2 / (2 * sigma**2))
+    g /= g.sum ()
+    return numpy.outer (g, g)
+
+#-------------------------------------------------------------------------------
+def log_kernel (sigma, size=None):
+    """Return a Laplacian-of-Gaussian kernel whose weights sum to zero,
+    registered as "log".
+
+    Args:
+        sigma (float): standard deviation of the Gaussian in pixels
+        size (int): number of rows and columns in the kernel
+                    (default: 2 * ceil (3 * sigma) + 1)
+
+    Returns:
+        k (array): the kernel
+
+    Tests:
+        >>> k = kernel ("log", sigma=1.4)
+        >>> print (k.shape, "%.6f" % abs (k.sum ()), k[4,4] < 0)
+        (11, 11) 0.000000 True
+    """
+    if size is None: size = 2 * int (numpy.ceil (3 * sigma)) + 1
+    x = numpy.arange (size) - (size - 1) / 2
+    r2 = x[:,None]**2 + x[None,:]**2
+    k = (r2 - 2 * sigma**2) / sigma**4 * numpy.exp (-r2 / (2 * sigma**2))
+    return k - k.mean ()
+
+register_kernel ("gaussian", gaussian_kernel)
+register_kernel ("log", log_kernel)
 
-    # Return the mask we have created.
-    return im
-	
 #-------------------------------------------------------------------------------
 def describe (im, title="Image"):
     """
@@ -476,14 +1511,14 @@ def examine (im, aty=None, atx=None, rows=15, cols=15, title=None):
         str: the formatted output to be printed
 
     Tests:
-        >>> im = create_mask ("laplacian")
+        >>> im = create_mask ("laplacian") * 4
         >>> print (examine (im)[:-1])
         [3 x 3 region of 3 x 3-pixel monochrome image at (1,1)]:
                   0   1   2
                ------------
-            0|    1   1   1
-            1|    1  -1   1
-            2|    1   1   1
+            0|    1   2   1
+            1|    2 -12   2
+            2|    1   2   1
     """
     # Work out the default values of arguments.
     ny = im.shape[0]
@@ -567,6 +1602,11 @@ def plot_histogram (x, y, title, colours=["blue", "green", "red"]):
     # ASIDE: This routine handles monochrome and multi-channel image histogram
     # plotting in essentially the same way as examine did for images.
 
+    # Matplotlib takes much longer to import than the rest of this module and
+    # its dependencies put together, and only this routine needs it, so it
+    # is imported here rather than at the top of the file.
+    import matplotlib.pylab as plt
+
     # Set up the plot.
     plt.figure ()
     plt.grid ()
@@ -639,12 +1679,200 @@ def version ():
     # whenever you make a significant change to it.
     return TS[13:32]
 
+#-------------------------------------------------------------------------------
+def import_time (module="sxcv", exclude=("cv2", "numpy"), repeats=3):
+    """
+    Return the time in seconds that a fresh Python interpreter takes to
+    import `module`, not counting the time spent importing the modules
+    in `exclude`, which are imported first.  The quickest of `repeats`
+    attempts is returned, to reduce the effect of other activity on the
+    computer.
+
+    Every program that uses this module pays its import time each time it
+    is run, which mounts up when FACT runs a program on hundreds of
+    images, so the test below fails if importing it on top of OpenCV and
+    numpy starts to take longer than IMPORT_BUDGET seconds.  Anything
+    slow to import that is needed by only a few routines, such as
+    matplotlib, should be imported inside them.
+
+    Args:
+        module (str): name of the module to be imported (default: "sxcv")
+        exclude (tuple): names of modules to import beforehand
+                         (default: cv2 and numpy)
+        repeats (int): number of times to import the module (default: 3)
+
+    Returns:
+        t (float): time taken to import the module in seconds
+
+    Tests:
+        >>> import_time () < IMPORT_BUDGET
+        True
+        >>> print (import_time ("matplotlib.pylab") > IMPORT_BUDGET)
+        True
+    """
+    import subprocess
+    here = os.path.dirname (os.path.abspath (__file__))
+    code = "import %s" % ", ".join (list (exclude) + [module])
+    best = None
+    for r in range (0, repeats):
+        result = subprocess.run ([sys.executable, "-X", "importtime", "-c",
+                                  code], cwd=here, capture_output=True,
+                                 text=True)
+        for line in result.stderr.splitlines ():
+            # Lines look like "import time: self | cumulative | name".
+            fields = line.split ("|")
+            if len (fields) == 3 and fields[2].strip () == module:
+                t = int (fields[1]) / 1.0e6
+                if best is None or t < best: best = t
+    if best is None:
+        raise ValueError ("I can't import module '%s'!" % module)
+    return best
+
 #-------------------------------------------------------------------------------
 # LIBRARY ROUTINES.
 #-------------------------------------------------------------------------------
+# The pixel types that OpenCV's statistical routines can handle; images of
+# other types are summarized by numpy.
+CV_STATS_TYPES = (numpy.uint8, numpy.int8, numpy.uint16, numpy.int16,
+                  numpy.int32, numpy.float32, numpy.float64)
+
+def stats (im, mask=None, roi=None, moments=True):
+    """Return the minimum, maximum, mean and variance of each channel of
+    an image, along with the locations of its extremes.  The result is a
+    dictionary holding:
+
+        count: the number of pixels summarized
+        min, max: arrays of the lowest and highest value of each channel
+        argmin, argmax: arrays of the (y, x) location of the first
+                        occurrence of the extremes of each channel
+        mean, var: arrays of the mean and variance of each channel
+
+    Only the pixels for which `mask` is non-zero are considered, and
+    only those within the region `roi` when that is given; locations are
+    always relative to the whole image.  `mean`, `highest`, `lowest` and
+    `extremes` are all worked out from this summary.
+
+    When `im` is a batch of images of shape (N, H, W, C), as returned by
+    `batch_files`, each entry of the summary gains a leading index that
+    selects the image, so that `count` is an array of length N and `min`
+    has shape (N, C).  `mask` may then be a single mask for all of the
+    images or a stack of N of them.
+
+    Args:
+        im (image): image to be summarized
+        mask (image): pixels to be summarized, the same size as `im`
+                      (default: all of them)
+        roi (tuple): the x, y, width and height of the region to be
+                     summarized, as returned by cv2.boundingRect
+                     (default: the whole image)
+        moments (bool): when False, the mean and variance are not
+                        calculated (default: True)
+
+    Returns:
+        stats (dict): the summary of the image
+
+    Raises:
+        ValueError: when there are no pixels to summarize
+
+    Tests:
+        >>> s = stats (testimage ())
+        >>> print (s["count"], s["min"], s["max"], s["argmin"], s["argmax"])
+        130 [10] [15] [[0 0]] [[2 3]]
+        >>> print (s["mean"].round (4), s["var"].round (4))
+        [11.0769] [2.6864]
+        >>> bgr = numpy.dstack ([testimage (), 25 - testimage (), testimage () // 2])
+        >>> s = stats (bgr, roi=(4, 5, 3, 4))
+        >>> print (s["count"], s["min"], s["max"])
+        12 [10 10  5] [15 15  7]
+        >>> print (s["argmin"])
+        [[5 6]
+         [5 4]
+         [5 6]]
+        >>> s = stats (testimage (), mask=testimage () > 14, moments=False)
+        >>> print (s["count"], s["min"], s["argmin"][0], "mean" in s)
+        8 [15] [2 3] False
+        >>> s = stats (numpy.stack ([bgr, 25 - bgr]))
+        >>> print (s["count"], s["max"].tolist (), s["argmax"][1,0])
+        [130 130] [[15, 15, 7], [15, 15, 20]] [0 0]
+    """
+    # ASIDE: OpenCV's minMaxLoc finds both extremes and their locations in
+    # a single pass over a channel, and meanStdDev accumulates the sums and
+    # sums of squares of all the channels in one more pass, whereas the
+    # obvious numpy code needs a pass for each of min, max, argmin, argmax,
+    # mean and var.  minMaxLoc works on one channel at a time, so colour
+    # images are split into their channels for it; that is still several
+    # times faster than numpy's per-channel min and max, which would also
+    # need argmin and argmax.  The same is true of batches of images:
+    # reducing a batch along its pixel axes with numpy is many times slower
+    # than summarizing each image in turn with OpenCV.
+    if len (im.shape) == 4:
+        if mask is None or len (mask.shape) == 2:
+            masks = [mask] * len (im)
+        else:
+            masks = mask
+        summaries = [stats (im[n], masks[n], roi, moments)
+                     for n in range (0, len (im))]
+        return {k: numpy.array ([s[k] for s in summaries])
+                for k in summaries[0]}
+    y0 = x0 = 0
+    if roi is not None:
+        x0, y0, w, h = roi
+        im = im[y0:y0+h,x0:x0+w]
+        if mask is not None:
+            mask = mask[y0:y0+h,x0:x0+w]
+    if mask is not None and mask.dtype != numpy.uint8:
+        mask = (mask != 0).view (numpy.uint8)
+    nc = 1 if len (im.shape) < 3 else im.shape[2]
+    count = im.shape[0] * im.shape[1]
+    if mask is not None:
+        count = cv2.countNonZero (mask)
+    if count == 0:
+        raise ValueError ("I can't summarize an image with no pixels!")
+
+    lo = numpy.empty (nc, dtype=im.dtype)
+    hi = numpy.empty (nc, dtype=im.dtype)
+    argmin = numpy.empty ((nc, 2), dtype=int)
+    argmax = numpy.empty ((nc, 2), dtype=int)
+    ave = numpy.empty (nc)
+    var = numpy.empty (nc)
+    if im.dtype in CV_STATS_TYPES:
+        planes = [im] if nc == 1 else cv2.split (im)
+        for c, plane in enumerate (planes):
+            lo[c], hi[c], (x, y), (xx, yy) = cv2.minMaxLoc (plane, mask)
+            argmin[c] = y, x
+            argmax[c] = yy, xx
+        if moments:
+            m, s = cv2.meanStdDev (im, mask=mask)
+            ave[:] = m.ravel ()
+            var[:] = s.ravel () ** 2
+    else:
+        pixels = im.reshape (-1, nc)
+        where = numpy.arange (len (pixels))
+        if mask is not None:
+            where = numpy.flatnonzero (mask)
+            pixels = pixels[where]
+        lo[:], hi[:] = pixels.min (axis=0), pixels.max (axis=0)
+        argmin[:] = numpy.column_stack (numpy.unravel_index (
+            where[pixels.argmin (axis=0)], im.shape[:2]))
+        argmax[:] = numpy.column_stack (numpy.unravel_index (
+            where[pixels.argmax (axis=0)], im.shape[:2]))
+        if moments:
+            ave[:] = pixels.mean (axis=0, dtype=numpy.float64)
+            var[:] = pixels.var (axis=0, dtype=numpy.float64)
+    argmin += (y0, x0)
+    argmax += (y0, x0)
+
+    summary = {"count": count, "min": lo, "max": hi,
+               "argmin": argmin, "argmax": argmax}
+    if moments:
+        summary["mean"] = ave
+        summary["var"] = var
+    return summary
+
 def mean (im):
     """
-    Return the mean of the pixel values an image.
+    Return the mean of the pixel values an image, or an array of the
+    means of the images of a batch.
 
     Args:
         im (image): image for which the mean value is to be found
@@ -656,11 +1884,17 @@ def mean (im):
         >>> ave = mean (arrowhead ())
         >>> print ("OK") if abs (ave - 39.66666666) < 1.0e-5 else print ("bad")
         OK
+        >>> im = testimage ()[:,:,None]
+        >>> print (mean (numpy.stack ([im, im + 1])).round (4))
+        [11.0769 12.0769]
     """
-    return numpy.mean(im)
+    ave = stats (im)["mean"].mean (axis=-1)
+    return ave if len (im.shape) == 4 else float (ave)
+
 def highest (im):
     """
-    Return the maximum of the pixel values of an image.
+    Return the maximum of the pixel values of an image, or an array of
+    the maxima of the images of a batch.
 
     Args:
         im (image): image for which the maximum value is to be found
@@ -673,11 +1907,12 @@ def highest (im):
         >>> print (highest (im))
         15
     """
-    return numpy.max(im)
+    return stats (im, moments=False)["max"].max (axis=-1)
 
 def lowest (im):
     """
-    Return the minimum of the pixel values of an image.
+    Return the minimum of the pixel values of an image, or an array of
+    the minima of the images of a batch.
 
     Args:
         im (image): image for which the maximum value is to be found
@@ -690,53 +1925,144 @@ def lowest (im):
         >>> print (lowest (im))
         10
     """
-    return numpy.min(im)
+    return stats (im, moments=False)["min"].min (axis=-1)
     
 def extremes (im):
     """
-    Return the minimum and maximum of the pixel values of an image.
+    Return the minimum and maximum of the pixel values of an image, found
+    together in a single pass over each channel.  For a batch of images,
+    they are arrays holding the extremes of each image.
 
     Args:
         im (image): image for which the maximum value is to be found
     
     Returns:
-        lo (of same type as image): lowest value in the image
-        hi (of same type as image): highest value in the image
+        lo (int or float): lowest value in the image
+        hi (int or float): highest value in the image
 
     Tests:
         >>> im = testimage ()
         >>> print (extremes (im))
         [10, 15]
     """
-    return [lowest(im),highest(im)]
+    s = stats (im, moments=False)
+    if len (im.shape) == 4:
+        return [s["min"].min (axis=-1), s["max"].max (axis=-1)]
+    return [s["min"].min ().item (), s["max"].max ().item ()]
     
-def linear_operation(im, a, b):
+def linear_operation(im, a, b, out=None, dtype=None):
     """
-    apply linear operation to the image
+    Apply the linear operation a * im + b to the image, which changes its
+    contrast (a) and brightness (b).
+
+    For uint8 images, the result is by default also uint8: it is rounded
+    and saturated (clipped to the range 0 to 255) and computed in a single
+    pass through a lookup table (see `linear_lut`).  Other images, or any
+    image when `dtype` is given, are computed with numpy's usual type rules
+    or in `dtype`; when `dtype` is an integer type and `a` or `b` is
+    fractional, the result is computed in floating point and then
+    truncated.  A batch of images is processed in a single call.
 
     Args:
         im (image): image to be modified
-        a (int): a is multiplicative modifier changes contrast
-        b (int): b is additive modifier it changes brightness
+        a (float): multiplicative modifier, which changes contrast
+        b (float): additive modifier, which changes brightness
+        out (image): image to hold the result, which may be `im` itself
+                     (default: a new image)
+        dtype (type): type of the result (default: see above)
 
     Returns:
-        str: the description to be printed
-
-    Raises:
-        ValueError: when invoked with an invalid image
+        lim (image): the modified image
 
     Tests:
-        >>> im = arrowhead ()
-        >>> print (describe (im, "This image"))
-        This image is monochrome of size 10 rows x 9 columns with uint8 pixels.
+        >>> im = testimage ()
+        >>> print (linear_operation (im, 20, -100)[0])
+        [100 140 120 120 140 120 100 140 120 140]
+        >>> print (linear_operation (im, 20, 0).max ())
+        255
+        >>> print (linear_operation (im, 20, 0, dtype=float).max ())
+        300.0
+        >>> print (linear_operation (im, 2.5, 0.5, dtype=numpy.uint8)[0])
+        [25 30 28 28 30 28 25 30 28 30]
+        >>> linear_operation (im, 2, 1, out=im) is im
+        True
+        >>> print (im[0])
+        [21 25 23 23 25 23 21 25 23 25]
+    """
+    if dtype is None and im.dtype == numpy.uint8:
+        return linear_lut (a, b) (im, out)
+    if dtype is None:
+        dtype = numpy.result_type (im, a, b)
+    work = numpy.result_type (dtype, im, a, b)
+    if work == dtype:
+        out = numpy.multiply (im, a, out=out, dtype=dtype, casting="unsafe")
+        out += b
+        return out
+    lim = numpy.multiply (im, a, dtype=work)
+    lim += b
+    if out is None:
+        return lim.astype (dtype)
+    numpy.copyto (out, lim, casting="unsafe")
+    return out
+
+
+def linear_blend(im, im2, a, out=None, dtype=None):
     """
-    return a*im+b
+    Blend two images, returning (1 - a) * im + a * im2.
 
+    When both images are uint8 and of the same shape, the result is by
+    default also uint8, rounded and saturated, and calculated in a single
+    pass by cv2.addWeighted; `out` must then be a contiguous uint8 image
+    of the same shape.  Otherwise, or when `dtype` is given, numpy's
+    usual type rules apply, or the result is of type `dtype`.  Batches of
+    images are blended in a single call.
 
-def linear_blend(im,im2,a):
-    return (1-a)*im + a*im2
+    Args:
+        im (image): first image to be blended
+        im2 (image): second image to be blended
+        a (float): proportion of `im2` in the result
+        out (image): image to hold the result, which may be `im` or `im2`
+                     (default: a new image)
+        dtype (type): type of the result (default: see above)
+
+    Returns:
+        bim (image): the blended image
+
+    Raises:
+        ValueError: when `out` cannot hold a uint8 result
+
+    Tests:
+        >>> im = testimage ()
+        >>> print (linear_blend (im, 255 - im, 0.25)[0])
+        [69 70 69 69 70 69 69 70 69 70]
+        >>> print (linear_blend (im, 255 - im, 0.25, dtype=float)[0,:3])
+        [68.75 69.75 69.25]
+        >>> ims = numpy.stack ([im, 255 - im])[:,:,:,None]
+        >>> print (linear_blend (ims, ims[::-1], 0.25)[:,0,:3,0])
+        [[ 69  70  69]
+         [186 185 186]]
+        >>> linear_blend (im, im, 0.5, out=numpy.zeros (im.shape, numpy.int16))
+        Traceback (most recent call last):
+        ...
+        ValueError: I can't put a uint8 result of shape (13, 10) in a int16 image of shape (13, 10)!
+    """
+    if dtype is None and im.dtype == numpy.uint8 and im2.dtype == numpy.uint8 \
+       and im.shape == im2.shape:
+        if out is not None:
+            _check_out (out, im.shape, numpy.uint8)
+        if len (im.shape) < 4:
+            return cv2.addWeighted (im, 1 - a, im2, a, 0, dst=out)
+        if out is not None:
+            out = _cv_view (out)
+        return cv2.addWeighted (_cv_view (im), 1 - a, _cv_view (im2), a, 0,
+                                dst=out).reshape (im.shape)
+    if dtype is None:
+        dtype = numpy.result_type (im, im2, a)
+    out = numpy.multiply (im, 1 - a, out=out, dtype=dtype, casting="unsafe")
+    out += numpy.multiply (im2, a, dtype=dtype)
+    return out
 
-def histogram (im):
+def histogram (im, bins=None, limits=None):
     """
     Return a histogram (frequency for each grey level) of the image `im`.
     The maximum pixel value is determined from the image this is use to
@@ -749,8 +2075,25 @@ def histogram (im):
     channel (colour band) and the second the counts for that band's
     pixel values.
 
+    For integer images, the default is one bin per grey level from zero
+    up to the highest value in the image, or from the lowest value if it
+    is negative; boolean images are treated as zeros and ones.  When
+    `limits` are given for an integer image, they are both included, so
+    `hi - lo + 1` bins give one per grey level.  Floating-point images default
+    to 256 bins spanning the range of their values.  Either default can
+    be overridden with `bins` and `limits`, in which case the first value
+    returned holds the lower edge of each bin and values outside
+    `limits` are not counted.  All the pixels are binned in a single
+    vectorized pass, whatever the number of channels.
+
+    A batch of images of shape (N, H, W, C) yields counts of shape
+    (N, C, bins), every image being binned in the same way.
+
     Args:
         im (image): image for which the histogram is to be produced
+        bins (int): number of bins (default: see above)
+        limits (tuple): lowest and highest values to be binned
+                        (default: see above)
 
     Returns:
         x (int): grey-level values for the abscissa (x) axis
@@ -764,44 +2107,155 @@ def histogram (im):
         >>> print (y)
         [ 0  0  0  0  0  0  0  0  0  0 80 13 13  3 13  8]
 
+        >>> x, y = histogram (numpy.dstack ([im, im // 2]))
+        >>> print (y)
+        [[ 0  0  0  0  0  0  0  0  0  0 80 13 13  3 13  8]
+         [ 0  0  0  0  0 93 16 21  0  0  0  0  0  0  0  0]]
+
+        >>> x, y = histogram (im.astype (numpy.uint16) * 1000, 4, (0, 15999))
+        >>> print (x)
+        [    0  4000  8000 12000]
+        >>> print (y)
+        [ 0  0 93 37]
+
+        >>> x, y = histogram (im, limits=(0, 255))
+        >>> print (len (x), x[9:16], y[9:16])
+        256 [ 9 10 11 12 13 14 15] [ 0 80 13 13  3 13  8]
+
+        >>> print (*histogram (numpy.array ([[-3, -1, 0, 2]], numpy.int16)))
+        [-3 -2 -1  0  1  2] [1 0 1 1 0 1]
+
+        >>> print (*histogram (numpy.array ([[True, False, True]])))
+        [0 1] [1 2]
+
+        >>> x, y = histogram (im / 15.0, bins=3, limits=(0.0, 1.0))
+        >>> print (y)
+        [  0   0 130]
+
+        >>> x, y = histogram (numpy.stack ([im, im // 2])[:,:,:,None])
+        >>> print (len (x), y.shape, y[1,0,5:8])
+        16 (2, 1, 16) [93 16 21]
     """
-    levels = highest(im) + 1
-    vals = numpy.array(range(levels), dtype=int)
-    if len (im.shape) == 2: 
-        # It's a monochrome image, so we have only one histogram.
-        ny, nx = im.shape
-        hist = numpy.zeros (levels, dtype=int)
-        for y in range (0, ny):
-            for x in range (0, nx):
-                v = im[y,x]
-                hist[v] += 1
+    # ASIDE: The obvious way of forming a histogram is to visit each pixel in
+    # turn and increment the appropriate count, but doing that in Python is
+    # painfully slow for real-sized images.  Instead, we turn every pixel into
+    # a bin number with whole-array operations and let numpy.bincount do the
+    # counting.  Multi-channel images are handled in the same pass by offsetting
+    # the bin numbers of channel c by c * levels, so that each channel ends up
+    # in its own section of the single array of counts.  For 8- and 16-bit
+    # images, OpenCV's calcHist does the same job in compiled code.
+    if len (im.shape) == 4:
+        return _batch_histogram (im, bins, limits)
+    if im.dtype == numpy.bool_:
+        im = im.view (numpy.uint8)
+    nc = 1 if len (im.shape) < 3 else im.shape[2]
+    integral = numpy.issubdtype (im.dtype, numpy.integer)
+
+    unsigned = im.dtype.kind == "u" or (integral and lowest (im) >= 0)
+    if bins is None and limits is None and unsigned:
+        # The usual case: one bin per grey level.  For 8- and 16-bit images we
+        # know the largest possible value, so we count into that many bins and
+        # trim off the empty ones at the top afterwards, saving the pass over
+        # the image needed to find its highest value.  OpenCV's calcHist is
+        # several times faster than bincount for these types.
+        if im.dtype == numpy.uint8 or im.dtype == numpy.uint16:
+            levels = 1 << (8 * im.dtype.itemsize)
+            hist = numpy.empty ((nc, levels), dtype=int)
+            for c in range (0, nc):
+                h = cv2.calcHist ([im], [c], None, [levels], [0, levels])
+                hist[c] = h.ravel ()
+        else:
+            levels = int (highest (im)) + 1
+            idx = im.reshape (-1, nc).astype (numpy.intp)
+            idx += numpy.arange (nc) * levels
+            hist = numpy.bincount (idx.ravel (), minlength=nc*levels)
+            hist = hist.reshape (nc, levels)
+        used = numpy.flatnonzero (hist.any (axis=0))
+        levels = int (used[-1]) + 1 if len (used) > 0 else 1
+        hist = hist[:,:levels]
+        vals = numpy.arange (levels)
     else:
-        # It's a multi-channel image, so we have a separate histogram for
-        # each of its channels.
-        ny, nx, nc = im.shape
-        hist = numpy.zeros ((nc,levels), dtype=int)
-        for c in range(0, nc):
-            for y in range (0, ny):
-                for x in range (0, nx):
-                    v = im[y,x,c]
-                    hist[c,v] += 1
+        # Work out the bins and the range of values that they cover.
+        if limits is None:
+            lo, hi = float (lowest (im)), float (highest (im))
+        else:
+            lo, hi = limits
+        if bins is None:
+            bins = int (hi - lo) + 1 if integral else 256
+        # Integer limits are inclusive, so they span hi - lo + 1 grey levels.
+        if integral:
+            width = (hi - lo + 1) / bins
+            vals = numpy.floor (lo + width * numpy.arange (bins)).astype (int)
+        else:
+            width = (hi - lo) / bins if hi > lo else 1.0
+            vals = lo + width * numpy.arange (bins)
+
+        # Convert pixel values into bin numbers, discarding those outside the
+        # range and putting those equal to the upper limit into the top bin.
+        # Out-of-range pixels are sent to an extra bin which is dropped.
+        ft = numpy.float64 if integral else numpy.result_type (im.dtype, numpy.float32)
+        t = numpy.subtract (im.reshape (-1, nc), lo, dtype=ft)
+        t *= 1.0 / width
+        outside = (t < 0) | (t > bins)
+        idx = numpy.minimum (t, bins - 1).astype (numpy.intp)
+        idx += numpy.arange (nc) * bins
+        idx[outside] = nc * bins
+        hist = numpy.bincount (idx.ravel (), minlength=nc*bins+1)
+        hist = hist[:-1].reshape (nc, bins)
+
+    # Monochrome images have a single-index histogram.
+    if len (im.shape) < 3:
+        hist = hist[0]
+    return vals, hist
+
+def _batch_histogram (ims, bins, limits):
+    "Return the histograms of a batch of images, binned in the same way."
+    # Images are binned one at a time, as calcHist is quicker than bincount
+    # on the whole batch.  Binning by grey level gives each image as many bins
+    # as it needs, so the shorter histograms are padded to the longest.  The
+    # other binning needs the same limits for every image.
+    if limits is None and (bins is not None or ims.dtype.kind != "u"):
+        lo, hi = extremes (ims)
+        lo, hi = lo.min (), hi.max ()
+        if bins is not None or lo < 0 or ims.dtype.kind == "f":
+            limits = float (lo), float (hi)
+    parts = [histogram (im, bins, limits) for im in ims]
+    vals = max ((x for x, _ in parts), key=len)
+    hist = numpy.zeros ((len (ims), ims.shape[3], len (vals)), dtype=int)
+    for n, (_, y) in enumerate (parts):
+        hist[n,:,:y.shape[1]] = y
     return vals, hist
 
-def binarize (im, threshold, below=0, above=255):
+def binarize (im, threshold, below=0, above=255, out=None):
     """Threshold image `im` at value `thresh`, setting pixels with value
     below `thresh` to `below` and those with larger values to `above`.
-    The resulting image is returned.
+    The resulting image is returned, of the same type as `im`.  A batch
+    of images is binarized in a single call.
     
     Args:
         im (image): image to be thresholded and binarized
         thresh (float): threshold value
         below (float): value to which pixels lower than `thresh` are set
         above (float): value to which pixels greater than `thresh` are set
+        out (image): image to hold the result, which may be `im` itself
+                     (default: a new image)
     Returns:
         bim (image): binarized image
 
+    Raises:
+        ValueError: when `below` or `above` cannot be held in an image
+                    of the type of `im`
+
     Tests:
         >>> im = testimage ()
+        >>> binarize (im, 12, 0, 300)
+        Traceback (most recent call last):
+            ...
+        ValueError: I can't set pixels of a uint8 image to 300!
+        >>> binarize (im.astype (numpy.int16), 12, -40000)
+        Traceback (most recent call last):
+            ...
+        ValueError: I can't set pixels of a int16 image to -40000!
         >>> bim = binarize (im, 12, 7, 25)
         >>> print (bim)
         [[ 7  7  7  7  7  7  7  7  7  7]
@@ -818,11 +2272,27 @@ def binarize (im, threshold, below=0, above=255):
          [ 7  7  7  7  7  7  7  7  7  7]
          [ 7  7  7  7  7  7  7  7  7  7]]
     """
-    out = im.copy()
-    out[im > threshold] = above
-    out[im <= threshold] = below
-
-    
+    # ASIDE: For uint8 images, the result for each of the 256 possible input
+    # values can be worked out in advance and stored in a lookup table, which
+    # is then applied to every pixel in a single pass; that is much quicker
+    # than comparing the image with the threshold and assigning values to it.
+    # See the section on lookup tables below.
+    # Values that integer types cannot hold would otherwise wrap around.
+    if im.dtype.kind in "biu":
+        if im.dtype == numpy.bool_:
+            lo, hi = 0, 1
+        else:
+            lo, hi = numpy.iinfo (im.dtype).min, numpy.iinfo (im.dtype).max
+        for v in below, above:
+            if not lo <= v <= hi:
+                raise ValueError ("I can't set pixels of a %s image to %s!" %
+                                  (im.dtype, v))
+    if im.dtype == numpy.uint8:
+        return threshold_lut (threshold, below, above) (im, out)
+    bim = numpy.where (im > threshold, above, below).astype (im.dtype)
+    if out is None:
+        return bim
+    numpy.copyto (out, bim)
     return out
 
 def hsv_to_cv2 (h, s, v):
@@ -851,7 +2321,7 @@ def largest_contour (contours):
         contours (list): list of contours return by cv2.findContours
 
     Returns:
-        contour (contour): a single contour
+        contour (contour): a single contour, or None if there are none
 
     Tests:
         >>> im = arrowhead ()
@@ -861,12 +2331,15 @@ def largest_contour (contours):
         >>> print (cv2.contourArea (lc))
         5.0
     """
-    for
-    return None
+    if len (contours) == 0:
+        return None
+    area = contour_features (contours, hulls=False)["area"]
+    return contours[numpy.argmax (area)]
 
 def circularity (c):
     """Return the circularity of the contour `c`, returned from the
-    OpenCV routine cv2.findContours.
+    OpenCV routine cv2.findContours.  This is the square of its perimeter
+    divided by its area, which is smallest (4 pi) for a circle.
 
     Args:
         c (contour): contours returned by cv2.findContours
@@ -881,11 +2354,13 @@ def circularity (c):
         >>> print ("%.4f" % circularity (lc))
         68.3411
     """
-    return None
+    return float (contour_features ([c], hulls=False)["circularity"][0])
 
 def rectangularity (c):
     """Return the rectangularity of the contour `c`, returned from the
-    OpenCV routine cv2.findContours.
+    OpenCV routine cv2.findContours.  This is the area of the smallest
+    (rotated) rectangle that encloses it divided by its area, which is
+    smallest (unity) for a rectangle.
 
     Args:
         c (contour): contours returned by cv2.findContours
@@ -900,14 +2375,2094 @@ def rectangularity (c):
         >>> print ("%.4f" % rectangularity (lc))
         4.8276
     """
-    return None
-def convolution(im,k,padding=None):
-    if padding:
-        im = image_padding(padding)
-    size = im.shape
+    return float (contour_features ([c])["rectangularity"][0])
+
+# The fields of the structured array returned by contour_features.
+CONTOUR_FEATURES = numpy.dtype ([
+    ("area",           numpy.float64),
+    ("perimeter",      numpy.float64),
+    ("bbox",           numpy.int32, (4,)),
+    ("centroid",       numpy.float64, (2,)),
+    ("circularity",    numpy.float64),
+    ("rectangularity", numpy.float64),
+    ("solidity",       numpy.float64),
+])
+
+def contour_features (contours, hulls=True):
+    """Return the features of all the contours found by cv2.findContours
+    as a numpy structured array with one element per contour.  Its fields
+    are:
+
+        area: the area enclosed, as returned by cv2.contourArea
+        perimeter: the perimeter, as returned by cv2.arcLength
+        bbox: x, y, width and height, as returned by cv2.boundingRect
+        centroid: the x and y coordinates of the centre of mass
+        circularity: perimeter squared divided by area (see `circularity`)
+        rectangularity: see `rectangularity`
+        solidity: area divided by the area of the convex hull
+
+    so that contours can be selected with numpy expressions rather than by
+    looping over them in Python.  Degenerate contours, with zero area,
+    have infinite circularity and rectangularity and zero solidity; their
+    centroid is the mean of their points.
+
+    Args:
+        contours (list): list of contours returned by cv2.findContours
+        hulls (bool): when False, the rectangularity and solidity, which
+                      involve calling OpenCV on each contour in turn, are
+                      not worked out and are NaN (default: True)
+
+    Returns:
+        features (array): structured array of the features
+
+    Tests:
+        >>> im = arrowhead ()
+        >>> im[1,1] = 255
+        >>> c, junk = cv2.findContours (im, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        >>> f = contour_features (c)
+        >>> print (f["area"], f["perimeter"].round (4))
+        [5. 0.] [18.4853  0.    ]
+        >>> print (f["bbox"])
+        [[2 1 5 8]
+         [1 1 1 1]]
+        >>> print (f["centroid"].round (4))
+        [[4.     2.5333]
+         [1.     1.    ]]
+        >>> print (f["solidity"].round (4), f["rectangularity"].round (4))
+        [0.3571 0.    ] [4.8276    inf]
+        >>> big = f[f["area"] > 1]
+        >>> print (len (big), big["circularity"].round (4))
+        1 [68.3411]
+    """
+    # ASIDE: The area, perimeter, bounding box and centroid of every contour
+    # are calculated at once: the points of all the contours are joined into
+    # a single array, each point paired with the next one round its contour,
+    # and the sums over each contour formed using numpy's reduceat.  Only the
+    # convex hull and minimum-area rectangle require a call per contour.
+    n = len (contours)
+    features = numpy.zeros (n, dtype=CONTOUR_FEATURES)
+    if n == 0:
+        return features
+    lengths = numpy.fromiter (map (len, contours), dtype=numpy.intp, count=n)
+    starts = numpy.concatenate (([0], numpy.cumsum (lengths)[:-1]))
+    pts = numpy.concatenate (contours).reshape (-1, 2)
+    x0, y0 = pts.T.astype (numpy.float64)
+    nxt = numpy.arange (1, len (pts) + 1)
+    nxt[starts + lengths - 1] = starts
+    x1, y1 = x0[nxt], y0[nxt]
+
+    # The area and centroid follow from the shoelace formula.
+    cross = x0 * y1 - x1 * y0
+    a2 = numpy.add.reduceat (cross, starts)
+    area = numpy.abs (a2) / 2
+    sx = numpy.add.reduceat ((x0 + x1) * cross, starts)
+    sy = numpy.add.reduceat ((y0 + y1) * cross, starts)
+    mx = numpy.add.reduceat (x0, starts) / lengths
+    my = numpy.add.reduceat (y0, starts) / lengths
+    with numpy.errstate (divide="ignore", invalid="ignore"):
+        cx = numpy.where (a2 != 0, sx / (3 * a2), mx)
+        cy = numpy.where (a2 != 0, sy / (3 * a2), my)
+    seg = numpy.hypot (x1 - x0, y1 - y0)
+    perim = numpy.add.reduceat (seg, starts)
+    lo = numpy.minimum.reduceat (pts, starts)
+    hi = numpy.maximum.reduceat (pts, starts)
+
+    features["area"] = area
+    features["perimeter"] = perim
+    features["bbox"][:,:2] = lo
+    features["bbox"][:,2:] = hi - lo + 1
+    features["centroid"][:,0] = cx
+    features["centroid"][:,1] = cy
+    with numpy.errstate (divide="ignore", invalid="ignore"):
+        features["circularity"] = numpy.where (area > 0, perim**2 / area,
+                                               numpy.inf)
+        if hulls:
+            # Contours that enclose nothing, which are often the majority,
+            # need no hull.
+            hull = numpy.zeros (n)
+            rect = numpy.zeros (n)
+            for i in numpy.flatnonzero (area):
+                hull[i] = cv2.contourArea (cv2.convexHull (contours[i]))
+                rect[i] = numpy.prod (cv2.minAreaRect (contours[i])[1])
+            features["rectangularity"] = numpy.where (area > 0, rect / area,
+                                                      numpy.inf)
+            features["solidity"] = numpy.where (hull > 0, area / hull, 0)
+        else:
+            features["rectangularity"] = numpy.nan
+            features["solidity"] = numpy.nan
+    return features
+
+# The padding modes supported by convolution and their OpenCV equivalents.
+# OpenCV's filtering routines cannot wrap around, so "wrap" is handled by
+# padding the image explicitly.
+PADDING = {
+    "constant":   cv2.BORDER_CONSTANT,
+    "replicate":  cv2.BORDER_REPLICATE,
+    "reflect":    cv2.BORDER_REFLECT,
+    "reflect101": cv2.BORDER_REFLECT_101,
+    "wrap":       cv2.BORDER_WRAP,
+}
+
+# A marker for separable factors that have not yet been worked out, as None
+# means that a kernel is known not to be separable.
+_UNKNOWN = object ()
+
+def convolution (im, k, padding="reflect101", method="auto"):
+    """Convolve image `im` with kernel `k`, returning a floating-point
+    result the same size as `im`.  Unlike cv2.filter2D, which performs
+    correlation, the kernel is flipped as the mathematical definition of
+    convolution requires; this makes no difference for symmetric kernels.
+    The centre of the kernel is at (rows//2, columns//2).
+
+    The pixels needed beyond the edges of the image are generated
+    according to `padding`, one of "constant" (zeros), "replicate",
+    "reflect", "reflect101" (OpenCV's default) or "wrap".  If `padding`
+    is None, the image is not padded and the result is smaller than `im`
+    by the size of the kernel less one.
+
+    The convolution is performed by one of several methods:
+    "direct" applies the kernel via cv2.filter2D; "separable" applies the
+    two 1-D factors of a rank-1 kernel in turn; and "fft" multiplies the
+    Fourier transforms of the image and kernel.  The default, "auto",
+    uses `convolution_method` to choose the fastest.
+
+    The kernel may be given by name, in which case it is obtained from
+    the kernel registry (see `kernel_info`) along with its separable
+    factors, which saves working them out on every call.
+
+    Args:
+        im (image): image to be convolved
+        k (array or str): 2-D kernel to convolve it with, or its name
+        padding (str): how the image is padded (default: "reflect101")
+        method (str): how the convolution is performed (default: "auto")
+
+    Returns:
+        cim (image): float32 result (float64 for float64 images)
+
+    Raises:
+        ValueError: when invoked with an unsupported padding or method
+
+    Tests:
+        >>> im = numpy.zeros ((5, 5), dtype="uint8")
+        >>> im[2,2] = 8
+        >>> k = numpy.array ([[0, 0, 0], [1, 2, 0], [0, 0, 0]])
+        >>> print (convolution (im, k, method="direct"))
+        [[ 0.  0.  0.  0.  0.]
+         [ 0.  0.  0.  0.  0.]
+         [ 0.  8. 16.  0.  0.]
+         [ 0.  0.  0.  0.  0.]
+         [ 0.  0.  0.  0.  0.]]
+
+        >>> im = testimage ()
+        >>> k = numpy.outer ([1, 2, 1], [1, 0, -1])
+        >>> ref = convolution (im, k, "wrap", "direct")
+        >>> for m in "separable", "fft":
+        ...     cim = convolution (im, k, "wrap", m)
+        ...     print (m, numpy.allclose (cim, ref, atol=1.0e-4))
+        separable True
+        fft True
+        >>> convolution (im, k, None).shape
+        (11, 8)
+        >>> cim = convolution (im, "sobelx")
+        >>> print (numpy.allclose (cim * 8, convolution (im, k), atol=1.0e-4))
+        True
+        >>> convolution (im, k, "mirror")
+        Traceback (most recent call last):
+         ...
+        ValueError: I don't know how to pad with 'mirror'!
+    """
+    # ASIDE: Convolution is the same as correlation with a flipped kernel, and
+    # correlation is what OpenCV's filtering routines do.  Flipping the kernel
+    # moves its centre, so we tell OpenCV where the centre of the flipped
+    # kernel is via the anchor argument.
+    if padding is not None and padding not in PADDING:
+        raise ValueError ("I don't know how to pad with '%s'!" % padding)
+    k, factors = _kernel_factors (k)
+    if method == "auto":
+        method = convolution_method (im.shape, k, padding, factors)
+    dtype = numpy.float64 if im.dtype == numpy.float64 else numpy.float32
+    if method == "fft":
+        return _fft_convolution (im, k, padding, dtype)
+    if method not in ("direct", "separable"):
+        raise ValueError ("I don't know the convolution method '%s'!" % method)
+
+    # Pad the image ourselves if OpenCV can't, cropping the result afterwards.
+    kh, kw = k.shape
+    top, bottom = kh - 1 - kh // 2, kh // 2
+    left, right = kw - 1 - kw // 2, kw // 2
+    ny, nx = im.shape[:2]
+    border = cv2.BORDER_CONSTANT
+    if padding == "wrap":
+        im = cv2.copyMakeBorder (im, top, bottom, left, right, cv2.BORDER_WRAP)
+        ylo, yhi, xlo, xhi = top, top + ny, left, left + nx
+    elif padding is None:
+        ylo, yhi, xlo, xhi = top, ny - bottom, left, nx - right
+    else:
+        border = PADDING[padding]
+        ylo, yhi, xlo, xhi = 0, ny, 0, nx
+
+    if method == "separable":
+        if factors is _UNKNOWN: factors = separate_kernel (k)
+        if factors is None:
+            raise ValueError ("I can't separate a kernel of rank > 1!")
+    else:
+        factors = None
+    cim = _filter (im, k, factors, dtype, border)
+    return cim[ylo:yhi,xlo:xhi]
+
+#-------------------------------------------------------------------------------
+def convolution_method (shape, k, padding="reflect101", factors=_UNKNOWN):
+    """Return the name of the method that `convolution` would use to
+    convolve an image of size `shape` with kernel `k`.
+
+    Rank-1 kernels, such as the blur, gaussian and sobel masks, are
+    fastest when applied as two 1-D passes: for a 5 x 5 kernel on a
+    1024 x 1024 image this is about five times faster than applying the
+    full kernel, though for tiny images the time taken to factorize the
+    kernel outweighs the gain.  Other kernels are applied directly via
+    cv2.filter2D, which itself switches to a Fourier-domain method for kernels of
+    11 x 11 and larger; timings show that this is as fast as our own
+    Fourier transforms when the image is padded.  The exception is
+    wrap-around padding, which cv2.filter2D cannot do: wrap-around
+    convolution is exactly the product of the Fourier transforms of the
+    unpadded image and kernel, and that is faster when the kernel is
+    large and the image not too many times bigger than it.
+
+    Args:
+        shape (tuple): shape of the image to be convolved
+        k (array or str): 2-D kernel to convolve it with, or its name
+        padding (str): how the image is padded (default: "reflect101")
+        factors (tuple): separable factors of `k` if already known, or
+                         None if `k` is known not to be separable
+
+    Returns:
+        method (str): one of "direct", "separable" or "fft"
+
+    Tests:
+        >>> convolution_method ((480, 640), create_mask ("gaussian5"))
+        'separable'
+        >>> convolution_method ((480, 640), create_mask ("laplacian"))
+        'direct'
+        >>> convolution_method ((100, 100), numpy.eye (15), "wrap")
+        'fft'
+        >>> convolution_method ((480, 640), numpy.eye (15), "wrap")
+        'direct'
+    """
+    if factors is _UNKNOWN or isinstance (k, str):
+        k, factors = _kernel_factors (k)
+    kh, kw = numpy.shape (k)
+    if kh * kw == 1:
+        return "direct"
+    if shape[0] * shape[1] >= SEPARABLE_MIN_PIXELS:
+        if factors is _UNKNOWN: factors = separate_kernel (k)
+        if factors is not None:
+            return "separable"
+    if padding == "wrap" and kh * kw >= FFT_MIN_AREA \
+       and shape[0] * shape[1] <= FFT_MAX_RATIO * kh * kw \
+       and kh <= shape[0] and kw <= shape[1]:
+        return "fft"
+    return "direct"
+
+# The smallest image area for which separating a kernel is worthwhile; below
+# this, the time taken to separate the kernel exceeds the time saved.
+SEPARABLE_MIN_PIXELS = 128 * 128
+
+# The smallest kernel area for which Fourier-domain convolution is used when
+# wrapping around the edges of images, and the largest ratio of the image area
+# to the kernel area; these were determined by timing with the benchmark
+# program.
+FFT_MIN_AREA = 100
+FFT_MAX_RATIO = 100
+
+#-------------------------------------------------------------------------------
+def separate_kernel (k, tol=1.0e-6):
+    """Return the 1-D column and row factors of the 2-D kernel `k`, whose
+    outer product is `k`, or None if `k` is not of rank one and so cannot
+    be separated.
+
+    Args:
+        k (array): the 2-D kernel to be separated
+        tol (float): largest ratio of the second to first singular values
+                     for the kernel to be considered separable
+                     (default: 1.0e-6)
+
+    Returns:
+        col (array): factor to be applied along columns
+        row (array): factor to be applied along rows
+
+    Tests:
+        >>> col, row = separate_kernel (numpy.outer ([1, 2, 1], [1, 0, -1]))
+        >>> print (numpy.round (col / col[0]), numpy.round (row * col[0]) + 0)
+        [1. 2. 1.] [ 1.  0. -1.]
+        >>> print (separate_kernel (create_mask ("laplacian")))
+        None
+    """
+    k = numpy.asarray (k, dtype=numpy.float64)
+    u, s, vt = numpy.linalg.svd (k)
+    if s[0] == 0 or (len (s) > 1 and s[1] > tol * s[0]):
+        return None
+    scale = numpy.sqrt (s[0])
+    col = u[:,0] * scale
+    row = vt[0] * scale
+    # The SVD's choice of sign is arbitrary, so make the column factor mostly
+    # positive; it's then easier to see what the factors do.
+    if col.sum () < 0:
+        col, row = -col, -row
+    return col, row
+
+#-------------------------------------------------------------------------------
+def _kernel_factors (k):
+    "Return a kernel and its separable factors, looking it up if named."
+    if isinstance (k, str):
+        info = kernel_info (k)
+        return info["float64"], info["factors"]
+    return numpy.asarray (k), _UNKNOWN
+
+#-------------------------------------------------------------------------------
+def _filter (im, k, factors, dtype, border, dst=None):
+    """Convolve via OpenCV, separably if `factors` are given, into `dst` if
+    it is given; see convolution."""
+    kh, kw = k.shape
+    anchor = (kw - 1 - kw // 2, kh - 1 - kh // 2)
+    ddepth = cv2.CV_64F if dtype == numpy.float64 else cv2.CV_32F
+    if factors is None:
+        kf = numpy.ascontiguousarray (k[::-1,::-1], dtype=dtype)
+        return cv2.filter2D (im, ddepth, kf, dst=dst, anchor=anchor,
+                             borderType=border)
+    col, row = factors
+    return cv2.sepFilter2D (im, ddepth, row[::-1].astype (dtype),
+                            col[::-1].astype (dtype), dst=dst, anchor=anchor,
+                            borderType=border)
+
+#-------------------------------------------------------------------------------
+def _fft_convolution (im, k, padding, dtype):
+    "Convolve via the Fourier transform; see convolution."
+    kh, kw = k.shape
+    ny, nx = im.shape[:2]
+    top, bottom = kh - 1 - kh // 2, kh // 2
+    left, right = kw - 1 - kw // 2, kw // 2
+    kf = k.astype (dtype)
+    if len (im.shape) > 2: kf = kf[:,:,None]
+
+    if padding == "wrap" and kh <= ny and kw <= nx:
+        # Wrap-around convolution is what the discrete Fourier transform does
+        # naturally, provided the kernel's centre is moved to the origin.
+        big = numpy.zeros ((ny, nx) + im.shape[2:], dtype=dtype)
+        big[:kh,:kw] = kf
+        big = numpy.roll (big, (-(kh // 2), -(kw // 2)), axis=(0, 1))
+        f = numpy.fft.rfft2 (im.astype (dtype), axes=(0, 1))
+        f *= numpy.fft.rfft2 (big, axes=(0, 1))
+        return numpy.fft.irfft2 (f, (ny, nx), axes=(0, 1)).astype (dtype)
+
+    # Otherwise, pad the image and keep the part of the full convolution that
+    # corresponds to the unpadded image.
+    if padding is not None:
+        im = cv2.copyMakeBorder (im, top, bottom, left, right, PADDING[padding])
+    py, px = im.shape[:2]
+    size = (cv2.getOptimalDFTSize (py + kh - 1),
+            cv2.getOptimalDFTSize (px + kw - 1))
+    f = numpy.fft.rfft2 (im.astype (dtype), size, axes=(0, 1))
+    f *= numpy.fft.rfft2 (kf, size, axes=(0, 1))
+    cim = numpy.fft.irfft2 (f, size, axes=(0, 1))
+    return cim[kh-1:py,kw-1:px].astype (dtype)
+
+#-------------------------------------------------------------------------------
+# LOOKUP TABLES.
+#-------------------------------------------------------------------------------
+# A point operation is one in which the output value of each pixel depends
+# only on its input value: thresholding, contrast and brightness adjustment,
+# inversion, gamma correction and so on.  For uint8 images there are only 256
+# possible input values, so any point operation can be worked out for all of
+# them in advance and stored in a lookup table, and then applied to an image
+# in a single pass by cv2.LUT.  Better still, a chain of point operations can
+# be combined into a single table, so applying five of them costs no more than
+# applying one.
+
+class Lut:
+    """A lookup table that performs a point operation on uint8 images.
+    `table` holds the 256 output values, or has shape (256, nc) to hold a
+    separate table for each of the nc channels of colour images.  A
+    whole batch of images (see `batch_files`) is looked up in one call.
+
+    Args:
+        table (array): the output value for each input value
+
+    Raises:
+        ValueError: when invoked with a table of the wrong shape
+
+    Tests:
+        >>> linear_lut (2, 0) (testimage (), out=testimage ()[:,::2])
+        Traceback (most recent call last):
+        ...
+        ValueError: I can't put a uint8 result of shape (13, 10) in a non-contiguous uint8 image of shape (13, 5)!
+        >>> im = testimage ()
+        >>> lut = linear_lut (20, -100).then (invert_lut ())
+        >>> print (lut (im)[0])
+        [155 115 135 135 115 135 155 115 135 115]
+        >>> chain = compose_luts (invert_lut (), invert_lut (), gamma_lut (1),
+        ...                       linear_lut (1, 0), invert_lut ())
+        >>> print (numpy.array_equal (chain (im), 255 - im))
+        True
+        >>> bgr = numpy.dstack ([im, im, im])
+        >>> lut = channel_lut (invert_lut (), Lut (numpy.arange (256)),
+        ...                    threshold_lut (12))
+        >>> print (lut (bgr)[0,:4])
+        [[245  10   0]
+         [243  12   0]
+         [244  11   0]
+         [244  11   0]]
+    """
+
+    def __init__ (self, table):
+        table = numpy.clip (numpy.rint (numpy.asarray (table)), 0, 255)
+        if table.shape[0] != 256 or len (table.shape) > 2:
+            raise ValueError ("A lookup table needs 256 entries, not %s!" %
+                              (table.shape,))
+        self.table = table.astype (numpy.uint8)
+
+    def __call__ (self, im, out=None):
+        """Apply the table to the uint8 image `im`.
+
+        Args:
+            im (image): image to which the table is to be applied
+            out (image): image to hold the result, which may be `im`
+                         itself (default: a new image)
+
+        Returns:
+            lim (image): the result of looking up every pixel of `im`
+
+        Raises:
+            ValueError: when `out` is not a contiguous uint8 image of the
+                        same shape as `im`
+        """
+        if out is not None:
+            _check_out (out, im.shape, numpy.uint8)
+        table = self.table
+        if len (table.shape) == 2:
+            table = table.reshape (1, 256, -1)
+        if len (im.shape) < 4:
+            return cv2.LUT (im, table, dst=out)
+        if out is not None:
+            out = _cv_view (out)
+        return cv2.LUT (_cv_view (im), table, dst=out).reshape (im.shape)
+
+    def then (self, other):
+        """Return the table that performs this table's operation followed
+        by that of `other`.
+
+        Args:
+            other (Lut): table whose operation is to be performed second
+
+        Returns:
+            lut (Lut): the combined table
+        """
+        if len (self.table.shape) == 2 and len (other.table.shape) == 2:
+            table = numpy.take_along_axis (other.table, self.table, axis=0)
+        elif len (other.table.shape) == 2:
+            table = other.table[self.table,:]
+        else:
+            table = other.table[self.table]
+        return Lut (table)
+
+#-------------------------------------------------------------------------------
+def compose_luts (*luts):
+    """Return the single table that applies the tables `luts` in turn.
+
+    Args:
+        luts (Lut): the tables to be combined, in the order they apply
+
+    Returns:
+        lut (Lut): the combined table
+    """
+    result = Lut (numpy.arange (256))
+    for lut in luts:
+        result = result.then (lut)
+    return result
+
+#-------------------------------------------------------------------------------
+def channel_lut (*luts):
+    """Return a table that applies each of `luts` to the corresponding
+    channel of a colour image.
+
+    Args:
+        luts (Lut): the single-channel tables, one per channel
+
+    Returns:
+        lut (Lut): the per-channel table
+    """
+    return Lut (numpy.stack ([lut.table for lut in luts], axis=1))
+
+#-------------------------------------------------------------------------------
+def threshold_lut (threshold, below=0, above=255):
+    """Return a table that does what `binarize` does.
+
+    Args:
+        threshold (float): threshold value
+        below (int): value for pixels not greater than `threshold`
+                     (default: 0)
+        above (int): value for pixels greater than `threshold`
+                     (default: 255)
+
+    Returns:
+        lut (Lut): the table
+    """
+    return Lut (numpy.where (numpy.arange (256) > threshold, above, below))
+
+#-------------------------------------------------------------------------------
+def linear_lut (a, b):
+    """Return a table that calculates a * v + b for each value v, rounded
+    and saturated, as `linear_operation` does for uint8 images.
+
+    Args:
+        a (float): multiplicative modifier, which changes contrast
+        b (float): additive modifier, which changes brightness
+
+    Returns:
+        lut (Lut): the table
+    """
+    return Lut (a * numpy.arange (256) + b)
+
+#-------------------------------------------------------------------------------
+def invert_lut ():
+    """Return a table that inverts images, calculating 255 - v for each
+    value v.
+
+    Returns:
+        lut (Lut): the table
+    """
+    return Lut (255 - numpy.arange (256))
+
+#-------------------------------------------------------------------------------
+def gamma_lut (gamma):
+    """Return a table that performs gamma correction, calculating
+    255 * (v / 255) ** gamma for each value v.
+
+    Args:
+        gamma (float): the exponent
+
+    Returns:
+        lut (Lut): the table
+
+    Tests:
+        >>> print (gamma_lut (0.5).table[[0, 64, 128, 255]])
+        [  0 128 181 255]
+    """
+    return Lut (255 * (numpy.arange (256) / 255) ** gamma)
+
+#-------------------------------------------------------------------------------
+# CONTRAST ENHANCEMENT.
+#-------------------------------------------------------------------------------
+# Stretching or equalizing the contrast of an image is a point operation whose
+# lookup table is worked out from the image's cumulative histogram, so each is
+# a histogram followed by a single pass of cv2.LUT.  Contrast-limited adaptive
+# histogram equalization (CLAHE) works out a separate table for each of a grid
+# of tiles and interpolates between the tables of the four nearest tiles, so
+# that there are no visible seams.  The tiles are independent of one another,
+# so their histograms and their share of the output are worked out in parallel.
+
+def equalize_lut (hist):
+    """Return the table that equalizes the histogram `hist`, calculated
+    as cv2.equalizeHist does: the lowest value present maps to zero and
+    the others in proportion to the number of pixels no brighter.
+
+    Args:
+        hist (array): counts of the 256 values, or an array of shape
+                      (nc, 256) holding the counts of each channel
+
+    Returns:
+        lut (Lut): the table, with a table for each channel if `hist`
+                   holds more than one
+
+    Tests:
+        >>> print (equalize_lut ([0, 2, 0, 2] + [0] * 252).table[:5])
+        [  0   0   0 255 255]
+    """
+    hist = numpy.asarray (hist).reshape (-1, 256)
+    cdf = numpy.cumsum (hist, axis=1)
+    total = cdf[:,-1:]
+    first = numpy.take_along_axis (hist, (hist != 0).argmax (axis=1)[:,None], 1)
+    base = total - first
+    with numpy.errstate (divide="ignore", invalid="ignore"):
+        table = numpy.where (base > 0, (cdf - first) * (255.0 / base), 0)
+    table[hist.cumsum (axis=1) == 0] = 0
+    # An image with a single value is left unchanged.
+    flat = (base == 0).ravel ()
+    table[flat] = numpy.arange (256)
+    return Lut (table[0] if len (table) == 1 else table.T)
+
+#-------------------------------------------------------------------------------
+def equalize (im, out=None):
+    """Equalize the histogram of the uint8 image `im`, spreading its
+    values so that each grey level is roughly equally common.  Each
+    channel of a colour image is equalized separately, as with
+    cv2.equalizeHist.
+
+    Args:
+        im (image): image to be equalized
+        out (image): image to hold the result, which may be `im` itself
+                     (default: a new image)
+
+    Returns:
+        eim (image): the equalized image
+
+    Raises:
+        ValueError: when invoked with an image that is not uint8
+
+    Tests:
+        >>> im = testimage ()
+        >>> print (numpy.array_equal (equalize (im * 16),
+        ...                           cv2.equalizeHist (im * 16)))
+        True
+        >>> print (sorted (set (equalize (im).ravel ().tolist ())))
+        [0, 66, 133, 148, 214, 255]
+    """
+    return equalize_lut (_histogram256 (im)) (im, out=out)
+
+#-------------------------------------------------------------------------------
+def stretch_lut (hist, low=1.0, high=99.0):
+    """Return the table that stretches the contrast of an image with
+    histogram `hist` linearly, so that the `low` percentile of its
+    values maps to zero and the `high` percentile to 255, with values
+    beyond them saturating.
+
+    Args:
+        hist (array): counts of the 256 values, or an array of shape
+                      (nc, 256) whose rows are added together
+        low (float): percentile that is to become black (default: 1)
+        high (float): percentile that is to become white (default: 99)
+
+    Returns:
+        lut (Lut): the table
+
+    Tests:
+        >>> print (stretch_lut ([0] * 100 + [5] * 56 + [0] * 100,
+        ...                     0, 100).table[[99, 100, 128, 155, 156]])
+        [  0   0 130 255 255]
+    """
+    hist = numpy.asarray (hist).reshape (-1, 256).sum (axis=0)
+    cdf = numpy.cumsum (hist)
+    lo, hi = numpy.searchsorted (cdf, [cdf[-1] * low / 100.0,
+                                       cdf[-1] * high / 100.0])
+    if low == 0:
+        lo = numpy.flatnonzero (hist)[0] if cdf[-1] > 0 else 0
+    lo, hi = int (lo), int (min (hi, 255))
+    if hi <= lo:
+        return Lut (numpy.arange (256))
+    scale = 255.0 / (hi - lo)
+    return linear_lut (scale, -lo * scale)
+
+#-------------------------------------------------------------------------------
+def stretch (im, low=1.0, high=99.0, out=None):
+    """Stretch the contrast of the uint8 image `im` linearly so that its
+    `low` percentile becomes black and its `high` percentile white.
+    The channels of a colour image are stretched together, so colours
+    keep their hue.  This is the data-driven equivalent of choosing the
+    gain and offset of `linear_operation` by hand, and is particularly
+    useful for over- and under-exposed images.
+
+    Args:
+        im (image): image whose contrast is to be stretched
+        low (float): percentile that is to become black (default: 1)
+        high (float): percentile that is to become white (default: 99)
+        out (image): image to hold the result, which may be `im` itself
+                     (default: a new image)
+
+    Returns:
+        sim (image): the stretched image
+
+    Raises:
+        ValueError: when invoked with an image that is not uint8
+
+    Tests:
+        >>> im = testimage ()
+        >>> sim = stretch (im, 0, 100)
+        >>> print (lowest (sim), highest (sim))
+        0 255
+        >>> print (sim[0])
+        [  0 102  51  51 102  51   0 102  51 102]
+    """
+    return stretch_lut (_histogram256 (im), low, high) (im, out=out)
+
+#-------------------------------------------------------------------------------
+def clahe (im, clip=2.0, tiles=(8, 8), workers=0, out=None):
+    """Perform contrast-limited adaptive histogram equalization on the
+    uint8 image `im`.  The image is divided into a grid of `tiles`, each
+    tile's histogram has its counts limited to `clip` times their mean,
+    with the excess shared out among all the values, and it is then
+    equalized.  Each pixel is looked up in the tables of the four tiles
+    whose centres surround it and the results interpolated bilinearly.
+    This is the algorithm of OpenCV's createCLAHE, including the way it
+    pads images that do not divide exactly into tiles, and the results
+    agree with it to within one grey level.  Each channel of a colour
+    image is processed separately.
+
+    The per-tile work is shared among `workers` threads, or as many as
+    there are processors if `workers` is zero.
+
+    Args:
+        im (image): image to be equalized
+        clip (float): contrast limit, or zero for none (default: 2)
+        tiles (tuple): number of tiles down and across (default: 8, 8)
+        workers (int): number of threads to use, or zero to use one
+                       per processor (default: 0)
+        out (image): image to hold the result (default: a new image)
+
+    Returns:
+        cim (image): the equalized image
+
+    Raises:
+        ValueError: when invoked with an image that is not uint8
+
+    Tests:
+        >>> im = cv2.imread (os.path.join (os.path.dirname (__file__),
+        ...                  "Images", "stomata.jpg"), cv2.IMREAD_GRAYSCALE)
+        >>> cim = clahe (im, 3.0, (6, 5))
+        >>> ref = cv2.createCLAHE (3.0, (5, 6)).apply (im)
+        >>> print (numpy.abs (cim.astype (int) - ref).max () <= 1)
+        True
+        >>> im = cv2.resize (im, (240, 121))
+        >>> cim = clahe (im, 2.0, (4, 8))
+        >>> ref = cv2.createCLAHE (2.0, (8, 4)).apply (im)
+        >>> print (numpy.abs (cim.astype (int) - ref).max () <= 1)
+        True
+        >>> bgr = cv2.merge ([im, 255 - im, im // 2])
+        >>> print (numpy.array_equal (clahe (bgr)[:,:,1], clahe (255 - im)))
+        True
+    """
+    if im.dtype != numpy.uint8:
+        raise ValueError ("CLAHE needs a uint8 image, not %s!" % im.dtype)
+    if len (im.shape) > 2:
+        if out is None:
+            out = numpy.empty_like (im)
+        for c in range (0, im.shape[2]):
+            out[:,:,c] = clahe (numpy.ascontiguousarray (im[:,:,c]), clip,
+                                tiles, workers)
+        return out
+    import concurrent.futures
+    ty, tx = tiles
+    ny, nx = im.shape
+
+    # Like OpenCV, pad the image out to a whole number of tiles unless it
+    # divides into them exactly; when it doesn't, OpenCV adds ty rows or
+    # tx columns to a dimension that does divide exactly, so we do too.
+    if ny % ty == 0 and nx % tx == 0:
+        py, px = 0, 0
+    else:
+        py, px = ty - ny % ty, tx - nx % tx
+    padded = cv2.copyMakeBorder (im, 0, py, 0, px, cv2.BORDER_REFLECT_101) \
+        if py > 0 or px > 0 else im
+    th, tw = (ny + py) // ty, (nx + px) // tx
+
+    # The work is shared out a band of tiles at a time, which keeps the
+    # overhead of the threads small compared with the work each does.
+    if workers <= 0:
+        workers = os.cpu_count () or 1
+    if workers > 1:
+        pool = concurrent.futures.ThreadPoolExecutor (workers)
+        run = lambda func, n: list (pool.map (func, range (0, n)))
+    else:
+        pool = None
+        run = lambda func, n: list (map (func, range (0, n)))
+
+    # Histograms of the tiles, clipped and turned into lookup tables.
+    def band_hist (y):
+        band = padded[y*th:(y+1)*th]
+        return [cv2.calcHist ([band[:,x*tw:(x+1)*tw]], [0], None, [256],
+                              [0, 256]).ravel () for x in range (0, tx)]
+    hist = numpy.array (run (band_hist, ty), dtype=numpy.int64)
+    luts = _clahe_luts (hist.reshape (ty * tx, 256), clip, th * tw)
+    luts = luts.reshape (ty, tx, 256)
+
+    # Interpolate between the tables.  Between the centres of each 2x2 block
+    # of tiles, every pixel uses the same four tables, so each block is
+    # looked up four times by cv2.LUT and the results blended with weights
+    # that vary along the rows and columns.  Beyond the outermost centres
+    # there are fewer than four distinct tables, but the same code works.
+    if out is None:
+        out = numpy.empty_like (im)
+    ycuts = numpy.ceil ((numpy.arange (-1, ty + 1) + 0.5) * th).astype (int)
+    xcuts = numpy.ceil ((numpy.arange (-1, tx + 1) + 0.5) * tw).astype (int)
+    ycuts = numpy.clip (ycuts, 0, ny)
+    xcuts = numpy.clip (xcuts, 0, nx)
+    ycuts[-1], xcuts[-1] = ny, nx
+    ywt = (numpy.arange (ny) / th - 0.5) % 1.0
+    xwt = (numpy.arange (nx) / tw - 0.5) % 1.0
+    ywt[:ycuts[1]] = 0
+    xwt[:xcuts[1]] = 0
+    ywt = ywt.astype (numpy.float32)[:,None]
+    xwt = xwt.astype (numpy.float32)
+    def blend_band (j):
+        ylo, yhi = ycuts[j], ycuts[j+1]
+        y1, y2 = max (j - 1, 0), min (j, ty - 1)
+        wy = ywt[ylo:yhi]
+        for i in range (0, tx + 1):
+            xlo, xhi = xcuts[i], xcuts[i+1]
+            if ylo >= yhi or xlo >= xhi:
+                continue
+            x1, x2 = max (i - 1, 0), min (i, tx - 1)
+            block = im[ylo:yhi,xlo:xhi]
+            wx = xwt[xlo:xhi]
+            a = cv2.LUT (block, luts[y1,x1]).astype (numpy.float32)
+            b = cv2.LUT (block, luts[y1,x2]).astype (numpy.float32)
+            top = a + (b - a) * wx
+            if y2 != y1:
+                a = cv2.LUT (block, luts[y2,x1]).astype (numpy.float32)
+                b = cv2.LUT (block, luts[y2,x2]).astype (numpy.float32)
+                top += (a + (b - a) * wx - top) * wy
+            out[ylo:yhi,xlo:xhi] = numpy.rint (top)
+    run (blend_band, ty + 1)
+    if pool is not None:
+        pool.shutdown ()
+    return out
+
+#-------------------------------------------------------------------------------
+def _clahe_luts (hist, clip, area):
+    "Return the lookup tables of the tiles with histograms `hist`."
+    # The excess of each clipped histogram is shared equally among the
+    # values, and what cannot be shared equally is added one at a time at
+    # regular intervals from the bottom, as OpenCV does.
+    if clip > 0:
+        limit = max (int (clip * area / 256), 1)
+        excess = numpy.maximum (hist - limit, 0).sum (axis=1)
+        hist = numpy.minimum (hist, limit) + (excess // 256)[:,None]
+        residual = excess % 256
+        step = numpy.maximum (256 // numpy.maximum (residual, 1), 1)[:,None]
+        v = numpy.arange (256)
+        hist += (v % step == 0) & (v // step < residual[:,None])
+    return numpy.clip (numpy.rint (numpy.cumsum (hist, axis=1) *
+                                   (255.0 / area)), 0, 255).astype (numpy.uint8)
+
+#-------------------------------------------------------------------------------
+def _histogram256 (im):
+    "Return the histograms of the channels of uint8 image `im`, (nc, 256)."
+    if im.dtype != numpy.uint8:
+        raise ValueError ("Contrast enhancement needs a uint8 image, not %s!"
+                          % im.dtype)
+    _, hist = histogram (im)
+    hist = hist.reshape (-1, hist.shape[-1])
+    return numpy.pad (hist, ((0, 0), (0, 256 - hist.shape[1])))
+
+#-------------------------------------------------------------------------------
+# BATCHES OF IMAGES.
+#-------------------------------------------------------------------------------
+# A dataset of many same-sized images can be held as a single array of shape
+# (N, H, W, C), a batch, and given to the point operations, statistics and
+# histogram routines in a single call rather than one call per image.  Point
+# operations treat the batch as one tall image, which OpenCV processes in a
+# single pass; summaries are worked out image by image but returned together,
+# with a leading index that selects the image.  Greyscale images in a batch
+# have a channel index of length one, so that a batch is always 4-D.
+
+def batch_files (filenames, flags=cv2.IMREAD_COLOR, size=0):
+    """Read the images in `filenames` and group those of the same shape
+    into batches, yielding each batch with the names of its files.  The
+    images of each batch are in the order in which they were named, and
+    the batches are yielded in the order in which their last file was
+    read, so only the images of incomplete batches are held in memory.
+
+    Args:
+        filenames (list): names of the files to be read
+        flags (int): flags passed to cv2.imread (default: colour)
+        size (int): largest number of images in a batch, or zero for
+                    no limit (default: 0)
+
+    Yields:
+        names (list): names of the files in the batch
+        batch (array): their images, of shape (N, H, W, C)
+
+    Raises:
+        OSError: when a file cannot be read
+
+    Tests:
+        >>> d = os.path.join (os.path.dirname (__file__), "Images")
+        >>> fns = [os.path.join (d, "biscuits", "biscuit-%03d.jpg" % i)
+        ...        for i in (1, 3)] + [os.path.join (d, "dice.jpg")] * 3
+        >>> for names, batch in batch_files (fns, cv2.IMREAD_GRAYSCALE, 2):
+        ...     print (len (names), batch.shape)
+        2 (2, 344, 612, 1)
+        2 (2, 1936, 2592, 1)
+        1 (1, 1936, 2592, 1)
+    """
+    pending = {}
+    for fn in filenames:
+        im = cv2.imread (fn, flags)
+        if im is None:
+            raise OSError ("I can't read an image from %s!" % fn)
+        if len (im.shape) < 3:
+            im = im[:,:,None]
+        names, images = pending.setdefault (im.shape, ([], []))
+        names.append (fn)
+        images.append (im)
+        if len (images) == size:
+            del pending[im.shape]
+            yield names, numpy.stack (images)
+    for names, images in pending.values ():
+        yield names, numpy.stack (images)
+
+#-------------------------------------------------------------------------------
+def _cv_view (im):
+    "Return a batch of images as one tall image that OpenCV can process."
+    return im.reshape ((-1,) + im.shape[2:])
+
+#-------------------------------------------------------------------------------
+# FILTER PIPELINES.
+#-------------------------------------------------------------------------------
+# A sequence of linear filters is itself a linear filter: convolving with one
+# kernel and then another is the same as convolving once with the convolution
+# of the two kernels.  A FilterPipeline takes advantage of this, combining
+# consecutive kernels into one whenever that is cheaper than applying them in
+# turn.  It also keeps the buffers it filters into from one call to the next,
+# so that processing a series of same-sized images allocates no new images.
+
+def compose_kernels (k1, k2):
+    """Return the kernel equivalent to convolving with `k1` and then `k2`.
+
+    Args:
+        k1 (array): first kernel to be applied
+        k2 (array): second kernel to be applied
+
+    Returns:
+        k (array): the combined kernel
+
+    Tests:
+        >>> print (compose_kernels ([[1, 1]], [[1], [1]]))
+        [[1. 1.]
+         [1. 1.]]
+        >>> print (compose_kernels ([[1, 2, 1]], [[1, 2, 1]]))
+        [[1. 4. 6. 4. 1.]]
+    """
+    k1 = numpy.asarray (k1, dtype=numpy.float64)
+    k2 = numpy.asarray (k2, dtype=numpy.float64)
+    h1, w1 = k1.shape
+    h2, w2 = k2.shape
+    k = numpy.zeros ((h1 + h2 - 1, w1 + w2 - 1))
+    for y in range (0, h2):
+        for x in range (0, w2):
+            k[y:y+h1,x:x+w1] += k2[y,x] * k1
+    return k
+
+#-------------------------------------------------------------------------------
+class FilterPipeline:
+    """A sequence of filters to be applied to images one after another.
+    Each stage is a kernel, given as an array or by name (see
+    `kernel_info`), or a function that takes an image and returns the
+    filtered image.  The kernels are applied by convolution, as in
+    `convolution`, in floating-point of type `dtype`, so intermediate
+    results are neither rounded nor clipped.
+
+    When `fuse` is True, each run of consecutive odd-sized kernels is
+    combined into fewer, larger kernels wherever applying the combined
+    kernel costs less than applying its parts; a separable kernel costs
+    its height plus its width and any other its area.  The result is the
+    same except within a few pixels of the edges of the image, where the
+    padding is applied once rather than once per kernel.
+
+    Calling the pipeline on an image returns the result in a buffer that
+    belongs to the pipeline and is reused by the next call with an image
+    of the same size, unless `out` is given.  Copy the result if it is
+    needed after that.  Each thread has buffers of its own, so threads
+    can share a pipeline, as they do when it is given to `tiled`.
+
+    Args:
+        stages (list): the kernels or functions to be applied, in order
+        dtype (type): numpy.float32 or numpy.float64 (default: float32)
+        padding (str): how images are padded, as for `convolution` but
+                       excluding "wrap" and None (default: "reflect101")
+        fuse (bool): whether kernels may be combined (default: True)
+
+    Raises:
+        ValueError: when invoked with an unsupported padding, or called
+                    with an `out` of the wrong shape or type
+
+    Tests:
+        >>> im = testimage ()
+        >>> p = FilterPipeline (["gaussian5", "sobelx"])
+        >>> len (p.kernels ()), p.kernels ()[0].shape
+        (1, (7, 7))
+        >>> q = FilterPipeline (["gaussian5", "sobelx"], fuse=False)
+        >>> d = p (im) - q (im)
+        >>> print ("%.6f" % abs (d[3:-3,3:-3]).max ())
+        0.000000
+        >>> p (im) is p (im)
+        True
+        >>> len (FilterPipeline (["gaussian5", "laplacian"]).kernels ())
+        2
+        >>> p (im, out=numpy.zeros (im.shape, numpy.float64))
+        Traceback (most recent call last):
+        ...
+        ValueError: I can't put a float32 result of shape (13, 10) in a float64 image of shape (13, 10)!
+    """
+
+    def __init__ (self, stages, dtype=numpy.float32, padding="reflect101",
+                  fuse=True):
+        if padding not in PADDING or padding == "wrap":
+            raise ValueError ("I can't pad with '%s' in a pipeline!" % padding)
+        self.dtype = numpy.dtype (dtype).type
+        self.border = PADDING[padding]
+        self.local = threading.local ()
+        self.stages = []
+        for s in stages:
+            if callable (s):
+                self.stages.append (s)
+                continue
+            k, factors = _kernel_factors (s)
+            if factors is _UNKNOWN: factors = separate_kernel (k)
+            stage = (k, factors)
+            if fuse and len (self.stages) > 0 \
+               and isinstance (self.stages[-1], tuple):
+                fused = _fuse_stages (self.stages[-1], stage)
+                if fused is not None:
+                    self.stages[-1] = fused
+                    continue
+            self.stages.append (stage)
+
+    def __call__ (self, im, out=None):
+        """Apply the pipeline to image `im`, returning the result.
+
+        Args:
+            im (image): image to be filtered
+            out (image): where to put the result, of the same shape as
+                         `im` and type `dtype` (default: a reused buffer)
+
+        Returns:
+            fim (image): the filtered image
+
+        Raises:
+            ValueError: when `out` is of the wrong shape or type
+        """
+        # Filter back and forth between two buffers, the last stage writing
+        # into `out` if it was given.
+        if out is not None:
+            _check_out (out, im.shape, self.dtype)
+        if not hasattr (self.local, "buffers"):
+            self.local.buffers = {}
+        key = im.shape
+        if key not in self.local.buffers:
+            self.local.buffers[key] = [numpy.empty (im.shape, dtype=self.dtype)
+                                       for i in range (0, 2)]
+        buffers = self.local.buffers[key]
+        src = im
+        for i, stage in enumerate (self.stages):
+            last = i == len (self.stages) - 1
+            dst = out if last and out is not None else buffers[i % 2]
+            if isinstance (stage, tuple):
+                k, factors = stage
+                _filter (src, k, factors, self.dtype, self.border, dst)
+            else:
+                numpy.copyto (dst, stage (src), casting="unsafe")
+            src = dst
+        if len (self.stages) == 0:
+            dst = out if out is not None else buffers[0]
+            numpy.copyto (dst, im, casting="unsafe")
+            src = dst
+        return src
+
+    def kernels (self):
+        """Return the kernels that the pipeline applies, after any fusion;
+        functions in the pipeline are returned unchanged.
+
+        Returns:
+            kernels (list): the kernels and functions
+        """
+        return [s[0] if isinstance (s, tuple) else s for s in self.stages]
+
+    def halo (self):
+        """Return the number of rows above and below a pixel on which its
+        result depends, the sum of the radii of the kernels; functions
+        in the pipeline are assumed to be point operations.
+
+        Returns:
+            halo (int): the number of rows
+        """
+        return sum (max (s[0].shape) // 2 for s in self.stages
+                    if isinstance (s, tuple))
+
+#-------------------------------------------------------------------------------
+def _fuse_stages (s1, s2):
+    "Return the combination of two pipeline stages if it is cheaper, else None."
+    (k1, f1), (k2, f2) = s1, s2
+    if any (n % 2 == 0 for n in k1.shape + k2.shape):
+        return None
+    def cost (k, f):
+        return sum (k.shape) if f is not None else k.size
+    k = compose_kernels (k1, k2)
+    if f1 is not None and f2 is not None:
+        f = (numpy.convolve (f1[0], f2[0]), numpy.convolve (f1[1], f2[1]))
+    else:
+        f = separate_kernel (k)
+    if cost (k, f) > cost (k1, f1) + cost (k2, f2):
+        return None
+    return k, f
+
+#-------------------------------------------------------------------------------
+def _check_out (out, shape, dtype):
+    "Ensure that `out` can hold a result of the given shape and type in place."
+    dtype = numpy.dtype (dtype)
+    if out.shape != tuple (shape) or out.dtype != dtype \
+       or not out.flags.c_contiguous:
+        raise ValueError ("I can't put a %s result of shape %s in a %s%s "
+                          "image of shape %s!" % (dtype, tuple (shape),
+                          "" if out.flags.c_contiguous else "non-contiguous ",
+                          out.dtype, out.shape))
+
+#-------------------------------------------------------------------------------
+# LARGE IMAGES.
+#-------------------------------------------------------------------------------
+# Images such as whole-slide leaf scans can be much larger than the memory of
+# the machine processing them.  The routines in this section work through such
+# an image a strip of rows at a time, summarizing each strip in a "partial"
+# that can be merged with any other partial.  As the order in which partials
+# are merged makes no difference to the result, strips can be processed in any
+# order and in parallel worker processes.  A numpy memmap, as returned by
+# open_raw or by numpy.load with mmap_mode="r", is paged in from disk only as
+# each strip is read, so memory use is bounded by the strip size rather than by
+# the size of the image.
+
+def open_raw (fn, ny, nx, nc=0, dtype="uint8", offset=0):
+    """Return a read-only, memory-mapped image whose pixels are stored in
+    file `fn` as raw binary values in row order.  Nothing is read from the
+    file until the pixels are accessed.
+
+    Args:
+        fn (str): name of the file holding the pixels
+        ny (int): number of rows in the image
+        nx (int): number of columns in the image
+        nc (int): number of channels, or zero for monochrome (default: 0)
+        dtype (str): type of the pixels (default: "uint8")
+        offset (int): number of header bytes before the first pixel
+                      (default: 0)
+
+    Returns:
+        im (image): numpy memmap containing the image
+    """
+    shape = (ny, nx) if nc == 0 else (ny, nx, nc)
+    return numpy.memmap (fn, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+#-------------------------------------------------------------------------------
+def partial_statistics (im, bins=None, limits=None):
+    """Return a mergeable summary of the image (or tile of an image) `im`.
+    The summary is a dictionary holding the number of pixel values
+    ("count"), their total ("sum"), their extremes ("lo" and "hi"), and
+    the "vals" and "hist" returned by `histogram`.
+
+    Args:
+        im (image): image or tile to be summarized
+        bins (int): number of histogram bins, as for `histogram`
+        limits (tuple): histogram limits, as for `histogram`
+
+    Returns:
+        stats (dict): the summary of the image
+
+    Tests:
+        >>> s = partial_statistics (testimage ())
+        >>> print (s["count"], s["lo"], s["hi"], s["sum"])
+        130 10 15 1440.0
+    """
+    s = stats (im)
+    vals, hist = histogram (im, bins, limits)
+    return {"count": im.size, "sum": float (s["mean"].sum ()) * s["count"],
+            "lo": s["min"].min ().item (), "hi": s["max"].max ().item (),
+            "vals": vals, "hist": hist}
+
+#-------------------------------------------------------------------------------
+def merge_statistics (s1, s2):
+    """Merge two summaries produced by `partial_statistics`, returning the
+    summary of the pixels of both.  Either may be None, in which case the
+    other is returned.  Histograms with the default one-bin-per-grey-level
+    binning may be of different lengths; others must have identical bins.
+
+    Args:
+        s1 (dict): first summary to be merged
+        s2 (dict): second summary to be merged
+
+    Returns:
+        stats (dict): the merged summary
+
+    Raises:
+        ValueError: when the summaries' histograms have different bins
+
+    Tests:
+        >>> im = testimage ()
+        >>> s = merge_statistics (partial_statistics (im[:6]),
+        ...                       partial_statistics (im[6:]))
+        >>> print (s["count"], s["lo"], s["hi"], s["sum"])
+        130 10 15 1440.0
+        >>> print (s["hist"])
+        [ 0  0  0  0  0  0  0  0  0  0 80 13 13  3 13  8]
+    """
+    if s1 is None: return s2
+    if s2 is None: return s1
+
+    # Partial histograms of integer images each stop at the highest value in
+    # their tile, so pad the shorter one out before adding them.
+    v1, h1 = s1["vals"], s1["hist"]
+    v2, h2 = s2["vals"], s2["hist"]
+    if h1.shape != h2.shape:
+        default = [numpy.array_equal (v, numpy.arange (len (v)))
+                   for v in (v1, v2)]
+        if not all (default) or h1.shape[:-1] != h2.shape[:-1]:
+            raise ValueError ("I can't merge histograms with different bins!")
+        n = max (len (v1), len (v2))
+        pad = [(0, 0)] * (len (h1.shape) - 1)
+        h1 = numpy.pad (h1, pad + [(0, n - len (v1))])
+        h2 = numpy.pad (h2, pad + [(0, n - len (v2))])
+        v1 = numpy.arange (n)
+    elif not numpy.array_equal (v1, v2):
+        raise ValueError ("I can't merge histograms with different bins!")
+
+    return {"count": s1["count"] + s2["count"], "sum": s1["sum"] + s2["sum"],
+            "lo": min (s1["lo"], s2["lo"]), "hi": max (s1["hi"], s2["hi"]),
+            "vals": v1, "hist": h1 + h2}
+
+#-------------------------------------------------------------------------------
+def tiled_statistics (source, tile_rows=1024, bins=None, limits=None,
+                      workers=0):
+    """Return the summary produced by `partial_statistics` for an image
+    that may be too large to fit into memory, plus its "mean".  The image
+    is processed in strips of `tile_rows` rows and the strips' summaries
+    merged.
+
+    `source` is normally a numpy array, in which case it is best to use a
+    memmap (see `open_raw`) for large images.  It can also be any iterable
+    that yields the tiles of an image one at a time, such as a generator
+    that decodes a tiled file piece by piece.  When `workers` is positive,
+    the strips of an unsliced memmap are processed in that many worker
+    processes, each of which maps the file for itself; those of other
+    arrays are processed in a pool of threads.
+
+    As the tiles must all be binned in the same way, images that are not
+    of an unsigned integer type must have their histogram `limits` given.
+
+    Args:
+        source (image or iterable): image or tiles to be summarized
+        tile_rows (int): number of rows in each strip (default: 1024)
+        bins (int): number of histogram bins, as for `histogram`
+        limits (tuple): histogram limits, as for `histogram`
+        workers (int): number of workers to use in parallel, or zero to
+                       process the strips serially (default: 0)
+
+    Returns:
+        stats (dict): the summary of the image
+
+    Raises:
+        ValueError: when the binning of the tiles cannot be determined
+
+    Tests:
+        >>> im = testimage ()
+        >>> s = tiled_statistics (im, tile_rows=4)
+        >>> print (s["count"], s["lo"], s["hi"], "%.4f" % s["mean"])
+        130 10 15 11.0769
+        >>> print (s["hist"])
+        [ 0  0  0  0  0  0  0  0  0  0 80 13 13  3 13  8]
+
+        >>> import tempfile
+        >>> fn = tempfile.NamedTemporaryFile (suffix=".raw", delete=False).name
+        >>> numpy.tile (im, (50, 3)).tofile (fn)
+        >>> big = open_raw (fn, 650, 30)
+        >>> s = tiled_statistics (big, tile_rows=100, workers=2)
+        >>> print (s["count"], s["hist"][10:])
+        19500 [12000  1950  1950   450  1950  1200]
+        >>> del big; os.remove (fn)
+
+        >>> s = tiled_statistics (im / 15.0, tile_rows=4)
+        Traceback (most recent call last):
+         ...
+        ValueError: I need histogram limits to summarize a float64 image in tiles!
+    """
+    if isinstance (source, numpy.ndarray) and limits is None \
+       and source.dtype.kind != "u":
+        raise ValueError ("I need histogram limits to summarize a %s " \
+                          "image in tiles!" % source.dtype)
+
+    # Merge the summaries as they become available.
+    summary = None
+    for ylo, part in _summarize_strips (source, tile_rows, workers,
+                                        partial_statistics, bins, limits):
+        summary = merge_statistics (summary, part)
+    if summary is None:
+        raise ValueError ("I can't summarize an image with no pixels!")
+    summary["mean"] = summary["sum"] / summary["count"]
+    return summary
+
+#-------------------------------------------------------------------------------
+def merge_stats (s1, s2):
+    """Merge two summaries produced by `stats`, returning the summary of
+    the pixels of both.  Either may be None, in which case the other is
+    returned.  Where both contain the same extreme value, the location
+    from `s1` is kept.
+
+    Args:
+        s1 (dict): first summary to be merged
+        s2 (dict): second summary to be merged
+
+    Returns:
+        stats (dict): the merged summary
+
+    Tests:
+        >>> im = testimage ()
+        >>> s = merge_stats (stats (im[:6]), stats (im[6:]))
+        >>> print (s["count"], s["min"], s["max"], s["mean"].round (4), s["var"].round (4))
+        130 [10] [15] [11.0769] [2.6864]
+    """
+    if s1 is None: return s2
+    if s2 is None: return s1
+
+    # ASIDE: Adding up the variances of the two parts is not enough, as
+    # their means differ; the formula of Chan, Golub and LeVeque corrects
+    # for that without needing a second pass over the pixels.
+    n1, n2 = s1["count"], s2["count"]
+    n = n1 + n2
+    merged = {"count": n}
+    lower = s2["min"] < s1["min"]
+    higher = s2["max"] > s1["max"]
+    merged["min"] = numpy.where (lower, s2["min"], s1["min"])
+    merged["max"] = numpy.where (higher, s2["max"], s1["max"])
+    merged["argmin"] = numpy.where (lower[:,None], s2["argmin"], s1["argmin"])
+    merged["argmax"] = numpy.where (higher[:,None], s2["argmax"], s1["argmax"])
+    if "mean" in s1 and "mean" in s2:
+        delta = s2["mean"] - s1["mean"]
+        merged["mean"] = s1["mean"] + delta * n2 / n
+        merged["var"] = (s1["var"] * n1 + s2["var"] * n2
+                         + delta**2 * n1 * n2 / n) / n
+    return merged
+
+#-------------------------------------------------------------------------------
+def tiled_stats (source, tile_rows=1024, workers=0):
+    """Return the summary produced by `stats` for an image that may be
+    too large to fit into memory.  The image is processed in strips of
+    `tile_rows` rows, as described for `tiled_statistics`, and the
+    strips' summaries merged.
+
+    Args:
+        source (image or iterable): image or tiles to be summarized
+        tile_rows (int): number of rows in each strip (default: 1024)
+        workers (int): number of workers to use in parallel, or zero to
+                       process the strips serially (default: 0)
+
+    Returns:
+        stats (dict): the summary of the image
+
+    Raises:
+        ValueError: when there are no pixels to summarize
+
+    Tests:
+        >>> im = testimage ()
+        >>> s = tiled_stats (im, tile_rows=4)
+        >>> print (s["count"], s["argmin"], s["argmax"], s["var"].round (4))
+        130 [[0 0]] [[2 3]] [2.6864]
+        >>> s = tiled_stats (iter ([im[:2], im[2:]]))
+        >>> print (s["argmax"])
+        [[2 3]]
+    """
+    summary = None
+    for ylo, part in _summarize_strips (source, tile_rows, workers, stats):
+        part["argmin"][:,0] += ylo
+        part["argmax"][:,0] += ylo
+        summary = merge_stats (summary, part)
+    if summary is None:
+        raise ValueError ("I can't summarize an image with no pixels!")
+    return summary
+
+#-------------------------------------------------------------------------------
+def _summarize_strips (source, tile_rows, workers, summarize, *args):
+    """Apply `summarize` to each strip of `source` in turn, as described
+    for `tiled_statistics`, yielding the first row of each strip and its
+    summary."""
+    if not isinstance (source, numpy.ndarray):
+        ylo = 0
+        for tile in source:
+            yield ylo, summarize (tile, *args)
+            ylo += tile.shape[0]
+        return
+
+    ny = source.shape[0]
+    strips = [(y, min (y + tile_rows, ny)) for y in range (0, ny, tile_rows)]
+    if workers > 0 and isinstance (source, numpy.memmap) \
+       and isinstance (source.base, mmap.mmap):
+        # Worker processes re-open the file rather than being sent the
+        # pixels, so the only data passing between processes are the
+        # (small) summaries.
+        import concurrent.futures
+        jobs = [(source.filename, source.dtype.str, source.shape,
+                 source.offset, ylo, yhi, summarize, args)
+                for ylo, yhi in strips]
+        pool = concurrent.futures.ProcessPoolExecutor (workers)
+        parts = pool.map (_summarize_memmap, jobs)
+    elif workers > 0:
+        # OpenCV and numpy release the GIL while they work, so threads
+        # are sufficient for an array that is already in memory.
+        import concurrent.futures
+        pool = concurrent.futures.ThreadPoolExecutor (workers)
+        parts = pool.map (lambda s: summarize (source[s[0]:s[1]], *args),
+                          strips)
+    else:
+        pool = None
+        parts = (summarize (source[ylo:yhi], *args) for ylo, yhi in strips)
+    try:
+        for (ylo, yhi), part in zip (strips, parts):
+            yield ylo, part
+    finally:
+        if pool is not None: pool.shutdown ()
+
+#-------------------------------------------------------------------------------
+def _summarize_memmap (job):
+    "Summarize one strip of a memory-mapped file in a worker process."
+    fn, dtype, shape, offset, ylo, yhi, summarize, args = job
+    im = numpy.memmap (fn, dtype=dtype, mode="r", offset=offset, shape=shape)
+    return summarize (im[ylo:yhi], *args)
+
+#-------------------------------------------------------------------------------
+# TILED PROCESSING.
+#-------------------------------------------------------------------------------
+# A neighbourhood operation such as a convolution or a morphological operation
+# can be applied to a large image a strip of rows at a time, with the strips
+# shared among threads, as long as each strip is extended by a "halo" of rows
+# above and below it, enough to cover the operation's reach.  Each strip's
+# result, minus its halo, is written into its place in a single output image,
+# and the result is the same as processing the image in one go: the halo rows
+# supply the neighbours that the operation needs, and the image's own top and
+# bottom edges are handled by the operation as usual.  Strips span the full
+# width of the image, so no halo is needed at the sides and the rows of each
+# strip are contiguous in memory.
+
+def tiled (func, im, halo=None, tile_rows=None, workers=0, out=None):
+    """Apply `func` to image `im` a strip of rows at a time, extending
+    each strip by `halo` rows above and below and sharing the strips
+    among `workers` threads, and return the reassembled result.  `func`
+    takes an image and returns the processed image, of the same number
+    of rows; its result must depend only on pixels within `halo` rows.
+    Point operations, such as a `Lut`, need no halo at all.  OpenCV and
+    numpy release the GIL while they work, so the strips are processed
+    in parallel.
+
+    Args:
+        func (function): operation to be applied to each strip
+        im (image): image to be processed
+        halo (int): rows of context needed above and below each row
+                    (default: func.halo () if there is one, else 0)
+        tile_rows (int): number of rows in each strip (default: enough
+                         for four strips per worker)
+        workers (int): number of threads to use, or zero to use one
+                       per processor (default: 0)
+        out (image): image to hold the result (default: a new image)
+
+    Returns:
+        tim (image): the processed image
+
+    Tests:
+        >>> im = testimage ()
+        >>> lut = linear_lut (20, -100)
+        >>> print (numpy.array_equal (tiled (lut, im, tile_rows=3), lut (im)))
+        True
+        >>> p = FilterPipeline (["gaussian5", "sobelx"])
+        >>> t = tiled (p, im, tile_rows=4, workers=2)
+        >>> print (p.halo (), numpy.array_equal (t, p (im)))
+        3 True
+    """
+    if halo is None:
+        halo = func.halo () if hasattr (func, "halo") else 0
+    if workers <= 0:
+        workers = os.cpu_count () or 1
+    ny = im.shape[0]
+    if tile_rows is None:
+        tile_rows = max (-(-ny // (4 * workers)), 4 * halo, 32)
+    strips = [(y, min (y + tile_rows, ny)) for y in range (0, ny, tile_rows)]
+
+    def run (strip):
+        ylo, yhi = strip
+        top, bottom = max (ylo - halo, 0), min (yhi + halo, ny)
+        result = func (im[top:bottom])
+        if out is None:
+            return result[ylo-top:yhi-top]
+        out[ylo:yhi] = result[ylo-top:yhi-top]
+
+    # The first strip shows what type and shape of image to return.
+    if out is None:
+        first = run (strips[0])
+        out = numpy.empty ((ny,) + first.shape[1:], dtype=first.dtype)
+        out[:len (first)] = first
+        strips = strips[1:]
+    if workers > 1 and len (strips) > 1:
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor (workers) as pool:
+            list (pool.map (run, strips))
+    else:
+        for strip in strips:
+            run (strip)
+    return out
+
+#-------------------------------------------------------------------------------
+def tiled_filter (im, k, padding="reflect101", tile_rows=None, workers=0):
+    """Convolve image `im` with kernel `k` as `convolution` does, but a
+    strip at a time in parallel (see `tiled`).
+
+    Args:
+        im (image): image to be convolved
+        k (array or str): the kernel, or its name (see `kernel_info`)
+        padding (str): how the image is padded, as for `convolution` but
+                       excluding "wrap" (default: "reflect101")
+        tile_rows (int): number of rows in each strip (default: see
+                         `tiled`)
+        workers (int): number of threads to use, or zero to use one
+                       per processor (default: 0)
+
+    Returns:
+        cim (image): float32 result (float64 for float64 images)
+
+    Raises:
+        ValueError: when invoked with "wrap" padding, which needs the
+                    whole image
+
+    Tests:
+        >>> im = testimage ()
+        >>> t = tiled_filter (im, "gaussian5", tile_rows=3, workers=2)
+        >>> print (numpy.array_equal (t, convolution (im, "gaussian5")))
+        True
+    """
+    if padding == "wrap":
+        raise ValueError ("I can't wrap around an image a strip at a time!")
+    if isinstance (k, str):
+        k = kernel (k)
+    k = numpy.asarray (k)
+    return tiled (lambda t: convolution (t, k, padding), im,
+                  max (k.shape) // 2, tile_rows, workers)
+
+#-------------------------------------------------------------------------------
+def tiled_morphology (im, op, k, iterations=1, tile_rows=None, workers=0):
+    """Apply the morphological operation `op` to image `im` with the
+    structuring element `k`, as cv2.morphologyEx does, but a strip at a
+    time in parallel (see `tiled`).  Opening, closing and the other
+    compound operations reach twice as far as erosion and dilation, and
+    each iteration reaches further, so the halo allows for both.
+
+    Args:
+        im (image): image to be processed
+        op (int): the operation, such as cv2.MORPH_OPEN
+        k (array): the structuring element
+        iterations (int): number of times the operation is applied
+                          (default: 1)
+        tile_rows (int): number of rows in each strip (default: see
+                         `tiled`)
+        workers (int): number of threads to use, or zero to use one
+                       per processor (default: 0)
+
+    Returns:
+        mim (image): the processed image
+
+    Tests:
+        >>> bim = binarize (testimage (), 11)
+        >>> k = numpy.ones ((3, 3), numpy.uint8)
+        >>> for op in cv2.MORPH_OPEN, cv2.MORPH_CLOSE, cv2.MORPH_DILATE:
+        ...     t = tiled_morphology (bim, op, k, 2, tile_rows=2, workers=2)
+        ...     print (numpy.array_equal (t, cv2.morphologyEx (bim, op, k,
+        ...                                                    iterations=2)))
+        True
+        True
+        True
+    """
+    reach = 1 if op in (cv2.MORPH_ERODE, cv2.MORPH_DILATE) else 2
+    halo = reach * iterations * (k.shape[0] // 2)
+    return tiled (lambda t: cv2.morphologyEx (t, op, k, iterations=iterations),
+                  im, halo, tile_rows, workers)
+
+#-------------------------------------------------------------------------------
+# PACKED BINARY IMAGES.
+#-------------------------------------------------------------------------------
+# A binary image, such as one returned by binarize or cv2.inRange, holds one
+# bit of information in each byte.  A PackedBinary holds each row of such an
+# image as the bits of 64-bit words, so it occupies an eighth of the memory
+# and a logical operation between two images handles 64 pixels at a time.
+# Morphology works the same way: dilation is the OR of copies of the image
+# shifted by each offset of the structuring element, and shifting a row of
+# words along by a few pixels takes only a couple of word-level shifts.  For
+# rectangular elements the shifts are combined by doubling, so that a 9x9
+# element takes four shifts in each direction rather than sixteen.
+
+class PackedBinary:
+    """A binary image packed 64 pixels to a word.  Pixels of `mask` that
+    are non-zero are set and others clear.  Packed images of the same
+    shape can be combined with `&`, `|` and `^` and inverted with `~`.
+
+    Morphological operations follow the conventions of cv2.erode and
+    cv2.dilate with their default borders, the anchor being at the
+    centre of the structuring element: pixels outside the image count as
+    set when eroding and clear when dilating, so the results are the
+    same as OpenCV's.
+
+    Args:
+        mask (image): the binary image, of any type
+
+    Tests:
+        >>> bim = binarize (testimage (), 11)
+        >>> p = PackedBinary (bim)
+        >>> print (p.shape, p.words.shape, p.area (), cv2.countNonZero (bim))
+        (13, 10) (13, 1) 37 37
+        >>> print (numpy.array_equal (p.unpack (), bim))
+        True
+        >>> print (numpy.array_equal ((~p).unpack (), 255 - bim))
+        True
+        >>> q = PackedBinary (binarize (testimage (), 13))
+        >>> print ((p & q).area (), (p | q).area (), (p ^ q).area ())
+        21 37 16
+        >>> rng = numpy.random.default_rng (1)
+        >>> bim = (rng.random ((40, 150)) > 0.6).astype (numpy.uint8) * 255
+        >>> p = PackedBinary (bim)
+        >>> for k in (numpy.ones ((5, 9), numpy.uint8), numpy.ones ((4, 2)),
+        ...           cv2.getStructuringElement (cv2.MORPH_CROSS, (5, 5))):
+        ...     for op in "erode", "dilate", "open", "close":
+        ...         ref = cv2.morphologyEx (bim, getattr (cv2, "MORPH_" +
+        ...                                 op.upper ()), k)
+        ...         if not numpy.array_equal (getattr (p, op) (k).unpack (),
+        ...                                   ref):
+        ...             print ("mismatch", op, k.shape)
+    """
+
+    def __init__ (self, mask):
+        mask = numpy.asarray (mask)
+        ny, nx = mask.shape
+        nw = (nx + 63) // 64
+        packed = numpy.zeros ((ny, nw * 8), dtype=numpy.uint8)
+        packed[:,:(nx+7)//8] = numpy.packbits (mask != 0, axis=1,
+                                               bitorder="little")
+        self.shape = (ny, nx)
+        self.words = packed.view ("<u8")
+
+    def _new (self, words):
+        "Return a packed image of the same shape holding `words`."
+        # The bits beyond the right-hand edge of the image must stay clear.
+        if self.shape[1] % 64 != 0:
+            words[:,-1] &= numpy.uint64 ((1 << (self.shape[1] % 64)) - 1)
+        result = PackedBinary.__new__ (PackedBinary)
+        result.shape = self.shape
+        result.words = words
+        return result
+
+    def unpack (self, value=255):
+        """Return the image as uint8 pixels.
+
+        Args:
+            value (int): the value of set pixels (default: 255)
+
+        Returns:
+            mask (image): the image, with clear pixels zero
+        """
+        bits = numpy.unpackbits (self.words.view (numpy.uint8), axis=1,
+                                 count=self.shape[1], bitorder="little")
+        if value != 1:
+            bits *= numpy.uint8 (value)
+        return bits
+
+    def area (self):
+        """Return the number of set pixels, counted a word at a time.
+
+        Returns:
+            area (int): the number of set pixels
+        """
+        if hasattr (numpy, "bitwise_count"):
+            return int (numpy.bitwise_count (self.words).sum (dtype=int))
+        return int (POPCOUNT[self.words.view (numpy.uint8)].sum (dtype=int))
+
+    def __and__ (self, other):
+        return self._new (self.words & other.words)
+
+    def __or__ (self, other):
+        return self._new (self.words | other.words)
+
+    def __xor__ (self, other):
+        return self._new (self.words ^ other.words)
+
+    def __invert__ (self):
+        return self._new (~self.words)
+
+    def dilate (self, k):
+        """Return the dilation of the image by structuring element `k`.
+
+        Args:
+            k (array): the structuring element, non-zero where it is set
+
+        Returns:
+            dim (PackedBinary): the dilated image
+        """
+        k = numpy.asarray (k)
+        ay, ax = k.shape[0] // 2, k.shape[1] // 2
+        if k.all ():
+            rows = _shift_span (self.words, -ax, k.shape[1] - 1 - ax, 1)
+            words = _shift_span (rows, -ay, k.shape[0] - 1 - ay, 0)
+        else:
+            # Shift each row of the image once for each column of the
+            # element that is used, then shift the results vertically.
+            words = numpy.zeros_like (self.words)
+            shifted = {}
+            for y, x in zip (*numpy.nonzero (k)):
+                if x not in shifted:
+                    shifted[x] = _shift_words (self.words, x - ax, 1)
+                words |= _shift_words (shifted[x], y - ay, 0)
+        return self._new (words)
+
+    def erode (self, k):
+        """Return the erosion of the image by structuring element `k`.
+
+        Args:
+            k (array): the structuring element, non-zero where it is set
+
+        Returns:
+            eim (PackedBinary): the eroded image
+        """
+        return ~(~self).dilate (k)
+
+    def open (self, k):
+        """Return the opening of the image by structuring element `k`.
+
+        Args:
+            k (array): the structuring element, non-zero where it is set
+
+        Returns:
+            oim (PackedBinary): the opened image
+        """
+        return self.erode (k).dilate (k)
+
+    def close (self, k):
+        """Return the closing of the image by structuring element `k`.
+
+        Args:
+            k (array): the structuring element, non-zero where it is set
+
+        Returns:
+            cim (PackedBinary): the closed image
+        """
+        return self.dilate (k).erode (k)
+
+# The number of bits set in each byte value, used for counting when numpy is
+# too old to provide bitwise_count.
+POPCOUNT = numpy.unpackbits (numpy.arange (256, dtype=numpy.uint8)
+                             [:,None], axis=1).sum (axis=1)
+
+#-------------------------------------------------------------------------------
+def _shift_words (words, d, axis):
+    """Return packed rows of pixels shifted so that each pixel takes the
+    value of the one `d` places after it along `axis`, with zeros shifted
+    in from beyond the edges."""
+    out = numpy.zeros_like (words)
+    n = words.shape[axis]
+    if axis == 0:
+        if abs (d) >= n:
+            return out
+        if d >= 0:
+            out[:n-d] = words[d:]
+        else:
+            out[-d:] = words[:n+d]
+        return out
+
+    # Along the rows, pixel x of a row is bit x % 64 of word x // 64, so a
+    # shift is a shift of whole words and then of bits within the words,
+    # the bits that move out of each word moving into its neighbour.
+    q, r = divmod (abs (d), 64)
+    if q >= n:
+        return out
+    r = numpy.uint64 (r)
+    if d >= 0:
+        out[:,:n-q] = words[:,q:] >> r
+        if r:
+            out[:,:n-q-1] |= words[:,q+1:] << numpy.uint64 (64 - r)
+    else:
+        out[:,q:] = words[:,:n-q] << r
+        if r:
+            out[:,q+1:] |= words[:,:n-q-1] >> numpy.uint64 (64 - r)
+    return out
+
+#-------------------------------------------------------------------------------
+def _shift_span (words, lo, hi, axis):
+    """Return the OR of `words` shifted by every distance from `lo` to
+    `hi` along `axis`, where lo <= 0 <= hi."""
+    # An OR of the shifts from 0 to span - 1 is doubled into one covering
+    # 0 to 2 * span - 1 by ORing it with itself shifted by span.  Shifts in
+    # each direction are combined separately, so that only zeros from
+    # beyond the image are ever shifted in.
+    result = words.copy ()
+    for reach, sign in (hi, 1), (-lo, -1):
+        acc, span = words, 1
+        while span <= reach:
+            step = min (span, reach + 1 - span)
+            acc = _or_shifted (acc.copy () if acc is words else acc,
+                               sign * step, axis)
+            span += step
+        if acc is not words:
+            result |= acc
+    return result
+
+#-------------------------------------------------------------------------------
+def _or_shifted (words, d, axis):
+    "OR `words` in place with themselves shifted as by _shift_words."
+    n = words.shape[axis]
+    if axis == 0 and abs (d) < n:
+        if d >= 0:
+            words[:n-d] |= words[d:]
+        else:
+            words[-d:] |= words[:n+d]
+    elif axis == 1 and 0 < abs (d) < 64:
+        # The commonest case, a shift by less than a word, done with as few
+        # passes over the words as possible.
+        r = numpy.uint64 (abs (d))
+        if d > 0:
+            t = words >> r
+            t[:,:-1] |= words[:,1:] << numpy.uint64 (64 - r)
+        else:
+            t = words << r
+            t[:,1:] |= words[:,:-1] >> numpy.uint64 (64 - r)
+        words |= t
+    else:
+        words |= _shift_words (words, d, axis)
+    return words
+
+#-------------------------------------------------------------------------------
+# PROFILING.
+#-------------------------------------------------------------------------------
+# Putting "profile" in the SXCV environment variable makes every public
+# routine in this module, the public methods and operators of its classes
+# (such as Lut.__call__), and every OpenCV routine called from it, record how
+# many times it is called, how long it takes and how much memory it allocates,
+# separately for each shape of image it is given.  A summary is written to
+# standard error when the program exits or, with "profile=<file>", saved to
+# that file in JSON format.  Profiling can also be controlled by calling
+# profile_on and profile_off.  When profiling is off, nothing is recorded
+# and routines are called directly, so it costs nothing; in particular,
+# tracemalloc runs only while profiling is on.
+#
+# The times are wall-clock times and include those of any other routines
+# called, and the memory is the peak amount allocated during the call that
+# numpy and Python know about, which includes images returned by OpenCV.
+# Calls made by background threads are recorded too, but their allocations
+# get mixed up with those of the main thread.
+
+# The records of calls, indexed by routine name and image shape; each holds
+# the number of calls, the total time in seconds and the total bytes.
+PROFILE = None
+
+# The routines that are not profiled, as they are part of the profiler, and
+# the unprofiled versions of those that are.  The methods of classes whose
+# names start with an underscore are profiled only if they are operators
+# listed here; the originals of profiled methods are kept as (class, name,
+# method) triples.
+NOT_PROFILED = ("profile_on", "profile_off", "profile_summary")
+PROFILED_OPERATORS = ("__call__", "__and__", "__or__", "__xor__",
+                      "__invert__")
+PROFILE_ORIGINALS = {}
+PROFILE_METHODS = []
+
+class _ProfiledModule:
+    "Stand in for a module, profiling calls to the routines in it."
+
+    def __init__ (self, module):
+        self.module = module
+        self.routines = {}
+
+    def __getattr__ (self, name):
+        if name not in self.routines:
+            value = getattr (self.module, name)
+            if type (value).__name__ == "builtin_function_or_method":
+                value = _profiled (value, self.module.__name__ + "." + name)
+            self.routines[name] = value
+        return self.routines[name]
+
+#-------------------------------------------------------------------------------
+def profile_on (output=None):
+    """
+    Start profiling the routines in this module and the OpenCV routines
+    they call.
+
+    Args:
+        output (str): name of the file to which a JSON version of the
+                      results is written at exit, or None to print a
+                      summary to standard error (default: None)
+
+    Tests:
+        >>> me = sys.modules[__name__]
+        >>> profile_on ()
+        >>> junk = me.histogram (testimage ())
+        >>> junk = me.binarize (testimage (), 12)
+        >>> # binarize calls a Lut too, hence the two calls of Lut.__call__.
+        >>> junk = me.linear_lut (2, 0) (testimage ())
+        >>> junk = ~me.PackedBinary (testimage () > 12)
+        >>> print (profile_summary ().splitlines ()[0].split ())
+        ['routine', 'shape', 'calls', 'total', 'ms', 'ms/call', 'MB/call']
+        >>> records = profile_off ()
+        >>> for key in sorted (records):
+        ...     if key[0] in ("sxcv.histogram", "cv2.calcHist", "sxcv.binarize",
+        ...                   "sxcv.Lut.__call__", "sxcv.PackedBinary.__invert__"):
+        ...         print (key, records[key][0])
+        ('cv2.calcHist', '13x10') 1
+        ('sxcv.Lut.__call__', '13x10') 2
+        ('sxcv.PackedBinary.__invert__', '13x10') 1
+        ('sxcv.binarize', '13x10') 1
+        ('sxcv.histogram', '13x10') 1
+        >>> print (me.histogram is histogram, me.cv2 is cv2)
+        True True
+        >>> print (Lut.__call__.__name__, hasattr (Lut.__call__, "__wrapped__"))
+        __call__ False
+    """
+    global PROFILE, PROFILE_OUTPUT, PROFILE_STATE, PROFILE_LOCK, \
+        PROFILE_TRACING, cv2
+    import tracemalloc, atexit, types
+
+    if PROFILE is not None:
+        return
+    PROFILE = {}
+    PROFILE_ORIGINALS.clear ()
+    PROFILE_METHODS.clear ()
+    PROFILE_OUTPUT = output
+    PROFILE_STATE = threading.local ()
+    PROFILE_LOCK = threading.Lock ()
+
+    # Memory is traced only while profiling is on, and not stopped at the
+    # end if something else started tracing it.
+    PROFILE_TRACING = not tracemalloc.is_tracing ()
+    if PROFILE_TRACING:
+        tracemalloc.start ()
+
+    # Replace every public routine with a profiled version.  Routines in
+    # this module look each other (and cv2) up by name when they are called,
+    # so they then call the profiled versions too.
+    names = globals ()
+    for name, value in list (names.items ()):
+        if isinstance (value, types.FunctionType) and \
+           value.__module__ == __name__ and not name.startswith ("_") \
+           and name not in NOT_PROFILED:
+            PROFILE_ORIGINALS[name] = value
+            names[name] = _profiled (value, "sxcv." + name)
+
+    # Much of the work is done by the methods of the classes, such as
+    # Lut.__call__ and the operators of PackedBinary, so they are replaced
+    # with profiled versions as well.
+    for name, value in list (names.items ()):
+        if isinstance (value, type) and value.__module__ == __name__ \
+           and not name.startswith ("_"):
+            for mname, method in list (vars (value).items ()):
+                if isinstance (method, types.FunctionType) and \
+                   (not mname.startswith ("_") or mname in PROFILED_OPERATORS):
+                    PROFILE_METHODS.append ((value, mname, method))
+                    setattr (value, mname, _profiled (method, "sxcv.%s.%s" %
+                                                      (name, mname)))
+    cv2 = _ProfiledModule (cv2)
+    atexit.register (_profile_exit)
+
+#-------------------------------------------------------------------------------
+def profile_off ():
+    """
+    Stop profiling, returning the records made.
+
+    Returns:
+        records (dict): for each routine name and image shape, the number
+                        of calls, their total time in seconds and the total
+                        number of bytes they allocated
+    """
+    global PROFILE, cv2
+    import tracemalloc, atexit
+
+    if PROFILE is None:
+        return {}
+    globals ().update (PROFILE_ORIGINALS)
+    for cls, name, method in PROFILE_METHODS:
+        setattr (cls, name, method)
+    cv2 = cv2.module
+    if PROFILE_TRACING:
+        tracemalloc.stop ()
+    atexit.unregister (_profile_exit)
+    records, PROFILE = PROFILE, None
+    return records
+
+#-------------------------------------------------------------------------------
+def profile_summary (records=None):
+    """
+    Return a summary of profiling records as a table, the routines that
+    took longest first.
+
+    Args:
+        records (dict): records returned by `profile_off`
+                        (default: those being made now)
+
+    Returns:
+        str: the summary
+    """
+    if records is None:
+        records = PROFILE or {}
+    lines = ["%-32s %-16s %7s %10s %10s %10s" % ("routine", "shape", "calls",
+             "total ms", "ms/call", "MB/call")]
+    for (name, shape), (n, t, b) in sorted (records.items (),
+                                            key=lambda r: -r[1][1]):
+        lines += ["%-32s %-16s %7d %10.3f %10.4f %10.3f" %
+                  (name, shape, n, t * 1000, t * 1000 / n, b / n / 1.0e6)]
+    return "\n".join (lines)
+
+#-------------------------------------------------------------------------------
+def _profile_exit ():
+    "Report the profiling results when the program exits."
+    records = PROFILE
+    if PROFILE_OUTPUT is None:
+        print (profile_summary (records), file=sys.stderr)
+    else:
+        import json
+        data = [{"routine": name, "shape": shape, "calls": n, "seconds": t,
+                 "seconds_per_call": t / n, "bytes": b, "bytes_per_call": b / n}
+                for (name, shape), (n, t, b) in records.items ()]
+        with open (PROFILE_OUTPUT, "w") as f:
+            json.dump (data, f, indent=1)
+
+#-------------------------------------------------------------------------------
+def _profiled (routine, name):
+    "Return a version of `routine` that records its calls under `name`."
+    @functools.wraps (routine)
+    def profiled (*args, **kwargs):
+        if PROFILE is None:
+            return routine (*args, **kwargs)
+        return _profile_call (routine, name, args, kwargs)
+    return profiled
+
+#-------------------------------------------------------------------------------
+def _profile_call (routine, name, args, kwargs):
+    "Call `routine`, recording its time and allocations under `name`."
+    import time, tracemalloc
+
+    # The peak memory use that tracemalloc records is reset for each call,
+    # so the peak seen so far by the calling routine is passed up to it via
+    # a stack of the calls in progress in this thread.
+    stack = getattr (PROFILE_STATE, "stack", None)
+    if stack is None:
+        stack = PROFILE_STATE.stack = []
+    used, peak = tracemalloc.get_traced_memory ()
+    if len (stack) > 0:
+        stack[-1] = max (stack[-1], peak)
+    stack.append (0)
+    tracemalloc.reset_peak ()
+    start = time.perf_counter ()
+    try:
+        return routine (*args, **kwargs)
+    finally:
+        t = time.perf_counter () - start
+        peak = max (tracemalloc.get_traced_memory ()[1], stack.pop ())
+        if len (stack) > 0:
+            stack[-1] = max (stack[-1], peak)
+        key = (name, _profile_shape (args))
+        with PROFILE_LOCK:
+            record = PROFILE.setdefault (key, [0, 0.0, 0])
+            record[0] += 1
+            record[1] += t
+            record[2] += max (0, peak - used)
+
+#-------------------------------------------------------------------------------
+def _profile_shape (args):
+    "Return the shape of the first image among `args`, as a string."
+    # The first argument of a method is the object itself, which is skipped
+    # unless it is a packed image.
+    for a in args:
+        if isinstance (a, (list, tuple)) and len (a) > 0:
+            a = a[0]
+        if isinstance (a, (numpy.ndarray, PackedBinary)):
+            return "x".join (str (n) for n in a.shape)
+    return "-"
+
+if _setting ("profile"):
+    profile_on (None if _setting ("profile") is True else _setting ("profile"))
 
-    return None     
-    
 #-------------------------------------------------------------------------------
 # EPILOGUE.
 #-------------------------------------------------------------------------------